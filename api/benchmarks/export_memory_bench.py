@@ -0,0 +1,107 @@
+"""Peak memory of the CSV export: streamed rows vs. the whole file buffered.
+
+Seeds a throwaway SQLite database with one completed task of ``--pages``
+pages, then measures (with tracemalloc) GET /export/csv/{task_id}, which
+streams one row at a time from batches of EXPORT_BATCH_SIZE pages, against
+the buffered export it replaced: every page loaded with ``load_task_result``
+and the whole CSV written into one StringIO before the response starts.
+
+    cd api && python benchmarks/export_memory_bench.py --pages 5000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+database_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(database_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+TASK_ID = 'export-bench'
+
+
+def seed(pages: int, headings: int, links: int):
+    with main.engine.begin() as connection:
+        connection.execute(main.tasks_table.insert().values(
+            id=TASK_ID, url='https://example.com/', status='completed', created_at=datetime.utcnow(),
+            completed_at=datetime.utcnow(), result=json.dumps({'pages_stored': True, 'total_pages': pages})
+        ))
+        for position in range(pages):
+            connection.execute(main.pages_table.insert().values(
+                task_id=TASK_ID, position=position, url=f'https://example.com/{position}', status_code=200,
+                title=f'Page {position}', description='d' * 300, content_length=5000,
+                scraped_at=datetime.utcnow().isoformat(), paragraphs=json.dumps(['p' * 200] * 20)
+            ))
+            connection.execute(main.page_headings_table.insert(), [
+                {'task_id': TASK_ID, 'page_position': position, 'position': i, 'level': 1, 'text': 'h' * 40}
+                for i in range(headings)
+            ])
+            connection.execute(main.page_links_table.insert(), [
+                {'task_id': TASK_ID, 'page_position': position, 'position': i,
+                 'url': f'https://example.com/{i}', 'text': 'link', 'internal': True}
+                for i in range(links)
+            ])
+
+
+async def buffered_export() -> int:
+    """The export as it was: all pages in memory, then the whole CSV in one buffer"""
+    task = await main.database.fetch_one(main.tasks_table.select().where(main.tasks_table.c.id == TASK_ID))
+    result = await main.load_task_result(task)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['URL', 'Title', 'Description', 'Headings', 'Paragraph_Count', 'Link_Count', 'Image_Count'])
+    for page in result.get('pages', []):
+        description = page.get('description') or ''
+        writer.writerow([
+            page.get('url', ''),
+            page.get('title', ''),
+            description[:100] + '...' if len(description) > 100 else description,
+            '; '.join(main.heading_text(h) for h in page.get('headings', []))[:200],
+            len(page.get('paragraphs', [])),
+            len(page.get('links', [])),
+            len(page.get('images', []))
+        ])
+    return len(output.getvalue().encode())
+
+
+def streamed_export(client) -> int:
+    with client.stream('GET', f'/export/csv/{TASK_ID}') as response:
+        response.raise_for_status()
+        return sum(len(chunk) for chunk in response.iter_bytes())
+
+
+def measure(name, export):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = export()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:10} {size / 1e6:7.1f} MB of CSV  peak={peak / 1e6:7.1f} MB  {elapsed:.2f}s")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=5000, help="pages in the exported task")
+    parser.add_argument('--headings', type=int, default=10, help="headings per page")
+    parser.add_argument('--links', type=int, default=50, help="links per page")
+    args = parser.parse_args()
+
+    print(f"Seeding {args.pages} pages ({args.headings} headings, {args.links} links each)...")
+    seed(args.pages, args.headings, args.links)
+    with TestClient(main.app) as client:
+        measure('streamed', lambda: streamed_export(client))
+        measure('buffered', lambda: client.portal.call(buffered_export))
+
+
+if __name__ == '__main__':
+    main_bench()
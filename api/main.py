@@ -8,10 +8,13 @@ import json
 import os
 from datetime import datetime
 import redis
+import redis.asyncio
 from celery import Celery
 import databases
 import sqlalchemy
-from sqlalchemy import create_engine, MetaData, Table, Column, String, DateTime, Text
+from sqlalchemy import create_engine, MetaData, Table, Column, String, DateTime, Text, Integer, Boolean, Index
+import base64
+import hashlib
 import re
 from collections import Counter
 from datetime import datetime, timedelta
@@ -35,11 +38,225 @@ tasks_table = Table(
     Column("completed_at", DateTime, nullable=True),
 )
 
+# Task listings walk these newest-first: (created_at, id) is the keyset, with
+# status in front for the per-status listing
+Index("ix_tasks_created_at_id", tasks_table.c.created_at, tasks_table.c.id)
+Index("ix_tasks_status_created_at_id", tasks_table.c.status, tasks_table.c.created_at, tasks_table.c.id)
+# Latest completed task for a URL (/compare)
+Index("ix_tasks_url_status_created_at", tasks_table.c.url, tasks_table.c.status, tasks_table.c.created_at)
+
+# Crawled pages, written by the worker one page at a time as the crawl runs.
+# Fields without a column of their own are kept in "extra" (JSON). "id" is
+# an INTEGER PRIMARY KEY, so on SQLite it is the row's stable rowid, which
+# the pages_fts search index is keyed on.
+pages_table = Table(
+    "pages",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("task_id", String, nullable=False),
+    Column("position", Integer, nullable=False),
+    Column("url", String, nullable=False),
+    Column("status_code", Integer, nullable=True),
+    Column("title", Text, nullable=True),
+    Column("description", Text, nullable=True),
+    Column("content_length", Integer, nullable=True),
+    Column("error", Text, nullable=True),
+    Column("scraped_at", String, nullable=True),
+    Column("paragraphs", Text, nullable=True),
+    Column("extra", Text, nullable=True),
+)
+
+Index("ux_pages_task_id_position", pages_table.c.task_id, pages_table.c.position, unique=True)
+
+page_links_table = Table(
+    "page_links",
+    metadata,
+    Column("task_id", String, primary_key=True),
+    Column("page_position", Integer, primary_key=True),
+    Column("position", Integer, primary_key=True),
+    Column("url", Text, nullable=False),
+    Column("text", Text, nullable=True),
+    Column("internal", Boolean, nullable=True),
+)
+
+# Per-task aggregates, written by the worker when a crawl completes so task
+# listings never have to open the result or the pages
+task_summaries_table = Table(
+    "task_summaries",
+    metadata,
+    Column("task_id", String, primary_key=True),
+    Column("total_pages", Integer, nullable=False, default=0),
+    Column("error_pages", Integer, nullable=False, default=0),
+    Column("total_links", Integer, nullable=False, default=0),
+    Column("total_images", Integer, nullable=False, default=0),
+    Column("total_content_size", Integer, nullable=False, default=0),
+    Column("depth_reached", Integer, nullable=True),
+)
+
+# Content analytics (the analyze_content report as JSON), computed by the
+# worker page by page and stored when the crawl completes
+task_analytics_table = Table(
+    "task_analytics",
+    metadata,
+    Column("task_id", String, primary_key=True),
+    Column("analytics", Text, nullable=False),
+    # Space-Saving keyword sketch ({"capacity", "items": {word: [count, error]}}),
+    # merged across tasks by /compare
+    Column("keyword_sketch", Text, nullable=True),
+    Column("computed_at", String, nullable=True),
+)
+
+# Running task counters: "status:<status>" per status and "<event>:<hour>"
+# buckets (created/completed/failed per UTC hour). The API and the worker bump
+# them in the same transaction as the task change they record.
+task_counters_table = Table(
+    "task_counters",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("value", Integer, nullable=False, default=0),
+)
+
+# Dashboard rollups, kept current as tasks are created (API) and finish
+# (worker); together with the task_counters they make /dashboard/advanced
+# independent of how many tasks exist
+daily_rollups_table = Table(
+    "daily_rollups",
+    metadata,
+    Column("day", String, primary_key=True),
+    Column("created", Integer, nullable=False, default=0),
+    Column("completed", Integer, nullable=False, default=0),
+    Column("failed", Integer, nullable=False, default=0),
+    Column("pages", Integer, nullable=False, default=0),
+    Column("content_size", Integer, nullable=False, default=0),
+)
+
+domain_rollups_table = Table(
+    "domain_rollups",
+    metadata,
+    Column("domain", String, primary_key=True),
+    Column("tasks", Integer, nullable=False, default=0),
+    Column("completed", Integer, nullable=False, default=0),
+    Column("pages", Integer, nullable=False, default=0),
+    Column("content_size", Integer, nullable=False, default=0),
+    Index("ix_domain_rollups_tasks", "tasks"),
+)
+
+page_headings_table = Table(
+    "page_headings",
+    metadata,
+    Column("task_id", String, primary_key=True),
+    Column("page_position", Integer, primary_key=True),
+    Column("position", Integer, primary_key=True),
+    Column("level", Integer, nullable=True),
+    Column("text", Text, nullable=True),
+)
+
 engine = create_engine(DATABASE_URL)
+
+def migrate_pages_table():
+    """Give a pages table from before pages.id its id column.
+    
+    The old table was keyed on (task_id, position) only. On SQLite it is
+    rebuilt, and the search index dropped so it is built again from the new
+    ids; elsewhere the column is added in place.
+    """
+    if not sqlalchemy.inspect(engine).has_table("pages"):
+        return
+    if "id" in {column["name"] for column in sqlalchemy.inspect(engine).get_columns("pages")}:
+        return
+    columns = ', '.join(column.name for column in pages_table.columns if column.name != "id")
+    with engine.begin() as conn:
+        if engine.dialect.name == 'sqlite':
+            conn.exec_driver_sql("ALTER TABLE pages RENAME TO pages_before_id")
+            pages_table.create(conn)
+            conn.exec_driver_sql(
+                f"INSERT INTO pages ({columns}) SELECT {columns} FROM pages_before_id ORDER BY task_id, position"
+            )
+            conn.exec_driver_sql("DROP TABLE pages_before_id")
+            conn.exec_driver_sql("DROP TABLE IF EXISTS pages_fts")
+        else:
+            conn.exec_driver_sql("ALTER TABLE pages DROP CONSTRAINT pages_pkey")
+            conn.exec_driver_sql("ALTER TABLE pages ADD COLUMN id SERIAL PRIMARY KEY")
+            for index in pages_table.indexes:
+                index.create(conn, checkfirst=True)
+
+migrate_pages_table()
 metadata.create_all(engine)
+# create_all skips tables that already exist, so add indexes introduced later
+for index in tasks_table.indexes:
+    index.create(engine, checkfirst=True)
+
+# Full-text search over crawled pages. On SQLite this is an FTS5 table whose
+# rowids are the pages' ids, filled in by the worker as each page is
+# stored; other databases (or SQLite builds without FTS5) fall back to LIKE.
+SEARCH_BACKFILL = """
+INSERT INTO pages_fts (rowid, title, content, links)
+SELECT p.id, p.title,
+       (SELECT group_concat(value, char(10)) FROM json_each(p.paragraphs)),
+       (SELECT group_concat(l.url || ' ' || coalesce(l.text, ''), char(10)) FROM page_links l
+        WHERE l.task_id = p.task_id AND l.page_position = p.position)
+FROM pages p WHERE p.error IS NULL
+"""
+
+def create_search_index() -> bool:
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as conn:
+            if conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'pages_fts'").first():
+                return True
+            conn.exec_driver_sql("CREATE VIRTUAL TABLE pages_fts USING fts5(title, content, links)")
+            # Index the pages stored before the search index existed
+            conn.exec_driver_sql(SEARCH_BACKFILL)
+        return True
+    except Exception as e:
+        print(f"Full-text search index unavailable, falling back to LIKE search: {e}")
+        return False
+
+SEARCH_FTS = create_search_index()
+# Search type -> FTS column it is limited to, and the bm25 weight of each column
+SEARCH_TYPES = {'all': None, 'title': 'title', 'content': 'content', 'links': 'links'}
+SEARCH_WEIGHTS = (10.0, 1.0, 2.0)
+
+# How long a cached task count (count=cached) may be served
+TASK_COUNT_CACHE_TTL = int(os.getenv("TASK_COUNT_CACHE_TTL", "30"))
+COUNT_MODES = ['exact', 'cached', 'none']
+
+# Pages read per query by the streaming exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "200"))
+# Excel exports size their columns from this many rows; Excel and Parquet
+# exports stay in memory up to EXCEL_SPOOL_BYTES before spilling to a temporary file
+EXCEL_WIDTH_SAMPLE_ROWS = 500
+EXCEL_SPOOL_BYTES = int(os.getenv("EXCEL_SPOOL_BYTES", str(16 * 1024 * 1024)))
+
+TASK_STATUSES = ['pending', 'running', 'completed', 'failed']
+ACTIVITY_EVENTS = ['created', 'completed', 'failed']
+# Hourly buckets older than this are dropped whenever the counters are written
+# (and by the reconciliation); /stats only reads the last 24
+ACTIVITY_RETENTION_HOURS = int(os.getenv("ACTIVITY_RETENTION_HOURS", "24"))
+# Responses of finished tasks never change, so they are cached in Redis (as
+# one hash per task, dropped on delete and by the worker's status updates) and
+# served with ETags; bodies above RESPONSE_CACHE_MAX_BYTES only get the ETag
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(1024 * 1024)))
+TERMINAL_STATUSES = ('completed', 'failed')
+
+# Dashboard payload cache and how many days of time series it shows
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+DASHBOARD_DAYS = 30
+COUNTER_UPSERT = (
+    "INSERT INTO task_counters (name, value) VALUES (:name, :delta) "
+    "ON CONFLICT (name) DO UPDATE SET value = task_counters.value + excluded.value"
+)
+
+# Progress streams: the worker publishes each task's events on task_events:{id};
+# idle streams get a keep-alive comment every TASK_EVENTS_KEEPALIVE seconds
+TASK_EVENTS_KEEPALIVE = float(os.getenv("TASK_EVENTS_KEEPALIVE", "15"))
 
 # Redis setup
 redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+# Pub/sub subscribers wait on the event loop, so they get an async client
+async_redis_client = redis.asyncio.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
 
 # Celery setup
 celery_app = Celery(
@@ -69,6 +286,9 @@ class CrawlRequest(BaseModel):
     url: HttpUrl
     depth: Optional[int] = 1
     max_pages: Optional[int] = 10
+    # Re-crawl against this task, or (incremental) the last completed crawl of the same URL
+    previous_task_id: Optional[str] = None
+    incremental: Optional[bool] = True
 
 class TaskResponse(BaseModel):
     id: str
@@ -83,6 +303,10 @@ class TaskResponse(BaseModel):
 @app.on_event("startup")
 async def startup():
     await database.connect()
+    # First start on an existing database: build the counters and rollups once from tasks
+    if (await database.fetch_val("SELECT COUNT(*) FROM task_counters") == 0 or
+            await database.fetch_val("SELECT COUNT(*) FROM daily_rollups") == 0):
+        await rebuild_task_counters()
 
 @app.on_event("shutdown")
 async def shutdown():
@@ -100,44 +324,48 @@ async def root():
 @app.post("/crawl")
 async def create_crawl_task(request: CrawlRequest):
     task_id = str(uuid.uuid4())
+    previous_task_id = await resolve_previous_task(str(request.url), request.previous_task_id, request.incremental)
     
     # Save task to database
+    created_at = datetime.utcnow()
     query = tasks_table.insert().values(
         id=task_id,
         url=str(request.url),
         status="pending",
-        created_at=datetime.utcnow()
+        created_at=created_at
     )
-    await database.execute(query)
+    async with database.transaction():
+        await database.execute(query)
+        await record_task_created(str(request.url), created_at)
     
     # Send task to Celery worker
     celery_app.send_task(
         "worker.crawl_url",
-        args=[task_id, str(request.url), request.depth, request.max_pages]
+        args=[task_id, str(request.url), request.depth, request.max_pages, previous_task_id]
     )
     
     return {
         "task_id": task_id,
         "status": "pending",
+        "previous_task_id": previous_task_id,
         "message": "Crawl task created successfully"
     }
 
 @app.get("/tasks/{task_id}")
-async def get_task_status(task_id: str):
+async def get_task_status(task_id: str, request: Request):
+    cached = cached_response(request, task_id, "task", "application/json")
+    if cached:
+        return cached
+    
     query = tasks_table.select().where(tasks_table.c.id == task_id)
     task = await database.fetch_one(query)
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    result = None
-    if task.result:
-        try:
-            result = json.loads(task.result)
-        except:
-            result = {"raw": task.result}
+    result = await load_task_result(task)
     
-    return {
+    body = json_body({
         "id": task.id,
         "url": task.url,
         "status": task.status,
@@ -145,38 +373,92 @@ async def get_task_status(task_id: str):
         "error": task.error,
         "created_at": task.created_at,
         "completed_at": task.completed_at
-    }
+    })
+    return caching_response(request, task, "task", body, "application/json")
+
+@app.get("/tasks/{task_id}/pages")
+async def get_task_pages(task_id: str, limit: int = 50, offset: int = 0):
+    """Page through a task's crawled pages without loading the whole result"""
+    limit = max(1, min(limit, 500))
+    query = tasks_table.select().where(tasks_table.c.id == task_id)
+    task = await database.fetch_one(query)
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    result = parse_task_result(task) or {}
+    if 'pages' in result:
+        # Older tasks keep their pages inside the result blob
+        all_pages = result['pages']
+        pages = all_pages[offset:offset + limit]
+        total = len(all_pages)
+    else:
+        # Also covers running tasks, whose pages are written as they are crawled
+        pages = await load_task_pages(task_id, limit, offset)
+        total = result.get('total_pages')
+        if total is None:
+            count_query = sqlalchemy.select(sqlalchemy.func.count()).select_from(pages_table).where(pages_table.c.task_id == task_id)
+            total = await database.fetch_val(count_query)
+    
+    return {"task_id": task_id, "pages": pages, "total": total, "limit": limit, "offset": offset}
+
+@app.get("/tasks/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request):
+    """Server-Sent Events stream of a task's progress, pushed by the worker through Redis"""
+    from fastapi.responses import StreamingResponse
+    
+    pubsub = async_redis_client.pubsub()
+    # Subscribe before reading the snapshot so no event falls in between
+    await pubsub.subscribe(task_events_channel(task_id))
+    try:
+        snapshot = await task_status_snapshot(task_id)
+    except Exception:
+        await close_pubsub(pubsub)
+        raise
+    if snapshot is None:
+        await close_pubsub(pubsub)
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    async def generate():
+        try:
+            yield sse_event("status", snapshot)
+            if snapshot["status"] in TERMINAL_STATUSES:
+                return
+            while not await request.is_disconnected():
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=TASK_EVENTS_KEEPALIVE)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = json.loads(message["data"])
+                yield sse_event(event.get("type", "message"), event)
+                if event.get("type") == "status" and event.get("status") in TERMINAL_STATUSES:
+                    return
+        finally:
+            await close_pubsub(pubsub)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/tasks")
-async def list_tasks(limit: int = 20, offset: int = 0):
+async def list_tasks(limit: int = 20, offset: int = 0, fields: Optional[str] = None, summary: bool = False,
+                     cursor: Optional[str] = None, count: str = "exact"):
+    """List tasks; ``summary=true`` or ``fields=id,url,...`` skip loading full results.
+    
+    Pass the returned ``next_cursor`` back as ``cursor`` to page without OFFSET;
+    ``count=cached`` or ``count=none`` avoid counting every task on each call.
+    """
+    task_fields = parse_task_fields(fields, summary)
+    
     # Get total count
-    count_query = "SELECT COUNT(*) FROM tasks"
-    total = await database.fetch_val(count_query)
+    total = await count_tasks(None, count)
     
     # Get tasks
-    query = tasks_table.select().order_by(tasks_table.c.created_at.desc()).limit(limit).offset(offset)
-    tasks = await database.fetch_all(query)
-    
-    task_responses = []
-    for task in tasks:
-        result = None
-        if task.result:
-            try:
-                result = json.loads(task.result)
-            except:
-                result = {"raw": task.result}
-        
-        task_responses.append({
-            "id": task.id,
-            "url": task.url,
-            "status": task.status,
-            "result": result,
-            "error": task.error,
-            "created_at": task.created_at,
-            "completed_at": task.completed_at
-        })
+    task_responses, next_cursor = await fetch_task_list(None, limit, offset, task_fields, cursor)
     
-    return {"tasks": task_responses, "total": total}
+    return {"tasks": task_responses, "total": total, "next_cursor": next_cursor}
 
 @app.get("/health")
 async def health_check():
@@ -202,7 +484,7 @@ async def health_check():
 # New features added!
 
 @app.get("/export/csv/{task_id}")
-async def export_task_csv(task_id: str):
+async def export_task_csv(task_id: str, request: Request):
     from fastapi.responses import StreamingResponse
     import csv
     import io
@@ -216,47 +498,50 @@ async def export_task_csv(task_id: str):
     if not task.result:
         raise HTTPException(status_code=400, detail="Task has no results to export")
     
-    try:
-        result = json.loads(task.result)
-    except:
+    if 'raw' in parse_task_result(task):
         raise HTTPException(status_code=400, detail="Invalid task result format")
     
-    # Create CSV content
+    etag = export_etag([task], "csv")
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
+    
+    # Rows are written to the response one at a time as pages are read
     output = io.StringIO()
     writer = csv.writer(output)
     
-    # Headers
-    writer.writerow(['URL', 'Title', 'Description', 'Headings', 'Paragraph_Count', 'Link_Count', 'Image_Count'])
-    
-    # Data rows
-    for page in result.get('pages', []):
-        writer.writerow([
-            page.get('url', ''),
-            page.get('title', ''),
-            page.get('description', '')[:100] + '...' if len(page.get('description', '')) > 100 else page.get('description', ''),
-            '; '.join(page.get('headings', []))[:200],
-            len(page.get('paragraphs', [])),
-            len(page.get('links', [])),
-            len(page.get('images', []))
-        ])
+    def csv_line(row) -> str:
+        output.seek(0)
+        output.truncate()
+        writer.writerow(row)
+        return output.getvalue()
     
-    output.seek(0)
-    
-    def iter_csv():
-        yield output.getvalue()
+    async def iter_csv():
+        # Headers
+        yield csv_line(['URL', 'Title', 'Description', 'Headings', 'Paragraph_Count', 'Link_Count', 'Image_Count'])
+        
+        # Data rows
+        async for page in iter_task_pages(task):
+            description = page.get('description') or ''
+            yield csv_line([
+                page.get('url', ''),
+                page.get('title', ''),
+                description[:100] + '...' if len(description) > 100 else description,
+                '; '.join(heading_text(h) for h in page.get('headings', []))[:200],
+                len(page.get('paragraphs', [])),
+                len(page.get('links', [])),
+                len(page.get('images', []))
+            ])
     
     return StreamingResponse(
         iter_csv(),
         media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=crawl_results_{task_id}.csv"}
+        headers=etag_headers(etag, {"Content-Disposition": f"attachment; filename=crawl_results_{task_id}.csv"})
     )
 
 @app.get("/export/excel/{task_id}")
-async def export_task_excel(task_id: str):
+async def export_task_excel(task_id: str, request: Request):
     from fastapi.responses import StreamingResponse
-    import io
-    import json
-    from datetime import datetime
+    import tempfile
     
     query = tasks_table.select().where(tasks_table.c.id == task_id)
     task = await database.fetch_one(query)
@@ -267,20 +552,30 @@ async def export_task_excel(task_id: str):
     if not task.result:
         raise HTTPException(status_code=400, detail="Task has no results to export")
     
-    try:
-        result = json.loads(task.result)
-    except:
+    if 'raw' in parse_task_result(task):
         raise HTTPException(status_code=400, detail="Invalid task result format")
     
-    # Create Excel content using openpyxl
+    etag = export_etag([task], "excel")
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
+    
     try:
         from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
         from openpyxl.styles import Font, Alignment, PatternFill
         from openpyxl.utils import get_column_letter
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Crawl Results"
+    except ImportError:
+        # Fallback to CSV if openpyxl not available
+        raise HTTPException(status_code=501, detail="Excel export requires openpyxl. Use CSV export instead.")
+    
+    # Create Excel content with a write-only workbook: rows go straight to
+    # openpyxl's temp file instead of being kept as cells in memory. The
+    # workbook is saved into memory, moving to a temporary file once it gets large
+    excel_file = tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_BYTES)
+    try:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Crawl Results")
+        loop = asyncio.get_running_loop()
         
         # Headers with styling
         headers = ['URL', 'Title', 'Description', 'Headings', 'Paragraphs', 'Links', 'Images', 'Content Size', 'Crawled At']
@@ -288,94 +583,119 @@ async def export_task_excel(task_id: str):
         header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
         header_alignment = Alignment(horizontal="center", vertical="center")
         
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
+        header_row = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
             cell.font = header_font
             cell.fill = header_fill
             cell.alignment = header_alignment
+            header_row.append(cell)
+        
+        def page_row(page) -> list:
+            description = page.get('description') or ''
+            return [
+                page.get('url', ''),
+                page.get('title', ''),
+                description[:200] + '...' if len(description) > 200 else description,
+                '; '.join(heading_text(h) for h in page.get('headings', []))[:300],
+                len(page.get('paragraphs', [])),
+                len(page.get('links', [])),
+                len(page.get('images', [])),
+                page.get('content_length', 0),
+                page.get('scraped_at', '')
+            ]
+        
+        # Column widths must be set before the first row is written, so they
+        # are estimated from the header and the first EXCEL_WIDTH_SAMPLE_ROWS rows
+        widths = [len(header) for header in headers]
+        pending = [header_row]
+        sized = False
+        
+        def set_widths():
+            for col, width in enumerate(widths, 1):
+                ws.column_dimensions[get_column_letter(col)].width = min(width + 2, 50)
+        
+        def append_rows(rows):
+            for row in rows:
+                ws.append(row)
         
         # Data rows
-        for row, page in enumerate(result.get('pages', []), 2):
-            ws.cell(row=row, column=1, value=page.get('url', ''))
-            ws.cell(row=row, column=2, value=page.get('title', ''))
-            ws.cell(row=row, column=3, value=page.get('description', '')[:200] + '...' if len(page.get('description', '')) > 200 else page.get('description', ''))
-            ws.cell(row=row, column=4, value='; '.join(page.get('headings', []))[:300])
-            ws.cell(row=row, column=5, value=len(page.get('paragraphs', [])))
-            ws.cell(row=row, column=6, value=len(page.get('links', [])))
-            ws.cell(row=row, column=7, value=len(page.get('images', [])))
-            ws.cell(row=row, column=8, value=page.get('content_length', 0))
-            ws.cell(row=row, column=9, value=page.get('scraped_at', ''))
-        
-        # Auto-adjust column widths
-        for col in range(1, len(headers) + 1):
-            column_letter = get_column_letter(col)
-            max_length = 0
-            for row in ws[column_letter]:
-                try:
-                    if len(str(row.value)) > max_length:
-                        max_length = len(str(row.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Save to BytesIO
-        excel_buffer = io.BytesIO()
-        wb.save(excel_buffer)
-        excel_buffer.seek(0)
-        
-        def iter_excel():
-            yield excel_buffer.getvalue()
-        
-        return StreamingResponse(
-            iter_excel(),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename=crawl_results_{task_id}.xlsx"}
-        )
+        async for page in iter_task_pages(task):
+            row = page_row(page)
+            pending.append(row)
+            if not sized:
+                widths = [max(width, len(str(value))) for width, value in zip(widths, row)]
+                if len(pending) > EXCEL_WIDTH_SAMPLE_ROWS:
+                    set_widths()
+                    sized = True
+            if sized and len(pending) >= EXPORT_BATCH_SIZE:
+                await loop.run_in_executor(None, append_rows, pending)
+                pending = []
+        if not sized:
+            set_widths()
+        await loop.run_in_executor(None, append_rows, pending)
         
-    except ImportError:
-        # Fallback to CSV if openpyxl not available
-        raise HTTPException(status_code=501, detail="Excel export requires openpyxl. Use CSV export instead.")
+        await loop.run_in_executor(None, wb.save, excel_file)
+        excel_file.seek(0)
     except Exception as e:
+        excel_file.close()
         raise HTTPException(status_code=500, detail=f"Excel export failed: {str(e)}")
+    
+    return StreamingResponse(
+        iter_file(excel_file),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=etag_headers(etag, {"Content-Disposition": f"attachment; filename=crawl_results_{task_id}.xlsx"})
+    )
+
+PARQUET_COMPRESSIONS = ['zstd', 'snappy', 'gzip', 'brotli', 'none']
+
+@app.get("/export/parquet/{task_id}")
+async def export_task_parquet(task_id: str, request: Request, compression: str = "zstd"):
+    """Export a task's pages as a typed, compressed Parquet file"""
+    return await parquet_response(request, [task_id], compression, f"crawl_results_{task_id}.parquet")
+
+@app.get("/export/parquet")
+async def export_tasks_parquet(task_ids: str, request: Request, compression: str = "zstd"):
+    """Export the pages of several tasks (comma-separated ids) into one Parquet file"""
+    ids = list(dict.fromkeys(task_id.strip() for task_id in task_ids.split(',') if task_id.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No task ids given")
+    if len(ids) > 50:
+        raise HTTPException(status_code=400, detail="Maximum 50 tasks per export")
+    return await parquet_response(request, ids, compression, "crawl_results.parquet")
 
 @app.get("/tasks/filter/{status}")
-async def filter_tasks_by_status(status: str, limit: int = 20):
+async def filter_tasks_by_status(status: str, limit: int = 20, fields: Optional[str] = None, summary: bool = False,
+                                 cursor: Optional[str] = None):
     """Filter tasks by status: pending, running, completed, failed"""
     valid_statuses = ['pending', 'running', 'completed', 'failed']
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Invalid status. Use: {', '.join(valid_statuses)}")
     
-    query = tasks_table.select().where(tasks_table.c.status == status).order_by(tasks_table.c.created_at.desc()).limit(limit)
-    tasks = await database.fetch_all(query)
-    
-    task_responses = []
-    for task in tasks:
-        result = None
-        if task.result:
-            try:
-                result = json.loads(task.result)
-                # Add summary stats
-                if 'pages' in result:
+    task_fields = parse_task_fields(fields, summary)
+    # Full results carry their summary stats inside result, as they always have
+    inline_summary = 'result' in task_fields and 'summary' not in task_fields
+    if inline_summary:
+        task_fields = task_fields + ['summary']
+    
+    task_responses, next_cursor = await fetch_task_list(tasks_table.c.status == status, limit, 0, task_fields, cursor)
+    
+    if inline_summary:
+        for task in task_responses:
+            stored = task.pop('summary')
+            result = task['result']
+            # Add summary stats
+            if result and 'pages' in result:
+                if stored:
+                    result['summary'] = {key: stored[key] for key in ('total_pages', 'total_links', 'total_images')}
+                else:
                     result['summary'] = {
                         'total_pages': len(result['pages']),
                         'total_links': sum(len(page.get('links', [])) for page in result['pages']),
                         'total_images': sum(len(page.get('images', [])) for page in result['pages'])
                     }
-            except:
-                result = {"raw": task.result}
-        
-        task_responses.append({
-            "id": task.id,
-            "url": task.url,
-            "status": task.status,
-            "result": result,
-            "error": task.error,
-            "created_at": task.created_at,
-            "completed_at": task.completed_at
-        })
     
-    return {"tasks": task_responses, "status_filter": status, "count": len(task_responses)}
+    return {"tasks": task_responses, "status_filter": status, "count": len(task_responses), "next_cursor": next_cursor}
 
 @app.delete("/tasks/{task_id}")
 async def delete_task(task_id: str):
@@ -386,13 +706,28 @@ async def delete_task(task_id: str):
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    delete_query = tasks_table.delete().where(tasks_table.c.id == task_id)
-    await database.execute(delete_query)
+    async with database.transaction():
+        # Before the summary row goes, since the rollups need its totals
+        await record_task_deleted(task)
+        # The task row first: a worker still writing pages holds it until it
+        # commits, so whatever it wrote is visible to the deletes below
+        delete_query = tasks_table.delete().where(tasks_table.c.id == task_id)
+        await database.execute(delete_query)
+        if SEARCH_FTS:
+            await database.execute(
+                query="DELETE FROM pages_fts WHERE rowid IN (SELECT id FROM pages WHERE task_id = :task_id)",
+                values={"task_id": task_id}
+            )
+        for table in (page_links_table, page_headings_table, pages_table, task_summaries_table, task_analytics_table):
+            await database.execute(table.delete().where(table.c.task_id == task_id))
+    # Only once the rows are gone, or a read racing the delete could cache them again
+    forget_cached_responses(task_id)
     
     return {"message": f"Task {task_id} deleted successfully"}
 
 @app.post("/batch/crawl")
-async def batch_crawl(urls: List[str], depth: Optional[int] = 1, max_pages: Optional[int] = 5):
+async def batch_crawl(urls: List[str], depth: Optional[int] = 1, max_pages: Optional[int] = 5,
+                      incremental: bool = True):
     """Create multiple crawl tasks at once"""
     if len(urls) > 10:
         raise HTTPException(status_code=400, detail="Maximum 10 URLs per batch")
@@ -400,26 +735,31 @@ async def batch_crawl(urls: List[str], depth: Optional[int] = 1, max_pages: Opti
     tasks = []
     for url in urls:
         task_id = str(uuid.uuid4())
+        previous_task_id = await resolve_previous_task(url, None, incremental)
         
         # Save task to database
+        created_at = datetime.utcnow()
         query = tasks_table.insert().values(
             id=task_id,
             url=url,
             status="pending",
-            created_at=datetime.utcnow()
+            created_at=created_at
         )
-        await database.execute(query)
+        async with database.transaction():
+            await database.execute(query)
+            await record_task_created(url, created_at)
         
         # Send task to Celery worker
         celery_app.send_task(
             "worker.crawl_url",
-            args=[task_id, url, depth, max_pages]
+            args=[task_id, url, depth, max_pages, previous_task_id]
         )
         
         tasks.append({
             "task_id": task_id,
             "url": url,
-            "status": "pending"
+            "status": "pending",
+            "previous_task_id": previous_task_id
         })
     
     return {
@@ -428,46 +768,60 @@ async def batch_crawl(urls: List[str], depth: Optional[int] = 1, max_pages: Opti
     }
 
 @app.get("/stats")
-async def get_system_stats():
-    """Get system statistics"""
-    # Count tasks by status
-    stats = {}
-    for status in ['pending', 'running', 'completed', 'failed']:
-        count_query = f"SELECT COUNT(*) FROM tasks WHERE status = '{status}'"
-        count = await database.fetch_val(count_query)
-        stats[f"{status}_tasks"] = count
+async def get_system_stats(source: str = "counters"):
+    """Get system statistics from the task counters, or ``source=query`` to count the tasks table"""
+    if source not in ('counters', 'query'):
+        raise HTTPException(status_code=400, detail="Invalid source. Use: counters, query")
+    if source == "query":
+        return await query_system_stats()
     
-    # Total tasks
-    total_query = "SELECT COUNT(*) FROM tasks"
-    stats['total_tasks'] = await database.fetch_val(total_query)
+    # One lookup of the status counters and the last 24 hourly buckets
+    now = datetime.utcnow()
+    hours = [hour_bucket(now - timedelta(hours=i)) for i in range(24)]
+    names = [f"status:{status}" for status in TASK_STATUSES]
+    names += [f"{event}:{hour}" for event in ACTIVITY_EVENTS for hour in hours]
+    query = task_counters_table.select().where(task_counters_table.c.name.in_(names))
+    counters = {row.name: row.value for row in await database.fetch_all(query)}
     
-    # Recent activity (last 24 hours)
-    recent_query = "SELECT COUNT(*) FROM tasks WHERE created_at > datetime('now', '-1 day')"
-    try:
-        stats['tasks_last_24h'] = await database.fetch_val(recent_query)
-    except:
-        stats['tasks_last_24h'] = 0
+    stats = {}
+    for status in TASK_STATUSES:
+        stats[f"{status}_tasks"] = counters.get(f"status:{status}", 0)
+    stats['total_tasks'] = sum(stats[f"{status}_tasks"] for status in TASK_STATUSES)
+    
+    # Recent activity (last 24 hours, in whole hours)
+    stats['tasks_last_24h'] = sum(counters.get(f"created:{hour}", 0) for hour in hours)
+    stats['completed_last_24h'] = sum(counters.get(f"completed:{hour}", 0) for hour in hours)
+    stats['failed_last_24h'] = sum(counters.get(f"failed:{hour}", 0) for hour in hours)
     
     return stats
 
+@app.post("/stats/reconcile")
+async def reconcile_stats():
+    """Rebuild the task counters from the tasks table"""
+    counters = await rebuild_task_counters()
+    return {"message": "Task counters rebuilt", "counters": len(counters)}
+
 @app.get("/analytics/{task_id}")
 async def get_task_analytics(task_id: str):
     """Phân tích nội dung chi tiết của task"""
     try:
-        task = database.get_task(task_id)
+        query = tasks_table.select().where(tasks_table.c.id == task_id)
+        task = await database.fetch_one(query)
         if not task:
             raise HTTPException(status_code=404, detail="Task not found")
         
-        if not task.get('data'):
+        analytics, generated_at = await load_task_analytics(task)
+        if not analytics:
             return {"error": "No data to analyze"}
         
-        analytics = analyze_content(task['data'])
         return {
             "task_id": task_id,
-            "status": task['status'],
+            "status": task.status,
             "analytics": analytics,
-            "generated_at": datetime.now().isoformat()
+            "generated_at": generated_at
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -480,80 +834,94 @@ async def compare_websites(urls: str):
             raise HTTPException(status_code=400, detail="Need at least 2 URLs to compare")
         
         comparison = {}
+        compared_task_ids = []
         for url in url_list:
             # Tìm task mới nhất cho URL này
-            tasks = database.get_all_tasks()
-            latest_task = None
-            for task in tasks:
-                if task.get('url') == url and task.get('status') == 'completed':
-                    if not latest_task or task.get('created_at', '') > latest_task.get('created_at', ''):
-                        latest_task = task
+            query = tasks_table.select().where(
+                (tasks_table.c.url == url) & (tasks_table.c.status == 'completed')
+            ).order_by(tasks_table.c.created_at.desc()).limit(1)
+            latest_task = await database.fetch_one(query)
             
-            if latest_task and latest_task.get('data'):
-                comparison[url] = analyze_content(latest_task['data'])
+            analytics = (await load_task_analytics(latest_task))[0] if latest_task else None
+            if analytics:
+                comparison[url] = analytics
+                compared_task_ids.append(latest_task.id)
             else:
                 comparison[url] = {"error": "No data found for this URL"}
         
+        summary = generate_comparison_summary(comparison)
+        # Keywords across all compared sites, from the stored sketches
+        if compared_task_ids:
+            summary["top_keywords"] = sketch_top(merge_keyword_sketches(await load_keyword_sketches(compared_task_ids)))
+        
         return {
             "comparison": comparison,
-            "summary": generate_comparison_summary(comparison)
+            "summary": summary
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/search")
 async def search_content(request: dict):
     """Tìm kiếm trong dữ liệu đã crawl"""
+    keyword = str(request.get('keyword', '')).strip()
+    search_type = request.get('type', 'all')  # all, title, content, links
+    task_id = request.get('task_id')
+    
+    if not keyword:
+        raise HTTPException(status_code=400, detail="Keyword is required")
+    if search_type not in SEARCH_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid type. Use: {', '.join(SEARCH_TYPES)}")
     try:
-        keyword = request.get('keyword', '').lower()
-        search_type = request.get('type', 'all')  # all, title, content, links
-        
-        if not keyword:
-            raise HTTPException(status_code=400, detail="Keyword is required")
-        
-        tasks = database.get_all_tasks()
-        results = []
-        
-        for task in tasks:
-            if task.get('status') != 'completed' or not task.get('data'):
-                continue
-                
-            matches = search_in_task(task, keyword, search_type)
-            if matches:
-                results.append({
-                    "task_id": task['id'],
-                    "url": task.get('url'),
-                    "crawled_at": task.get('created_at'),
-                    "matches": matches
-                })
-        
-        return {
-            "keyword": keyword,
-            "search_type": search_type,
-            "total_results": len(results),
-            "results": results[:50]  # Limit to 50 results
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        limit = max(1, min(int(request.get('limit', 20)), 100))
+        offset = max(0, int(request.get('offset', 0)))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limit and offset must be integers")
+    
+    if SEARCH_FTS:
+        total, results = await search_pages_fts(keyword, search_type, task_id, limit, offset)
+    else:
+        total, results = await search_pages_like(keyword, search_type, task_id, limit, offset)
+    
+    return {
+        "keyword": keyword,
+        "search_type": search_type,
+        "total_results": total,
+        "results": results,
+        "limit": limit,
+        "offset": offset
+    }
 
 @app.get("/export/json/{task_id}")
-async def export_json(task_id: str):
+async def export_json(task_id: str, request: Request):
     """Xuất dữ liệu dạng JSON"""
+    headers = {"Content-Disposition": f"attachment; filename=crawl_data_{task_id}.json"}
     try:
-        task = database.get_task(task_id)
+        cached = cached_response(request, task_id, "export_json", "application/json", headers)
+        if cached:
+            return cached
+        
+        query = tasks_table.select().where(tasks_table.c.id == task_id)
+        task = await database.fetch_one(query)
         if not task:
             raise HTTPException(status_code=404, detail="Task not found")
         
+        result = await load_task_result(task) or {}
+        pages = result.get('pages', [])
+        analytics = (await load_task_analytics(task, pages))[0] if pages else None
+        
         export_data = {
             "task_info": {
                 "id": task_id,
-                "url": task.get('url'),
-                "status": task.get('status'),
-                "created_at": task.get('created_at'),
-                "completed_at": task.get('completed_at')
+                "url": task.url,
+                "status": task.status,
+                "created_at": task.created_at.isoformat() if task.created_at else None,
+                "completed_at": task.completed_at.isoformat() if task.completed_at else None
             },
-            "crawl_data": task.get('data', []),
-            "analytics": analyze_content(task.get('data', [])) if task.get('data') else None,
+            "crawl_data": pages,
+            "analytics": analytics,
             "export_info": {
                 "exported_at": datetime.now().isoformat(),
                 "format": "json",
@@ -561,11 +929,10 @@ async def export_json(task_id: str):
             }
         }
         
-        return Response(
-            content=json.dumps(export_data, indent=2, ensure_ascii=False),
-            media_type="application/json",
-            headers={"Content-Disposition": f"attachment; filename=crawl_data_{task_id}.json"}
-        )
+        body = json.dumps(export_data, indent=2, ensure_ascii=False).encode()
+        return caching_response(request, task, "export_json", body, "application/json", headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -573,68 +940,704 @@ async def export_json(task_id: str):
 async def get_advanced_dashboard():
     """Dashboard nâng cao với thống kê chi tiết"""
     try:
-        tasks = database.get_all_tasks()
-        
-        # Thống kê theo thời gian
-        time_stats = {}
-        domain_stats = {}
-        status_stats = {"pending": 0, "running": 0, "completed": 0, "failed": 0}
-        content_stats = {"total_pages": 0, "total_content_size": 0, "avg_content_size": 0}
-        
-        for task in tasks:
-            # Thống kê trạng thái
-            status = task.get('status', 'unknown')
-            status_stats[status] = status_stats.get(status, 0) + 1
-            
-            # Thống kê theo domain
-            url = task.get('url', '')
-            if url:
-                try:
-                    from urllib.parse import urlparse
-                    domain = urlparse(url).netloc
-                    domain_stats[domain] = domain_stats.get(domain, 0) + 1
-                except:
-                    pass
-            
-            # Thống kê nội dung
-            data = task.get('data', [])
-            if data:
-                content_stats["total_pages"] += len(data)
-                for page in data:
-                    size = page.get('content_size', 0)
-                    if isinstance(size, (int, float)):
-                        content_stats["total_content_size"] += size
-            
-            # Thống kê theo thời gian
-            created_at = task.get('created_at', '')
-            if created_at:
-                try:
-                    date_key = created_at[:10]  # YYYY-MM-DD
-                    time_stats[date_key] = time_stats.get(date_key, 0) + 1
-                except:
-                    pass
+        # Cùng một payload cho mọi client trong DASHBOARD_CACHE_TTL giây
+        try:
+            cached = redis_client.get("dashboard:advanced")
+            if cached is not None:
+                return json.loads(cached)
+        except Exception as e:
+            print(f"Dashboard cache unavailable: {e}")
+        
+        # Thống kê trạng thái và nội dung từ task_counters
+        names = [f"status:{status}" for status in TASK_STATUSES] + ["pages", "content_size"]
+        query = task_counters_table.select().where(task_counters_table.c.name.in_(names))
+        counters = {row.name: row.value for row in await database.fetch_all(query)}
+        status_stats = {status: counters.get(f"status:{status}", 0) for status in TASK_STATUSES}
+        content_stats = {
+            "total_pages": counters.get("pages", 0),
+            "total_content_size": counters.get("content_size", 0),
+            "avg_content_size": 0
+        }
         
         # Tính trung bình
         if content_stats["total_pages"] > 0:
             content_stats["avg_content_size"] = content_stats["total_content_size"] / content_stats["total_pages"]
         
+        # Thống kê theo thời gian (số task tạo mỗi ngày, DASHBOARD_DAYS ngày gần nhất)
+        first_day = (datetime.utcnow() - timedelta(days=DASHBOARD_DAYS - 1)).strftime('%Y-%m-%d')
+        query = daily_rollups_table.select().where(
+            (daily_rollups_table.c.day >= first_day) & (daily_rollups_table.c.created > 0)
+        ).order_by(daily_rollups_table.c.day)
+        time_stats = {row.day: row.created for row in await database.fetch_all(query)}
+        
         # Top domains
-        top_domains = sorted(domain_stats.items(), key=lambda x: x[1], reverse=True)[:10]
+        query = domain_rollups_table.select().where(domain_rollups_table.c.tasks > 0).order_by(
+            domain_rollups_table.c.tasks.desc()
+        ).limit(10)
+        top_domains = [(row.domain, row.tasks) for row in await database.fetch_all(query)]
         
-        return {
+        dashboard = {
             "summary": {
-                "total_tasks": len(tasks),
+                "total_tasks": sum(status_stats.values()),
                 "status_breakdown": status_stats,
                 "content_stats": content_stats
             },
-            "time_series": dict(sorted(time_stats.items())),
+            "time_series": time_stats,
             "top_domains": top_domains,
             "generated_at": datetime.now().isoformat()
         }
+        try:
+            redis_client.setex("dashboard:advanced", DASHBOARD_CACHE_TTL, json.dumps(dashboard))
+        except Exception:
+            pass
+        return dashboard
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Helper functions
+async def resolve_previous_task(url: str, previous_task_id: Optional[str], incremental: Optional[bool]) -> Optional[str]:
+    """Task an incremental crawl compares against: the one asked for, or the last completed crawl of ``url``"""
+    if previous_task_id:
+        task = await database.fetch_one(tasks_table.select().where(tasks_table.c.id == previous_task_id))
+        if not task:
+            raise HTTPException(status_code=404, detail="Previous task not found")
+        if task.status != "completed":
+            raise HTTPException(status_code=400, detail="Previous task has not completed")
+        return task.id
+    if not incremental:
+        return None
+    # Served by ix_tasks_url_status_created_at
+    query = sqlalchemy.select(tasks_table.c.id).where(
+        (tasks_table.c.url == url) & (tasks_table.c.status == "completed")
+    ).order_by(tasks_table.c.created_at.desc()).limit(1)
+    return await database.fetch_val(query)
+
+def task_events_channel(task_id: str) -> str:
+    return f"task_events:{task_id}"
+
+async def task_status_snapshot(task_id: str) -> Optional[Dict[str, Any]]:
+    """Current status of a task for a new progress subscriber, or None if unknown"""
+    task = await database.fetch_one(tasks_table.select().where(tasks_table.c.id == task_id))
+    if task:
+        count_query = sqlalchemy.select(sqlalchemy.func.count()).select_from(pages_table).where(pages_table.c.task_id == task_id)
+        return {
+            "type": "status",
+            "task_id": task_id,
+            "status": task.status,
+            "error": task.error,
+            "pages_done": await database.fetch_val(count_query)
+        }
+    # Enhanced crawls only keep their progress in the task:{id} hash
+    progress = redis_client.hgetall(f"task:{task_id}")
+    if not progress:
+        return None
+    progress = {key.decode(): value.decode() for key, value in progress.items()}
+    return {
+        "type": "status",
+        "task_id": task_id,
+        "status": progress.get("status", "pending"),
+        "error": progress.get("error"),
+        "progress": progress.get("progress"),
+        "message": progress.get("message")
+    }
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def close_pubsub(pubsub):
+    try:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+    except Exception as e:
+        print(f"Error closing task event subscription: {e}")
+
+def json_body(payload: Dict[str, Any]) -> bytes:
+    """Serialize a payload the way FastAPI's JSONResponse would"""
+    from fastapi.encoders import jsonable_encoder
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode()
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def etag_headers(etag: Optional[str], headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    headers = dict(headers or {})
+    if etag:
+        headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+    return headers
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
+
+def export_etag(tasks: list, name: str) -> Optional[str]:
+    """ETag for an export of finished tasks, known before any page is read"""
+    if not all(task.status in TERMINAL_STATUSES for task in tasks):
+        return None
+    return make_etag(name, *[f"{task.id}|{task.status}|{task.completed_at}" for task in tasks])
+
+def response_cache_key(task_id: str) -> str:
+    return f"response_cache:{task_id}"
+
+def forget_cached_responses(task_id: str):
+    try:
+        redis_client.delete(response_cache_key(task_id))
+    except Exception as e:
+        print(f"Response cache unavailable: {e}")
+
+def cached_response(request: Request, task_id: str, name: str, media_type: str,
+                    headers: Optional[Dict[str, str]] = None) -> Optional[Response]:
+    """The cached ``name`` response of a finished task (or a 304), if there is one"""
+    try:
+        etag, body = redis_client.hmget(response_cache_key(task_id), f"{name}:etag", f"{name}:body")
+    except Exception as e:
+        print(f"Response cache unavailable: {e}")
+        return None
+    if etag is None:
+        return None
+    etag = etag.decode()
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    if body is None:
+        return None
+    return Response(content=body, media_type=media_type, headers=etag_headers(etag, headers))
+
+def caching_response(request: Request, task, name: str, body: bytes, media_type: str,
+                     headers: Optional[Dict[str, str]] = None) -> Response:
+    """Respond with an ETag, and keep the response in Redis once the task has finished"""
+    etag = make_etag(body)
+    if task.status in TERMINAL_STATUSES:
+        key = response_cache_key(task.id)
+        entry = {f"{name}:etag": etag}
+        if len(body) <= RESPONSE_CACHE_MAX_BYTES:
+            entry[f"{name}:body"] = body
+        try:
+            pipe = redis_client.pipeline()
+            pipe.hset(key, mapping=entry)
+            pipe.expire(key, RESPONSE_CACHE_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"Response cache unavailable: {e}")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return Response(content=body, media_type=media_type, headers=etag_headers(etag, headers))
+
+def hour_bucket(moment: datetime) -> str:
+    """UTC hour an activity counter belongs to, e.g. 2024-05-01T13"""
+    return moment.strftime('%Y-%m-%dT%H')
+
+def created_counters(created_at: datetime) -> Dict[str, int]:
+    return {"status:pending": 1, f"created:{hour_bucket(created_at)}": 1}
+
+def task_domain(url: str) -> str:
+    from urllib.parse import urlparse
+    return urlparse(url).netloc
+
+async def bump_rollup(table: Table, key: str, deltas: Dict[str, int]):
+    """Add to one dashboard rollup row; call inside the transaction that makes the change"""
+    key_column = table.primary_key.columns.values()[0].name
+    columns = [column.name for column in table.columns if column.name != key_column]
+    query = (
+        f"INSERT INTO {table.name} ({key_column}, {', '.join(columns)}) "
+        f"VALUES (:key, {', '.join(':' + column for column in columns)}) "
+        f"ON CONFLICT ({key_column}) DO UPDATE SET " +
+        ', '.join(f"{column} = {table.name}.{column} + excluded.{column}" for column in columns)
+    )
+    await database.execute(query=query, values={"key": key, **{column: deltas.get(column, 0) for column in columns}})
+
+async def record_task_created(url: str, created_at: datetime):
+    await bump_task_counters(created_counters(created_at))
+    await bump_rollup(daily_rollups_table, created_at.strftime('%Y-%m-%d'), {"created": 1})
+    await bump_rollup(domain_rollups_table, task_domain(url), {"tasks": 1})
+
+async def record_task_deleted(task):
+    """Take a task back out of the counters and rollups it was added to"""
+    counters = {f"status:{task.status}": -1, f"created:{hour_bucket(task.created_at)}": -1}
+    await bump_rollup(daily_rollups_table, task.created_at.strftime('%Y-%m-%d'), {"created": -1})
+    domain = {"tasks": -1}
+    if task.status in ('completed', 'failed') and task.completed_at:
+        counters[f"{task.status}:{hour_bucket(task.completed_at)}"] = -1
+        finished = {task.status: -1}
+        if task.status == 'completed':
+            query = task_summaries_table.select().where(task_summaries_table.c.task_id == task.id)
+            summary = await database.fetch_one(query)
+            if summary:
+                finished.update({"pages": -summary.total_pages, "content_size": -summary.total_content_size})
+                counters.update({"pages": -summary.total_pages, "content_size": -summary.total_content_size})
+            domain.update({key: value for key, value in finished.items() if key != 'failed'})
+        await bump_rollup(daily_rollups_table, task.completed_at.strftime('%Y-%m-%d'), finished)
+    await bump_rollup(domain_rollups_table, task_domain(task.url), domain)
+    await bump_task_counters(counters)
+
+async def bump_task_counters(deltas: Dict[str, int]):
+    """Add to task counters; call inside the transaction that makes the change"""
+    for name, delta in deltas.items():
+        if delta:
+            await database.execute(query=COUNTER_UPSERT, values={"name": name, "delta": delta})
+    await prune_activity_counters()
+
+async def prune_activity_counters():
+    """Drop hourly buckets past ACTIVITY_RETENTION_HOURS (including any a delete just took below zero)"""
+    cutoff = hour_bucket(datetime.utcnow() - timedelta(hours=ACTIVITY_RETENTION_HOURS))
+    for event in ACTIVITY_EVENTS:
+        await database.execute(task_counters_table.delete().where(
+            task_counters_table.c.name.like(f"{event}:%") & (task_counters_table.c.name < f"{event}:{cutoff}")
+        ))
+
+async def rebuild_task_counters() -> Dict[str, int]:
+    """Recount status totals, recent hourly buckets and the dashboard rollups from tasks, replacing the stored ones"""
+    counters = {f"status:{status}": 0 for status in TASK_STATUSES}
+    status_query = sqlalchemy.select(
+        tasks_table.c.status, sqlalchemy.func.count().label("total")
+    ).group_by(tasks_table.c.status)
+    for row in await database.fetch_all(status_query):
+        counters[f"status:{row.status}"] = row.total
+    
+    since = datetime.utcnow() - timedelta(hours=ACTIVITY_RETENTION_HOURS)
+    created_query = sqlalchemy.select(tasks_table.c.created_at).where(tasks_table.c.created_at >= since)
+    for row in await database.fetch_all(created_query):
+        key = f"created:{hour_bucket(row.created_at)}"
+        counters[key] = counters.get(key, 0) + 1
+    finished_query = sqlalchemy.select(tasks_table.c.status, tasks_table.c.completed_at).where(
+        tasks_table.c.status.in_(['completed', 'failed']) & (tasks_table.c.completed_at >= since)
+    )
+    for row in await database.fetch_all(finished_query):
+        key = f"{row.status}:{hour_bucket(row.completed_at)}"
+        counters[key] = counters.get(key, 0) + 1
+    
+    daily: Dict[str, Dict[str, int]] = {}
+    domains: Dict[str, Dict[str, int]] = {}
+    counters.update({"pages": 0, "content_size": 0})
+    rollup_query = sqlalchemy.select(
+        tasks_table.c.url, tasks_table.c.status, tasks_table.c.created_at, tasks_table.c.completed_at,
+        task_summaries_table.c.total_pages, task_summaries_table.c.total_content_size
+    ).select_from(tasks_table.outerjoin(task_summaries_table, task_summaries_table.c.task_id == tasks_table.c.id))
+    async for row in database.iterate(rollup_query):
+        created = daily.setdefault(row.created_at.strftime('%Y-%m-%d'), {})
+        created["created"] = created.get("created", 0) + 1
+        domain = domains.setdefault(task_domain(row.url), {})
+        domain["tasks"] = domain.get("tasks", 0) + 1
+        if row.status in ('completed', 'failed') and row.completed_at:
+            finished = daily.setdefault(row.completed_at.strftime('%Y-%m-%d'), {})
+            finished[row.status] = finished.get(row.status, 0) + 1
+            if row.status == 'completed':
+                pages, content_size = row.total_pages or 0, row.total_content_size or 0
+                for bucket in (finished, domain):
+                    bucket["pages"] = bucket.get("pages", 0) + pages
+                    bucket["content_size"] = bucket.get("content_size", 0) + content_size
+                domain["completed"] = domain.get("completed", 0) + 1
+                counters["pages"] += pages
+                counters["content_size"] += content_size
+    
+    async with database.transaction():
+        await database.execute(task_counters_table.delete())
+        if counters:
+            await database.execute_many(
+                task_counters_table.insert(),
+                [{"name": name, "value": value} for name, value in counters.items()]
+            )
+        for table, rows in ((daily_rollups_table, daily), (domain_rollups_table, domains)):
+            key_column = table.primary_key.columns.values()[0].name
+            columns = [column.name for column in table.columns if column.name != key_column]
+            await database.execute(table.delete())
+            if rows:
+                await database.execute_many(table.insert(), [
+                    {key_column: key, **{column: values.get(column, 0) for column in columns}}
+                    for key, values in rows.items()
+                ])
+    return counters
+
+async def query_system_stats() -> Dict[str, Any]:
+    """Fallback for /stats: one grouped query over tasks instead of the counters"""
+    since = datetime.utcnow() - timedelta(days=1)
+    recent = sqlalchemy.case((tasks_table.c.created_at > since, 1), else_=0)
+    query = sqlalchemy.select(
+        tasks_table.c.status,
+        sqlalchemy.func.count().label("total"),
+        sqlalchemy.func.sum(recent).label("recent")
+    ).group_by(tasks_table.c.status)
+    rows = await database.fetch_all(query)
+    
+    stats = {f"{status}_tasks": 0 for status in TASK_STATUSES}
+    for row in rows:
+        stats[f"{row.status}_tasks"] = row.total
+    stats['total_tasks'] = sum(row.total for row in rows)
+    stats['tasks_last_24h'] = sum(row.recent or 0 for row in rows)
+    return stats
+
+def iter_file(file, chunk_size: int = 64 * 1024):
+    """Stream an export file to the response and close it afterwards"""
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+async def parquet_response(request: Request, task_ids: List[str], compression: str, filename: str):
+    """Write the tasks' pages into a Parquet file, one row group per batch of pages, and stream it"""
+    from fastapi.responses import StreamingResponse
+    import tempfile
+    
+    if compression not in PARQUET_COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid compression. Use: {', '.join(PARQUET_COMPRESSIONS)}")
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow. Use CSV export instead.")
+    
+    query = tasks_table.select().where(tasks_table.c.id.in_(task_ids))
+    tasks = {task.id: task for task in await database.fetch_all(query)}
+    missing = [task_id for task_id in task_ids if task_id not in tasks]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Task not found: {', '.join(missing)}")
+    empty = [task_id for task_id in task_ids if not tasks[task_id].result]
+    if empty:
+        raise HTTPException(status_code=400, detail=f"Task has no results to export: {', '.join(empty)}")
+    if any('raw' in parse_task_result(tasks[task_id]) for task_id in task_ids):
+        raise HTTPException(status_code=400, detail="Invalid task result format")
+    
+    etag = export_etag([tasks[task_id] for task_id in task_ids], f"parquet:{compression}")
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
+    
+    schema = pa.schema([
+        ('task_id', pa.string()),
+        ('position', pa.int32()),
+        ('url', pa.string()),
+        ('title', pa.string()),
+        ('description', pa.string()),
+        ('status_code', pa.int32()),
+        ('content_length', pa.int64()),
+        ('error', pa.string()),
+        ('scraped_at', pa.string()),
+        ('paragraph_count', pa.int32()),
+        ('heading_count', pa.int32()),
+        ('link_count', pa.int32()),
+        ('image_count', pa.int32()),
+        ('headings', pa.list_(pa.struct([('level', pa.int32()), ('text', pa.string())]))),
+        ('links', pa.list_(pa.struct([('url', pa.string()), ('text', pa.string()), ('internal', pa.bool_())]))),
+    ])
+    
+    def page_record(task_id: str, position: int, page: Dict[str, Any]) -> Dict[str, Any]:
+        headings = page.get('headings', [])
+        links = page.get('links', [])
+        return {
+            'task_id': task_id,
+            'position': position,
+            'url': page.get('url'),
+            'title': page.get('title'),
+            'description': page.get('description'),
+            'status_code': page.get('status_code'),
+            'content_length': page.get('content_length'),
+            'error': page.get('error'),
+            'scraped_at': page.get('scraped_at'),
+            'paragraph_count': len(page.get('paragraphs', [])),
+            'heading_count': len(headings),
+            'link_count': len(links),
+            'image_count': len(page.get('images', [])),
+            'headings': [
+                {'level': h.get('level') if isinstance(h, dict) else None, 'text': heading_text(h)}
+                for h in headings
+            ],
+            'links': [
+                {'url': l.get('url'), 'text': l.get('text'), 'internal': l.get('internal')}
+                for l in links
+            ],
+        }
+    
+    loop = asyncio.get_running_loop()
+    parquet_file = tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_BYTES)
+    try:
+        writer = pq.ParquetWriter(parquet_file, schema, compression=compression)
+        
+        def write_batch(records):
+            writer.write_table(pa.Table.from_pylist(records, schema=schema))
+        
+        records = []
+        for task_id in task_ids:
+            async for position, page in iter_positioned_pages(tasks[task_id]):
+                records.append(page_record(task_id, position, page))
+                if len(records) >= EXPORT_BATCH_SIZE:
+                    await loop.run_in_executor(None, write_batch, records)
+                    records = []
+        if records:
+            await loop.run_in_executor(None, write_batch, records)
+        await loop.run_in_executor(None, writer.close)
+        parquet_file.seek(0)
+    except Exception as e:
+        parquet_file.close()
+        raise HTTPException(status_code=500, detail=f"Parquet export failed: {str(e)}")
+    
+    return StreamingResponse(
+        iter_file(parquet_file),
+        media_type="application/vnd.apache.parquet",
+        headers=etag_headers(etag, {"Content-Disposition": f"attachment; filename={filename}"})
+    )
+
+def heading_text(heading) -> str:
+    """crawl_url stores headings as {level, text}, the enhanced crawler as plain strings"""
+    return heading.get('text', '') if isinstance(heading, dict) else heading
+
+def parse_task_result(task) -> Optional[Dict[str, Any]]:
+    """Decode the tasks.result column"""
+    if not task.result:
+        return None
+    try:
+        return json.loads(task.result)
+    except:
+        return {"raw": task.result}
+
+async def load_task_pages(task_id: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """Rebuild page dicts from the pages/page_headings/page_links tables"""
+    query = pages_table.select().where(pages_table.c.task_id == task_id).order_by(pages_table.c.position)
+    if limit is not None:
+        query = query.limit(limit).offset(offset)
+    rows = await database.fetch_all(query)
+    return await build_task_pages(task_id, rows)
+
+async def iter_task_pages(task, batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield a task's pages in order, holding at most ``batch_size`` of them at a time"""
+    async for _, page in iter_positioned_pages(task, batch_size):
+        yield page
+
+async def iter_positioned_pages(task, batch_size: int = EXPORT_BATCH_SIZE):
+    """``iter_task_pages`` yielding (position, page): the stored position, which has gaps where duplicates were skipped"""
+    result = parse_task_result(task) or {}
+    if not result.get('pages_stored'):
+        # Older tasks keep their pages inside the result blob
+        for position, page in enumerate(result.get('pages', [])):
+            yield position, page
+        return
+    
+    last_position = -1
+    while True:
+        query = pages_table.select().where(
+            (pages_table.c.task_id == task.id) & (pages_table.c.position > last_position)
+        ).order_by(pages_table.c.position).limit(batch_size)
+        rows = await database.fetch_all(query)
+        for row, page in zip(rows, await build_task_pages(task.id, rows)):
+            yield row.position, page
+        if len(rows) < batch_size:
+            return
+        last_position = rows[-1].position
+
+async def build_task_pages(task_id: str, rows) -> List[Dict[str, Any]]:
+    """Page dicts for the given pages rows, with their headings and links"""
+    if not rows:
+        return []
+    
+    positions = [row.position for row in rows]
+    headings: Dict[int, list] = {}
+    heading_query = page_headings_table.select().where(
+        (page_headings_table.c.task_id == task_id) & page_headings_table.c.page_position.in_(positions)
+    ).order_by(page_headings_table.c.page_position, page_headings_table.c.position)
+    for heading in await database.fetch_all(heading_query):
+        headings.setdefault(heading.page_position, []).append({'level': heading.level, 'text': heading.text})
+    
+    links: Dict[int, list] = {}
+    link_query = page_links_table.select().where(
+        (page_links_table.c.task_id == task_id) & page_links_table.c.page_position.in_(positions)
+    ).order_by(page_links_table.c.page_position, page_links_table.c.position)
+    for link in await database.fetch_all(link_query):
+        links.setdefault(link.page_position, []).append({'url': link.url, 'text': link.text, 'internal': link.internal})
+    
+    pages = []
+    for row in rows:
+        page = {'url': row.url}
+        if row.error is not None:
+            page['error'] = row.error
+        else:
+            page.update({
+                'status_code': row.status_code,
+                'title': row.title,
+                'description': row.description,
+                'headings': headings.get(row.position, []),
+                'paragraphs': json.loads(row.paragraphs) if row.paragraphs else [],
+                'links': links.get(row.position, []),
+                'content_length': row.content_length,
+            })
+        page['scraped_at'] = row.scraped_at
+        if row.extra:
+            page.update(json.loads(row.extra))
+        pages.append(page)
+    return pages
+
+TASK_FIELDS = ['id', 'url', 'status', 'result', 'error', 'created_at', 'completed_at']
+SUMMARY_FIELDS = ['total_pages', 'error_pages', 'total_links', 'total_images', 'total_content_size', 'depth_reached']
+
+def parse_task_fields(fields: Optional[str], summary: bool) -> List[str]:
+    """Fields a task listing should return: an explicit ``fields=`` list, summary mode or everything"""
+    if fields:
+        requested = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in requested if field not in TASK_FIELDS and field != 'summary']
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}. Use: {', '.join(TASK_FIELDS + ['summary'])}"
+            )
+        return requested
+    if summary:
+        return [field for field in TASK_FIELDS if field != 'result'] + ['summary']
+    return list(TASK_FIELDS)
+
+def task_summary(row) -> Optional[Dict[str, Any]]:
+    if row['total_pages'] is None:
+        return None
+    return {field: row[field] for field in SUMMARY_FIELDS}
+
+def encode_cursor(created_at: datetime, task_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{task_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    """(created_at, id) of the last task on the previous page"""
+    try:
+        created_at, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(created_at), task_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def count_tasks(condition, mode: str = "exact", cache_key: str = "all") -> Optional[int]:
+    """Number of tasks matching ``condition``, counted exactly, served from a short-lived cache or skipped"""
+    if mode not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid count mode. Use: {', '.join(COUNT_MODES)}")
+    if mode == "none":
+        return None
+    
+    query = sqlalchemy.select(sqlalchemy.func.count()).select_from(tasks_table)
+    if condition is not None:
+        query = query.where(condition)
+    if mode == "exact":
+        return await database.fetch_val(query)
+    
+    cache_key = f"tasks:count:{cache_key}"
+    try:
+        cached = redis_client.get(cache_key)
+        if cached is not None:
+            return int(cached)
+    except Exception as e:
+        print(f"Task count cache unavailable: {e}")
+    
+    total = await database.fetch_val(query)
+    try:
+        redis_client.setex(cache_key, TASK_COUNT_CACHE_TTL, total)
+    except Exception:
+        pass
+    return total
+
+async def fetch_task_list(condition, limit: int, offset: int, fields: List[str],
+                          cursor: Optional[str] = None):
+    """Newest-first task listing that only selects (and decodes) the requested fields.
+    
+    Returns the tasks and the cursor for the next page (None on the last page).
+    With a cursor the page starts right after it and ``offset`` is ignored.
+    """
+    columns = [tasks_table.c[field] for field in TASK_FIELDS if field in fields or field in ('id', 'created_at')]
+    source = tasks_table
+    if 'summary' in fields:
+        columns += [task_summaries_table.c[field] for field in SUMMARY_FIELDS]
+        source = tasks_table.outerjoin(task_summaries_table, task_summaries_table.c.task_id == tasks_table.c.id)
+    
+    query = sqlalchemy.select(*columns).select_from(source)
+    if condition is not None:
+        query = query.where(condition)
+    if cursor:
+        created_at, task_id = decode_cursor(cursor)
+        query = query.where(sqlalchemy.or_(
+            tasks_table.c.created_at < created_at,
+            sqlalchemy.and_(tasks_table.c.created_at == created_at, tasks_table.c.id < task_id)
+        ))
+        offset = 0
+    query = query.order_by(tasks_table.c.created_at.desc(), tasks_table.c.id.desc()).limit(limit).offset(offset)
+    rows = await database.fetch_all(query)
+    
+    tasks = []
+    for row in rows:
+        task = {}
+        for field in fields:
+            if field == 'result':
+                task['result'] = await load_task_result(row)
+            elif field == 'summary':
+                task['summary'] = task_summary(row)
+            else:
+                task[field] = row[field]
+        tasks.append(task)
+    
+    next_cursor = None
+    if rows and len(rows) == limit and rows[-1]['created_at'] is not None:
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return tasks, next_cursor
+
+async def load_task_result(task, include_pages: bool = True) -> Optional[Dict[str, Any]]:
+    """Task result with its pages, whether they live in the pages table or (older tasks) the JSON blob"""
+    result = parse_task_result(task)
+    if result and result.pop('pages_stored', False) and include_pages:
+        result['pages'] = await load_task_pages(task.id)
+    return result
+
+async def load_task_analytics(task, pages: Optional[list] = None):
+    """Stored analytics for a task and when they were computed.
+    
+    Tasks without stored analytics (older or still running) are analyzed on the
+    spot from their pages, or from ``pages`` if the caller already loaded them.
+    """
+    query = task_analytics_table.select().where(task_analytics_table.c.task_id == task.id)
+    stored = await database.fetch_one(query)
+    if stored:
+        return json.loads(stored.analytics), stored.computed_at
+    if pages is None:
+        pages = [page async for page in iter_task_pages(task)]
+    return analyze_content(pages), datetime.now().isoformat()
+
+async def load_keyword_sketches(task_ids: List[str]) -> List[Dict[str, Any]]:
+    query = task_analytics_table.select().where(
+        task_analytics_table.c.task_id.in_(task_ids) & task_analytics_table.c.keyword_sketch.isnot(None)
+    )
+    return [json.loads(row.keyword_sketch) for row in await database.fetch_all(query)]
+
+def merge_keyword_sketches(sketches: List[Dict[str, Any]], capacity: Optional[int] = None) -> Dict[str, Any]:
+    """Merge the worker's Space-Saving sketches into one of ``capacity`` entries.
+    
+    A word missing from a full sketch may have been counted there up to that
+    sketch's smallest count, so it gets that floor added (as overcount too).
+    """
+    capacity = capacity or max((sketch['capacity'] for sketch in sketches), default=0)
+    floors = []
+    for sketch in sketches:
+        items = sketch['items']
+        floors.append(min(entry[0] for entry in items.values()) if len(items) >= sketch['capacity'] else 0)
+    
+    combined = {}
+    for word in set().union(*(sketch['items'] for sketch in sketches)):
+        count = error = 0
+        for sketch, floor in zip(sketches, floors):
+            entry = sketch['items'].get(word)
+            count += entry[0] if entry else floor
+            error += entry[1] if entry else floor
+        combined[word] = [count, error]
+    # Ties broken by word, so the merge does not depend on the order of the sketches
+    kept = sorted(combined.items(), key=lambda item: (-item[1][0], item[0]))[:capacity]
+    return {"capacity": capacity, "items": dict(kept)}
+
+def sketch_top(sketch: Dict[str, Any], n: int = 20) -> list:
+    return [[word, entry[0]] for word, entry in
+            sorted(sketch['items'].items(), key=lambda item: item[1][0], reverse=True)[:n]]
+
 def analyze_content(data: list) -> Dict[str, Any]:
     """Phân tích nội dung crawl"""
     if not data:
@@ -655,15 +1658,15 @@ def analyze_content(data: list) -> Dict[str, Any]:
     
     for page in data:
         # Content size
-        size = page.get('content_size', 0)
+        size = page.get('content_size', page.get('content_length', 0))
         if isinstance(size, (int, float)):
             analysis["total_content_size"] += size
         
         # Text analysis
-        title = page.get('title', '')
-        description = page.get('description', '')
+        title = page.get('title') or ''
+        description = page.get('description') or ''
         paragraphs = ' '.join(page.get('paragraphs', []))
-        headings = ' '.join(page.get('headings', []))
+        headings = ' '.join(heading_text(h) for h in page.get('headings', []))
         
         page_text = f"{title} {description} {paragraphs} {headings}"
         all_text += f" {page_text}"
@@ -671,6 +1674,9 @@ def analyze_content(data: list) -> Dict[str, Any]:
         # Links analysis
         links = page.get('links', [])
         total_links += len(links)
+        internal_links = sum(1 for link in links if isinstance(link, dict) and link.get('internal'))
+        analysis["links_analysis"]["internal_links"] += internal_links
+        analysis["links_analysis"]["external_links"] += len(links) - internal_links
         
         # Content types
         if page.get('images'):
@@ -728,35 +1734,105 @@ def generate_comparison_summary(comparison: Dict) -> Dict:
     
     return summary
 
-def search_in_task(task: dict, keyword: str, search_type: str) -> list:
-    """Tìm kiếm trong task"""
-    matches = []
-    data = task.get('data', [])
+def fts_query(keyword: str, search_type: str) -> str:
+    """FTS5 query matching every word of ``keyword``, optionally within one column"""
+    terms = ' '.join('"' + term.replace('"', '""') + '"' for term in keyword.split())
+    column = SEARCH_TYPES[search_type]
+    return f"{column} : ({terms})" if column else terms
+
+async def search_pages_fts(keyword: str, search_type: str, task_id: Optional[str], limit: int, offset: int):
+    """Ranked (bm25) page hits with highlighted snippets from the FTS5 index"""
+    where = "pages_fts MATCH :query AND t.status = 'completed'"
+    values = {"query": fts_query(keyword, search_type)}
+    if task_id:
+        where += " AND p.task_id = :task_id"
+        values["task_id"] = task_id
+    joins = "FROM pages_fts JOIN pages p ON p.id = pages_fts.rowid JOIN tasks t ON t.id = p.task_id"
     
-    for page in data:
-        page_matches = {"url": page.get('url'), "matches": []}
-        
-        if search_type in ['all', 'title']:
-            title = page.get('title', '').lower()
-            if keyword in title:
-                page_matches["matches"].append({"type": "title", "content": page.get('title', '')})
-        
-        if search_type in ['all', 'content']:
-            paragraphs = page.get('paragraphs', [])
-            for i, para in enumerate(paragraphs):
-                if keyword in para.lower():
-                    page_matches["matches"].append({"type": "paragraph", "content": para[:200] + "..."})
-        
-        if search_type in ['all', 'links']:
-            links = page.get('links', [])
-            for link in links:
-                if keyword in link.lower():
-                    page_matches["matches"].append({"type": "link", "content": link})
-        
-        if page_matches["matches"]:
-            matches.append(page_matches)
+    total = await database.fetch_val(query=f"SELECT COUNT(*) {joins} WHERE {where}", values=values)
+    rows = await database.fetch_all(
+        query=f"""
+            SELECT p.task_id, p.position, p.url, p.title, t.url AS task_url, t.created_at AS crawled_at,
+                   bm25(pages_fts, {', '.join(str(w) for w in SEARCH_WEIGHTS)}) AS score,
+                   snippet(pages_fts, -1, '<mark>', '</mark>', '...', 24) AS snippet
+            {joins} WHERE {where}
+            ORDER BY score LIMIT :limit OFFSET :offset
+        """,
+        values={**values, "limit": limit, "offset": offset}
+    )
+    results = [{
+        "task_id": row.task_id,
+        "task_url": row.task_url,
+        "crawled_at": row.crawled_at,
+        "position": row.position,
+        "url": row.url,
+        "title": row.title,
+        "score": round(-row.score, 4),
+        "snippet": row.snippet
+    } for row in rows]
+    return total, results
+
+def highlight_snippet(text: str, keyword: str, width: int = 80) -> Optional[str]:
+    """Text around the first occurrence of ``keyword`` with the match wrapped in <mark>"""
+    found = text.lower().find(keyword.lower()) if text else -1
+    if found < 0:
+        return None
+    start = max(0, found - width)
+    end = found + len(keyword)
+    return (
+        ('...' if start else '') + text[start:found] +
+        '<mark>' + text[found:end] + '</mark>' +
+        text[end:end + width] + ('...' if end + width < len(text) else '')
+    )
+
+async def search_pages_like(keyword: str, search_type: str, task_id: Optional[str], limit: int, offset: int):
+    """Substring search for databases without FTS5; title matches rank first"""
+    pattern = '%' + keyword.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    title_match = sqlalchemy.func.lower(pages_table.c.title).like(pattern, escape='\\')
+    content_match = sqlalchemy.func.lower(pages_table.c.paragraphs).like(pattern, escape='\\')
+    link_match = sqlalchemy.exists().where(
+        (page_links_table.c.task_id == pages_table.c.task_id) &
+        (page_links_table.c.page_position == pages_table.c.position) &
+        (sqlalchemy.func.lower(page_links_table.c.url).like(pattern, escape='\\') |
+         sqlalchemy.func.lower(page_links_table.c.text).like(pattern, escape='\\'))
+    )
+    matches = {'title': [title_match], 'content': [content_match], 'links': [link_match]}
+    condition = sqlalchemy.or_(*matches.get(search_type, [title_match, content_match, link_match]))
+    condition = condition & (tasks_table.c.status == 'completed')
+    if task_id:
+        condition = condition & (pages_table.c.task_id == task_id)
+    source = pages_table.join(tasks_table, tasks_table.c.id == pages_table.c.task_id)
     
-    return matches
+    total = await database.fetch_val(sqlalchemy.select(sqlalchemy.func.count()).select_from(source).where(condition))
+    title_first = sqlalchemy.case((title_match, 0), else_=1)
+    query = sqlalchemy.select(
+        pages_table.c.task_id, pages_table.c.position, pages_table.c.url, pages_table.c.title,
+        pages_table.c.paragraphs, tasks_table.c.url.label('task_url'), tasks_table.c.created_at.label('crawled_at')
+    ).select_from(source).where(condition).order_by(
+        title_first, tasks_table.c.created_at.desc(), pages_table.c.position
+    ).limit(limit).offset(offset)
+    
+    results = []
+    for row in await database.fetch_all(query):
+        snippet = None
+        if search_type in ('all', 'title'):
+            snippet = highlight_snippet(row.title, keyword)
+        if snippet is None and search_type in ('all', 'content') and row.paragraphs:
+            for paragraph in json.loads(row.paragraphs):
+                snippet = highlight_snippet(paragraph, keyword)
+                if snippet:
+                    break
+        results.append({
+            "task_id": row.task_id,
+            "task_url": row.task_url,
+            "crawled_at": row.crawled_at,
+            "position": row.position,
+            "url": row.url,
+            "title": row.title,
+            "score": None,
+            "snippet": snippet
+        })
+    return total, results
 
 if __name__ == "__main__":
     import uvicorn
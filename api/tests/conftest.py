@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# main creates its tables on import, so point it at a throwaway database first
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
@@ -0,0 +1,54 @@
+"""Export endpoints against the throwaway database."""
+import json
+import tempfile
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def task():
+    task_id = f"export-{datetime.utcnow().timestamp()}"
+    with main.engine.begin() as connection:
+        connection.execute(main.tasks_table.insert().values(
+            id=task_id, url='https://example.com/', status='completed', created_at=datetime.utcnow(),
+            completed_at=datetime.utcnow(), result=json.dumps({'pages_stored': True, 'total_pages': 1})
+        ))
+        connection.execute(main.pages_table.insert().values(
+            task_id=task_id, position=0, url='https://example.com/', status_code=200, title='Home'
+        ))
+    return task_id
+
+
+def test_excel_export(client, task):
+    response = client.get(f"/export/excel/{task}")
+    assert response.status_code == 200
+    assert response.content[:2] == b'PK'
+
+
+def test_failed_excel_export_closes_its_spool_file(client, task, monkeypatch):
+    spooled = []
+    make_spool = tempfile.SpooledTemporaryFile
+
+    def spool(*args, **kwargs):
+        spooled.append(make_spool(*args, **kwargs))
+        return spooled[-1]
+
+    async def broken_pages(task):
+        raise RuntimeError("database went away")
+        yield
+
+    monkeypatch.setattr(tempfile, 'SpooledTemporaryFile', spool)
+    monkeypatch.setattr(main, 'iter_task_pages', broken_pages)
+    response = client.get(f"/export/excel/{task}")
+    assert response.status_code == 500
+    assert len(spooled) == 1 and spooled[0].closed
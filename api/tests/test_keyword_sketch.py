@@ -0,0 +1,70 @@
+"""Merging the worker's Space-Saving keyword sketches, against exact counts."""
+import itertools
+import random
+from collections import Counter
+
+from main import merge_keyword_sketches, sketch_top
+
+
+def space_saving(words, capacity):
+    """The worker's KeywordSketch, in the {"capacity", "items"} form it stores"""
+    items = {}
+    for word in words:
+        if word in items:
+            items[word][0] += 1
+        elif len(items) < capacity:
+            items[word] = [1, 0]
+        else:
+            evicted = min(items, key=lambda w: items[w][0])
+            floor = items.pop(evicted)[0]
+            items[word] = [floor + 1, floor]
+    return {"capacity": capacity, "items": items}
+
+
+def skewed_streams(count=3, length=5000, vocabulary=500, seed=11):
+    rng = random.Random(seed)
+    words = [f'w{i}' for i in range(1, vocabulary + 1)]
+    weights = [1 / i for i in range(1, vocabulary + 1)]
+    streams = []
+    for _ in range(count):
+        # Each task has its own favourite words on top of the shared skew
+        favourites = weights[:20]
+        rng.shuffle(favourites)
+        streams.append(rng.choices(words, weights=favourites + weights[20:], k=length))
+    return streams
+
+
+def test_merged_counts_bound_the_exact_totals():
+    streams = skewed_streams()
+    exact = Counter(itertools.chain(*streams))
+    merged = merge_keyword_sketches([space_saving(stream, 50) for stream in streams])
+    assert merged["capacity"] == 50 and len(merged["items"]) == 50
+    for word, (count, error) in merged["items"].items():
+        assert count - error <= exact[word] <= count
+    assert [word for word, _ in sketch_top(merged, 3)] == [word for word, _ in exact.most_common(3)]
+
+
+def test_merge_is_exact_while_the_sketches_are_not_full():
+    merged = merge_keyword_sketches([
+        {"capacity": 10, "items": {"a": [3, 0], "b": [1, 0]}},
+        {"capacity": 10, "items": {"a": [2, 0], "c": [4, 0]}},
+    ])
+    assert merged == {"capacity": 10, "items": {"a": [5, 0], "c": [4, 0], "b": [1, 0]}}
+
+
+def test_words_missing_from_a_full_sketch_get_its_floor():
+    merged = merge_keyword_sketches([
+        {"capacity": 2, "items": {"a": [5, 0], "b": [3, 1]}},
+        {"capacity": 2, "items": {"a": [4, 0], "c": [6, 2]}},
+    ])
+    # c may have been counted up to 3 in the first sketch, b up to 4 in the second
+    assert merged["items"] == {"a": [9, 0], "c": [9, 5]}
+
+
+def test_merge_order_does_not_matter():
+    sketches = [space_saving(stream, 30) for stream in skewed_streams(count=4, length=2000)]
+    # Ties at the capacity cut-off included
+    sketches.append({"capacity": 30, "items": {f"tie{i}": [1, 0] for i in range(40)}})
+    merged = [merge_keyword_sketches(list(order)) for order in itertools.permutations(sketches)]
+    assert all(result == merged[0] for result in merged)
+    assert all(list(result["items"]) == list(merged[0]["items"]) for result in merged)
@@ -0,0 +1,152 @@
+"""Per-task content analytics, built up page by page during the crawl.
+
+``/analytics/{task_id}`` and ``/compare`` used to rebuild these numbers from
+every page of a task on each request. ``ContentAnalytics`` takes each page as
+it is stored and keeps only running totals and word counts, so the report is
+ready (and stored in ``task_analytics``) the moment the crawl completes. The
+report has the same shape the API's ``analyze_content`` returns.
+
+Keywords are counted with a Space-Saving sketch of ``KEYWORD_SKETCH_SIZE``
+entries, so memory stays fixed however large the crawl or its vocabulary.
+Counts are exact until the sketch fills up and upper bounds after that (each
+entry also records its maximum overcount). The API merges stored sketches to
+combine keyword stats across tasks and domains.
+"""
+import heapq
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List
+
+WORD_PATTERN = re.compile(r'\b\w+\b')
+STOP_WORDS = {'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those', 'a', 'an'}
+TOP_KEYWORDS = 20
+KEYWORD_SKETCH_SIZE = int(os.getenv("KEYWORD_SKETCH_SIZE", "1000"))
+
+
+def heading_text(heading) -> str:
+    return heading.get('text', '') if isinstance(heading, dict) else heading
+
+
+def page_words(page: Dict[str, Any]) -> list:
+    """Lower-cased words of a page's title, description, paragraphs and headings"""
+    title = page.get('title') or ''
+    description = page.get('description') or ''
+    paragraphs = ' '.join(page.get('paragraphs', []))
+    headings = ' '.join(heading_text(h) for h in page.get('headings', []))
+    return WORD_PATTERN.findall(f"{title} {description} {paragraphs} {headings}".lower())
+
+
+class KeywordSketch:
+    """Space-Saving heavy hitters: at most ``capacity`` words with count and overcount"""
+
+    def __init__(self, capacity: int = KEYWORD_SKETCH_SIZE):
+        self.capacity = max(1, capacity)
+        # word -> [count, error]; count - error <= true count <= count
+        self.items: Dict[str, List[int]] = {}
+        # (count, word) min-heap; entries go stale when a count changes and
+        # are skipped when popped
+        self._heap: List[tuple] = []
+
+    def _push(self, word: str):
+        heapq.heappush(self._heap, (self.items[word][0], word))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(entry[0], w) for w, entry in self.items.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> str:
+        while True:
+            count, word = heapq.heappop(self._heap)
+            entry = self.items.get(word)
+            if entry is not None and entry[0] == count:
+                return word
+
+    def add(self, word: str, count: int = 1):
+        entry = self.items.get(word)
+        if entry is not None:
+            entry[0] += count
+        elif len(self.items) < self.capacity:
+            self.items[word] = [count, 0]
+        else:
+            # Replace the smallest entry; the newcomer inherits its count as error
+            evicted = self._pop_min()
+            floor = self.items.pop(evicted)[0]
+            self.items[word] = [floor + count, floor]
+        self._push(word)
+
+    def update(self, counts: Dict[str, int]):
+        for word, count in counts.items():
+            self.add(word, count)
+
+    def min_count(self) -> int:
+        """What any word missing from a full sketch may have been counted up to"""
+        if len(self.items) < self.capacity:
+            return 0
+        return min(entry[0] for entry in self.items.values())
+
+    def top(self, n: int = TOP_KEYWORDS) -> List[list]:
+        return [[word, entry[0]] for word, entry in
+                sorted(self.items.items(), key=lambda item: item[1][0], reverse=True)[:n]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"capacity": self.capacity, "items": self.items}
+
+
+class ContentAnalytics:
+    """Running analytics for one task; ``add_page`` may be called from several threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total_pages = 0
+        self.total_content_size = 0
+        self.total_words = 0
+        self.keywords = KeywordSketch()
+        self.total_links = 0
+        self.internal_links = 0
+        self.external_links = 0
+        self.content_types = {"with_images": 0, "with_links": 0, "with_headings": 0}
+
+    def add_page(self, page: Dict[str, Any]):
+        words = page_words(page)
+        keywords = Counter(word for word in words if len(word) > 3 and word not in STOP_WORDS)
+        links = page.get('links', [])
+        internal = sum(1 for link in links if isinstance(link, dict) and link.get('internal'))
+        size = page.get('content_size', page.get('content_length', 0))
+
+        with self._lock:
+            self.total_pages += 1
+            if isinstance(size, (int, float)):
+                self.total_content_size += size
+            self.total_words += len(words)
+            self.keywords.update(keywords)
+            self.total_links += len(links)
+            self.internal_links += internal
+            self.external_links += len(links) - internal
+            if page.get('images'):
+                self.content_types["with_images"] += 1
+            if links:
+                self.content_types["with_links"] += 1
+            if page.get('headings'):
+                self.content_types["with_headings"] += 1
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            pages = self.total_pages
+            return {
+                "total_pages": pages,
+                "total_content_size": self.total_content_size,
+                "avg_content_size": self.total_content_size / pages if pages else 0,
+                "word_count": {"total": self.total_words, "avg_per_page": self.total_words / pages if pages else 0},
+                "top_keywords": self.keywords.top(TOP_KEYWORDS),
+                "links_analysis": {
+                    "total_links": self.total_links,
+                    "internal_links": self.internal_links,
+                    "external_links": self.external_links
+                },
+                "content_types": dict(self.content_types)
+            }
+
+    def keyword_sketch(self) -> Dict[str, Any]:
+        with self._lock:
+            return self.keywords.to_dict()
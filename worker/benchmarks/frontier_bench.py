@@ -0,0 +1,76 @@
+"""Crawl frontier benchmark: ``Frontier`` vs. the list-based queue it replaced.
+
+Walks a random link graph breadth-first the way ``crawl_website_enhanced``
+did before (``list.pop(0)`` plus a visited set, with already-queued URLs
+appended again) and the way it does now (``Frontier``), crawling every
+reachable page. Reports wall time and the peak queue length of each.
+
+    cd worker && python benchmarks/frontier_bench.py --pages 100000 --links 10
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frontier import Frontier  # noqa: E402
+
+
+def make_graph(pages: int, links: int, seed: int):
+    rng = random.Random(seed)
+    return [[f"https://example.com/p{rng.randrange(pages)}" for _ in range(links)] for _ in range(pages)]
+
+
+def page_number(url: str) -> int:
+    return int(url.rsplit('/p', 1)[1])
+
+
+def list_frontier(graph, max_depth: int):
+    visited = set()
+    urls_to_visit = [("https://example.com/p0", 0)]
+    crawled = peak = 0
+    while urls_to_visit:
+        current_url, depth = urls_to_visit.pop(0)
+        if current_url in visited or depth > max_depth:
+            continue
+        visited.add(current_url)
+        crawled += 1
+        for link in graph[page_number(current_url)]:
+            if link not in visited:
+                urls_to_visit.append((link, depth + 1))
+        peak = max(peak, len(urls_to_visit))
+    return crawled, peak
+
+
+def deque_frontier(graph, max_depth: int):
+    frontier = Frontier(max_depth=max_depth)
+    frontier.add("https://example.com/p0", 0)
+    crawled = peak = 0
+    while frontier:
+        current_url, depth = frontier.pop()
+        crawled += 1
+        frontier.extend(graph[page_number(current_url)], depth + 1)
+        peak = max(peak, len(frontier))
+    return crawled, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=100_000, help="pages in the link graph")
+    parser.add_argument('--links', type=int, default=10, help="links per page")
+    parser.add_argument('--max-depth', type=int, default=1_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    graph = make_graph(args.pages, args.links, args.seed)
+    print(f"{args.pages} pages, {args.links} links each")
+    for name, walk in (('Frontier (deque + seen set)', deque_frontier), ('list.pop(0) + visited set', list_frontier)):
+        started = time.perf_counter()
+        crawled, peak = walk(graph, args.max_depth)
+        print(f"{name:30} crawled={crawled:<8} peak_queue={peak:<9} {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
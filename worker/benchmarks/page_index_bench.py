@@ -0,0 +1,144 @@
+"""Tree walks per page: ``PageIndex`` analyzers vs. the ones they replaced.
+
+Runs everything ``crawl_page_enhanced`` extracts from one page (the five
+analyzers plus the headings/paragraphs/links/images lists) over a synthetic
+page, once with the legacy analyzers that each walk the soup themselves
+(``tests/legacy_analyzers.py``) and once with the current ones sharing a
+``PageIndex``. Counts tree traversals (``Tag.descendants``, which
+``find_all``, ``select`` and ``get_text`` all go through, plus the index's
+own walk), both of the whole page and of any subtree such as one heading's
+text, and the nodes they visit; checks both produce the same output, and
+times them.
+
+    cd worker && python benchmarks/page_index_bench.py --sections 2000
+"""
+import argparse
+import os
+import sys
+import time
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CRAWL_DELAY", "0")
+
+from bs4 import Tag  # noqa: E402
+
+import page_index  # noqa: E402
+from canonical import canonicalize  # noqa: E402
+from parsers import make_soup  # noqa: E402
+from tests.legacy_analyzers import LegacyAnalyzers  # noqa: E402
+from worker import EnhancedWebCrawler  # noqa: E402
+
+URL = 'https://example.com/'
+
+
+class WalkCounter:
+    """Counts traversals of the whole page, of any subtree, and the nodes they visit"""
+
+    def __init__(self):
+        self.page_walks = 0
+        self.walks = 0
+        self.nodes = 0
+        self._descendants = Tag.descendants
+        self._walk = page_index.PageIndex._walk
+
+    def __enter__(self):
+        counter = self
+        descendants = self._descendants.fget
+
+        def counted_descendants(tag):
+            counter.walks += 1
+            counter.page_walks += tag.parent is None
+            for node in descendants(tag):
+                counter.nodes += 1
+                yield node
+
+        def counted_walk(index):
+            counter.walks += 1
+            counter.page_walks += 1
+            counter._walk(index)
+            # The index visits every node's children list once
+            counter.nodes += sum(len(element.contents) for element in index.elements) + len(index.soup.contents)
+
+        Tag.descendants = property(counted_descendants)
+        page_index.PageIndex._walk = counted_walk
+        return self
+
+    def __exit__(self, *exc):
+        Tag.descendants = self._descendants
+        page_index.PageIndex._walk = self._walk
+
+
+def make_page(sections: int) -> str:
+    body = ''.join(
+        f"<div class='section'><h2>Section {i}</h2><p>Paragraph {i}: call 0912 345 {i % 1000:03d} "
+        f"or mail team{i}@example.com.</p><a href='/s{i}'>more</a><img src='/i{i}.png'>"
+        f"<table><tr><th>Key</th></tr><tr><td>{i}</td></tr></table></div>"
+        for i in range(sections)
+    )
+    return (
+        "<html lang='en'><head><title>Benchmark</title><meta name='description' content='d'>"
+        "<link rel='canonical' href='/'></head><body><nav><a href='/'>Home</a></nav>"
+        "<ol class='breadcrumb'><li><a href='/'>Home</a></li></ol>"
+        f"{body}<form action='/q'><input name='q'></form><footer><a href='/about'>About</a></footer></body></html>"
+    )
+
+
+def legacy_page(soup):
+    analyzers = LegacyAnalyzers()
+    return {
+        'seo_analysis': analyzers.analyze_seo(soup, URL),
+        'social_media': analyzers.detect_social_media(soup),
+        'contact_info': analyzers.extract_contact_info(soup),
+        'content_quality': analyzers.analyze_content_quality(soup),
+        'structured_data': analyzers.extract_structured_data(soup),
+        **analyzers.page_lists(soup, URL)
+    }
+
+
+def indexed_page(soup):
+    # Same calls as EnhancedWebCrawler.crawl_page_enhanced
+    crawler = EnhancedWebCrawler()
+    index = page_index.PageIndex(soup)
+    return {
+        'seo_analysis': crawler.analyze_seo(soup, URL, index),
+        'social_media': crawler.detect_social_media(soup, index),
+        'contact_info': crawler.extract_contact_info(soup, index),
+        'content_quality': crawler.analyze_content_quality(soup, index),
+        'structured_data': crawler.extract_structured_data(soup, index),
+        'headings': [h.get_text().strip() for h in index.find_all('h1', 'h2', 'h3', 'h4', 'h5', 'h6')],
+        'paragraphs': [text for text in (p.get_text().strip() for p in index.find_all('p')) if text],
+        'links': [canonicalize(link.get('href', ''), URL) for link in index.with_attr('a', 'href')],
+        'images': [urljoin(URL, img.get('src', '')) for img in index.with_attr('img', 'src')]
+    }
+
+
+def unordered(page):
+    for section in ('social_media', 'contact_info'):
+        page[section] = {key: sorted(values) for key, values in page[section].items()}
+    return page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', type=int, default=2000, help="repeated content blocks in the page")
+    parser.add_argument('--backend', default=None, help="HTML parser backend (default: HTML_PARSER)")
+    args = parser.parse_args()
+
+    html = make_page(args.sections)
+    print(f"{len(html) / 1e6:.1f} MB page, {args.sections} sections")
+    results = {}
+    for name, extract in (('legacy', legacy_page), ('PageIndex', indexed_page)):
+        soup = make_soup(html, args.backend)
+        with WalkCounter() as counter:
+            started = time.perf_counter()
+            results[name] = unordered(extract(soup))
+            elapsed = time.perf_counter() - started
+        print(f"{name:10} page_walks={counter.page_walks:<4} all_walks={counter.walks:<7} "
+              f"nodes_visited={counter.nodes:<10} {elapsed:.2f}s")
+    assert results['legacy'] == results['PageIndex'], "outputs differ"
+    print("outputs identical")
+
+
+if __name__ == '__main__':
+    main()
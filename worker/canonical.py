@@ -0,0 +1,115 @@
+"""URL canonicalization for link collection and crawl dedup.
+
+``canonicalize`` turns the many spellings of one http(s) URL into a single
+fetchable form: lower-case scheme and host, no default port, no fragment,
+dot segments resolved, percent-escapes normalized (unreserved characters
+decoded, the rest upper-case), tracking parameters dropped and the query
+sorted. ``dedup_key`` goes one step further and also ignores a trailing
+slash; it is only used to decide whether a URL was seen already, never as
+the URL that gets fetched, because relative links on ``/docs/`` and
+``/docs`` resolve differently.
+
+Tracking parameters come from ``TRACKING_PARAMS`` (comma separated, a
+trailing ``*`` matches a prefix).
+"""
+import os
+import re
+import string
+from typing import Optional
+from urllib.parse import quote, urljoin, urlsplit, urlunsplit
+
+TRACKING_PARAMS = [
+    name.strip().lower() for name in
+    os.getenv("TRACKING_PARAMS", "utm_*,gclid,dclid,fbclid,msclkid,yclid,mc_cid,mc_eid,_ga,_gl,igshid").split(',')
+    if name.strip()
+]
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+UNRESERVED = frozenset(string.ascii_letters + string.digits + '-._~')
+PERCENT_ESCAPE = re.compile(r'%([0-9A-Fa-f]{2})')
+# Characters left as they are in each component (besides unreserved ones and escapes)
+PATH_SAFE = "/:@!$&'()*+,;=%"
+QUERY_SAFE = "/:@!$'()*+,;?=%"
+
+
+def is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return any(name.startswith(pattern[:-1]) if pattern.endswith('*') else name == pattern
+               for pattern in TRACKING_PARAMS)
+
+
+def normalize_escapes(part: str, safe: str) -> str:
+    """Decode escaped unreserved characters, upper-case other escapes, escape the rest"""
+    def unescape(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in UNRESERVED else '%' + match.group(1).upper()
+    return quote(PERCENT_ESCAPE.sub(unescape, part), safe=safe)
+
+
+def remove_dot_segments(path: str) -> str:
+    segments = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(segments) > 1:
+                segments.pop()
+        elif segment != '.':
+            segments.append(segment)
+    # A trailing . or .. still names a directory
+    if path.endswith(('/.', '/..')):
+        segments.append('')
+    return '/'.join(segments) or '/'
+
+
+def normalize_host(parsed) -> str:
+    host = (parsed.hostname or '').rstrip('.')
+    try:
+        host.encode('ascii')
+    except UnicodeEncodeError:
+        host = host.encode('idna').decode('ascii')
+    if ':' in host:
+        host = f"[{host}]"
+    port = parsed.port
+    if port is not None and port != DEFAULT_PORTS.get(parsed.scheme.lower()):
+        host = f"{host}:{port}"
+    if parsed.username is not None:
+        userinfo = parsed.username if parsed.password is None else f"{parsed.username}:{parsed.password}"
+        host = f"{userinfo}@{host}"
+    return host
+
+
+def normalize_query(query: str) -> str:
+    params = []
+    for param in query.split('&'):
+        if not param:
+            continue
+        name, sep, value = param.partition('=')
+        if is_tracking_param(PERCENT_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), name)):
+            continue
+        params.append(normalize_escapes(name, QUERY_SAFE.replace('=', '')) + sep + normalize_escapes(value, QUERY_SAFE))
+    return '&'.join(sorted(params))
+
+
+def canonicalize(url: str, base: Optional[str] = None) -> str:
+    """Canonical form of ``url`` (resolved against ``base``); non-http(s) URLs only get resolved"""
+    if base is not None:
+        url = urljoin(base, url)
+    try:
+        parsed = urlsplit(url.strip())
+        scheme = parsed.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            return url
+        netloc = normalize_host(parsed)
+    except ValueError:
+        # Malformed host or port: leave it for the fetch to fail on
+        return url
+    path = normalize_escapes(remove_dot_segments(parsed.path or '/'), PATH_SAFE)
+    return urlunsplit((scheme, netloc, path, normalize_query(parsed.query), ''))
+
+
+def dedup_key(url: str) -> str:
+    """``canonicalize`` ignoring a trailing slash, for seen-URL checks only"""
+    canonical = canonicalize(url)
+    parsed = urlsplit(canonical)
+    if parsed.scheme not in DEFAULT_PORTS or parsed.path == '/' or not parsed.path.endswith('/'):
+        return canonical
+    return urlunsplit(parsed._replace(path=parsed.path.rstrip('/') or '/'))
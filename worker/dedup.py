@@ -0,0 +1,142 @@
+"""Duplicate page detection for the crawl tasks.
+
+Each fetched body is checked before it is parsed. A body seen before (same
+SHA-1) is an exact duplicate. Otherwise the body's visible words are reduced
+to a 64-bit SimHash of word shingles, and a page within
+``NEAR_DUPLICATE_DISTANCE`` bits of an earlier page is a near duplicate
+(session IDs, print views, the same article under another path). The
+SimHashes are split into bands so a lookup only compares pages that share a
+band, not every page of the crawl.
+
+Duplicates are not parsed and their links are not followed; the crawl
+records them as aliases of the page they duplicate. Pages an incremental
+crawl revalidates with a 304 have no body to look at, so they are checked
+by the ``content_hash`` stored with them last time (``check_digest``) and
+only exact duplicates of them are caught.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "3"))
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+# Pages with fewer shingles than this are too short to call near duplicates
+MIN_SHINGLES = 16
+
+MARKUP_PATTERN = re.compile(rb'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>', re.S | re.I)
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def body_hash(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+
+def visible_words(body: bytes) -> List[str]:
+    """Words of a page with its markup, scripts and styles stripped out (no full parse)"""
+    text = MARKUP_PATTERN.sub(b' ', body).decode('utf-8', errors='replace')
+    return WORD_PATTERN.findall(text.lower())
+
+
+# Each hash bit gets its own 32-bit lane in one big int, so a shingle's bits are
+# added in with a handful of byte lookups instead of a loop over all 64 bits
+LANE_BITS = 32
+BYTE_LANES = [sum(1 << (LANE_BITS * i) for i in range(8) if byte >> i & 1) for byte in range(256)]
+
+
+def simhash(words: List[str]) -> Optional[int]:
+    """64-bit SimHash of the word shingles, or None for pages too short to compare"""
+    shingles = Counter(' '.join(words[i:i + SHINGLE_SIZE]) for i in range(max(0, len(words) - SHINGLE_SIZE + 1)))
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    lanes = 0
+    for shingle, count in shingles.items():
+        digest = hashlib.blake2b(shingle.encode(), digest_size=SIMHASH_BITS // 8).digest()
+        spread = 0
+        for position, byte in enumerate(digest):
+            spread |= BYTE_LANES[byte] << (LANE_BITS * 8 * position)
+        lanes += spread * count
+    # A bit is set when more than half of the (weighted) shingles have it set
+    total = sum(shingles.values())
+    mask = (1 << LANE_BITS) - 1
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if 2 * (lanes >> (LANE_BITS * bit) & mask) > total)
+
+
+class DuplicateDetector:
+    """Remembers the pages of one crawl; ``check`` may be called from several threads"""
+
+    def __init__(self, max_distance: int = NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        # With max_distance + 1 bands, two hashes that close agree on at least one band
+        self.bands = min(SIMHASH_BITS, max(1, max_distance + 1))
+        self.band_bits = SIMHASH_BITS // self.bands
+        self._lock = threading.Lock()
+        self._hashes: Dict[str, str] = {}
+        self._band_index: List[Dict[int, List[tuple]]] = [{} for _ in range(self.bands)]
+        self.pages_checked = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [fingerprint >> (band * self.band_bits) & mask for band in range(self.bands)]
+
+    def _nearest(self, fingerprint: int) -> Optional[tuple]:
+        best = None
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            for other, url in self._band_index[band].get(key, ()):
+                distance = bin(fingerprint ^ other).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (url, distance)
+        return best
+
+    def check(self, url: str, body: bytes) -> Optional[Dict[str, Any]]:
+        """Alias entry if ``body`` duplicates an earlier page, else None (and remember it)"""
+        digest = body_hash(body)
+        fingerprint = None
+        with self._lock:
+            self.pages_checked += 1
+            original = self._hashes.get(digest)
+            if original is not None:
+                self.exact_duplicates += 1
+                return {'url': url, 'duplicate_of': original, 'match': 'exact', 'distance': 0}
+        if self.max_distance >= 0:
+            fingerprint = simhash(visible_words(body))
+        with self._lock:
+            if digest in self._hashes:
+                # Another thread stored the same body in the meantime
+                self.exact_duplicates += 1
+                return {'url': url, 'duplicate_of': self._hashes[digest], 'match': 'exact', 'distance': 0}
+            if fingerprint is not None:
+                nearest = self._nearest(fingerprint)
+                if nearest is not None:
+                    self.near_duplicates += 1
+                    return {'url': url, 'duplicate_of': nearest[0], 'match': 'near', 'distance': nearest[1]}
+                for band, key in enumerate(self._band_keys(fingerprint)):
+                    self._band_index[band].setdefault(key, []).append((fingerprint, url))
+            self._hashes[digest] = url
+            return None
+
+    def check_digest(self, url: str, digest: str) -> Optional[Dict[str, Any]]:
+        """``check`` for a page known only by its ``body_hash`` (e.g. a 304): exact duplicates only"""
+        with self._lock:
+            self.pages_checked += 1
+            original = self._hashes.get(digest)
+            if original is not None:
+                self.exact_duplicates += 1
+                return {'url': url, 'duplicate_of': original, 'match': 'exact', 'distance': 0}
+            self._hashes[digest] = url
+            return None
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            duplicates = self.exact_duplicates + self.near_duplicates
+            return {
+                'pages_checked': self.pages_checked,
+                'exact_duplicates': self.exact_duplicates,
+                'near_duplicates': self.near_duplicates,
+                'dedup_ratio': round(duplicates / self.pages_checked, 4) if self.pages_checked else 0
+            }
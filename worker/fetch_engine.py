@@ -0,0 +1,434 @@
+"""Async fetch engine used by the crawl tasks.
+
+Pages are fetched concurrently through the process-wide HTTP pool with a
+bounded number of in-flight requests per task, while the crawl itself keeps
+the same level-by-level BFS that ``crawl_url`` always had. Each request first
+takes a slot from the per-host politeness scheduler, so one site is never
+hammered while different sites are fetched in parallel.
+
+Bodies are streamed rather than read whole: non-HTML responses are skipped
+from their headers alone, and at most ``MAX_RESPONSE_BYTES`` of decoded
+content is kept per page (decompression included), so one huge or endless
+response cannot pin a worker's memory.
+
+With a ``ResponseCache``, pages seen by an earlier task are revalidated with
+a conditional GET; on a 304 the cached body (and extracted page) is used.
+"""
+import asyncio
+import os
+import zlib
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+
+from canonical import canonicalize, dedup_key
+from dedup import DuplicateDetector, body_hash
+from frontier import Frontier
+from http_pool import ConnectionStats, pool
+from politeness import BACKOFF_STATUSES, WaitStats, robots_url, scheduler
+from response_cache import CacheStats, ResponseCache, conditional_headers, validators
+
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "10"))
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "30"))
+MAX_RETRIES = int(os.getenv("CRAWL_MAX_RETRIES", "2"))
+ROBOTS_TIMEOUT = 10
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(5 * 1024 * 1024)))
+MAX_ROBOTS_BYTES = 512 * 1024
+CHUNK_SIZE = 64 * 1024
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# extract(url, status_code, body) -> page dict
+Extractor = Callable[[str, int, bytes], Dict[str, Any]]
+# on_page(position, page), called as soon as each page is done
+PageCallback = Callable[[int, Dict[str, Any]], None]
+
+
+class FetchStats:
+    """Per-task politeness, connection and response cache counters"""
+
+    def __init__(self):
+        self.waits = WaitStats()
+        self.connections = ConnectionStats()
+        self.cache = CacheStats()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'politeness': self.waits.report(),
+            'connections': self.connections.report(),
+            'cache': self.cache.report()
+        }
+
+
+class NonHtmlContent(Exception):
+    """Raised for pages skipped because of their Content-Type"""
+
+
+class BoundedDecoder:
+    """Undo gzip/deflate content-encoding without ever producing more than asked for"""
+
+    def __init__(self, encoding: str):
+        encoding = (encoding or 'identity').strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS)
+        elif encoding == 'identity':
+            self._zlib = None
+        else:
+            raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+        self._raw_deflate_checked = encoding != 'deflate'
+
+    def decode(self, chunk: bytes, max_length: int) -> bytes:
+        if self._zlib is None:
+            return chunk[:max_length]
+        try:
+            data = self._zlib.decompress(chunk, max_length)
+        except zlib.error:
+            # Some servers send raw deflate without the zlib header
+            if self._raw_deflate_checked:
+                raise
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._zlib.decompress(chunk, max_length)
+        self._raw_deflate_checked = True
+        return data
+
+
+def declared_length(response: aiohttp.ClientResponse) -> Optional[int]:
+    value = response.headers.get('Content-Length')
+    return int(value) if value and value.isdigit() else None
+
+
+def is_html(response: aiohttp.ClientResponse) -> bool:
+    content_type = response.headers.get('Content-Type')
+    # No Content-Type at all: let the parser have a go, as before
+    return not content_type or content_type.split(';')[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+async def read_body(response: aiohttp.ClientResponse, max_bytes: int) -> Dict[str, Any]:
+    """Stream and decode a response body, stopping once ``max_bytes`` are decoded"""
+    decoder = BoundedDecoder(response.headers.get('Content-Encoding'))
+    chunks = []
+    size = 0
+    transferred = 0
+    truncated = False
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        transferred += len(chunk)
+        # Ask for one byte more than we can keep to find out if the body overflows
+        data = decoder.decode(chunk, max_bytes - size + 1)
+        if size + len(data) > max_bytes:
+            chunks.append(data[:max_bytes - size])
+            size = max_bytes
+            truncated = True
+            break
+        chunks.append(data)
+        size += len(data)
+    if truncated:
+        # The rest of the body is still on the wire, so the connection can't be reused
+        response.close()
+    return {
+        'body': b''.join(chunks),
+        'bytes_transferred': transferred,
+        'truncated': truncated
+    }
+
+
+def transfer_info(fetched: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'bytes_transferred': fetched['bytes_transferred'],
+        'declared_length': fetched['declared_length'],
+        'truncated': fetched['truncated']
+    }
+
+
+async def load_robots(url: str, headers: Optional[Dict[str, str]] = None):
+    """Fetch robots.txt once per host so its Crawl-delay feeds the scheduler"""
+    if not scheduler.claim_robots(url):
+        return
+    robots_txt = None
+    try:
+        async with pool.session().get(robots_url(url), headers=headers,
+                                      timeout=aiohttp.ClientTimeout(total=ROBOTS_TIMEOUT)) as response:
+            if response.status == 200:
+                robots = await read_body(response, MAX_ROBOTS_BYTES)
+                robots_txt = robots['body'].decode('utf-8', errors='replace')
+    except Exception as e:
+        print(f"Could not load robots.txt for {url}: {e}")
+    scheduler.set_robots(url, robots_txt)
+
+
+async def fetch_page(url: str, stats: FetchStats, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Fetch a single URL and return its status code, headers and (capped) body.
+
+    Non-HTML responses come back with ``skipped`` set and no body read.
+    """
+    print(f"Fetching URL: {url}")
+    async with pool.session().get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+                                  trace_request_ctx=stats.connections) as response:
+        scheduler.record_response(url, response.status, response.headers.get('Retry-After'), stats.waits)
+        if response.status not in BACKOFF_STATUSES:
+            response.raise_for_status()
+        fetched = {
+            'url': url,
+            'status_code': response.status,
+            'headers': response.headers,
+            'content_type': response.headers.get('Content-Type', ''),
+            'declared_length': declared_length(response),
+            'skipped': False
+        }
+        if response.status == 304:
+            # Revalidated: the caller has the body already
+            fetched.update({'body': b'', 'bytes_transferred': 0, 'truncated': False})
+            return fetched
+        if response.status in BACKOFF_STATUSES or not is_html(response):
+            fetched.update({'skipped': True, 'body': b'', 'bytes_transferred': 0, 'truncated': False})
+            response.close()
+            return fetched
+        fetched.update(await read_body(response, MAX_RESPONSE_BYTES))
+        return fetched
+
+
+async def fetch_url(url: str, stats: FetchStats, semaphore: Optional[asyncio.Semaphore] = None,
+                    headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Fetch a URL once the host allows it and a request slot is free.
+
+    429/503 responses are retried (the scheduler has already slowed the host
+    down) up to ``MAX_RETRIES`` times before being raised as errors.
+    """
+    await load_robots(url, headers)
+    for _ in range(MAX_RETRIES + 1):
+        await scheduler.acquire(url, stats.waits)
+        if semaphore is None:
+            fetched = await fetch_page(url, stats, headers)
+        else:
+            async with semaphore:
+                fetched = await fetch_page(url, stats, headers)
+        if fetched['status_code'] not in BACKOFF_STATUSES:
+            return fetched
+    raise RuntimeError(f"HTTP {fetched['status_code']}: gave up after {MAX_RETRIES + 1} attempts")
+
+
+async def fetch_cached(url: str, stats: FetchStats, cache: Optional[ResponseCache],
+                       semaphore: Optional[asyncio.Semaphore] = None,
+                       headers: Optional[Dict[str, str]] = None,
+                       prior: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """``fetch_url`` through the response cache.
+
+    A cached URL is requested conditionally; on a 304 the cached body comes
+    back as if it had been downloaded, with ``cache_entry`` set. Fresh 200s
+    that can be revalidated are stored for the next task. Without a cache
+    entry, the validators of ``prior`` (the page from an earlier crawl) are
+    sent instead, and a 304 comes back as is, with an empty body.
+    """
+    loop = asyncio.get_running_loop()
+    use_cache = cache is not None and cache.enabled
+    entry = None
+    if use_cache:
+        entry = await loop.run_in_executor(None, cache.get, url)
+        stats.cache.lookups += 1
+    request_headers = dict(headers or {})
+    if entry is not None or prior is not None:
+        request_headers.update(conditional_headers(entry if entry is not None else prior))
+    fetched = await fetch_url(url, stats, semaphore, request_headers or None)
+    if fetched['status_code'] == 304 and entry is not None:
+        stats.cache.hits += 1
+        stats.cache.bytes_saved += len(entry['body'])
+        fetched.update({
+            'status_code': entry['status_code'],
+            'content_type': entry['content_type'],
+            'body': entry['body'],
+            'cache_entry': entry
+        })
+        await loop.run_in_executor(None, cache.touch, url)
+    elif use_cache and fetched['status_code'] == 200 and not fetched['skipped']:
+        if await loop.run_in_executor(None, cache.put, url, fetched):
+            stats.cache.stored += 1
+    return fetched
+
+
+def response_validators(fetched: Dict[str, Any]) -> Dict[str, str]:
+    """ETag/Last-Modified of the body in ``fetched``, wherever it came from"""
+    entry = fetched.get('cache_entry')
+    if entry is not None:
+        return {name: entry[name] for name in ('etag', 'last_modified') if entry.get(name)}
+    return validators(fetched['headers'])
+
+
+def fetch_url_sync(url: str, stats: FetchStats, headers: Optional[Dict[str, str]] = None,
+                   cache: Optional[ResponseCache] = None) -> Dict[str, Any]:
+    """Blocking ``fetch_url`` for sync callers, still going through the shared pool"""
+    return pool.run(fetch_cached(url, stats, cache, headers=headers))
+
+
+async def fetch_and_extract(semaphore: asyncio.Semaphore, stats: FetchStats, url: str,
+                            extract: Extractor, on_error: Callable[[str, Exception], Dict[str, Any]],
+                            dedup: Optional[DuplicateDetector] = None,
+                            cache: Optional[ResponseCache] = None,
+                            previous: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Fetch a URL and extract it off the event loop so other fetches keep flowing.
+
+    With ``dedup``, a body that duplicates an earlier page is not extracted;
+    the alias entry (with ``duplicate_of``) comes back instead. With
+    ``cache``, a 304 reuses the page this extractor made of the cached body.
+    A 304 to ``prior``'s validators goes to ``dedup`` by its stored
+    ``content_hash`` instead, since there is no body.
+
+    ``previous`` maps ``dedup_key`` URLs to the pages of an earlier crawl of
+    the site. A page whose body has not changed since (a 304, or the same
+    ``content_hash``) is reused from there without extraction (with a fresh
+    ``scraped_at``), and every page's ``change`` says whether it is
+    ``unchanged``, ``changed`` or ``added``. Pages carry their ``content_hash`` and validators for the next
+    incremental crawl either way.
+    """
+    prior = previous.get(dedup_key(url)) if previous is not None else None
+    try:
+        fetched = await fetch_cached(url, stats, cache, semaphore, prior=prior)
+        if fetched['skipped']:
+            page = on_error(url, NonHtmlContent(f"Skipped non-HTML content: {fetched['content_type']}"))
+        else:
+            loop = asyncio.get_running_loop()
+            # A 304 to prior's validators: unchanged, and there is no body to look at
+            not_modified = fetched['status_code'] == 304
+            digest = None if not_modified else body_hash(fetched['body'])
+            alias = None
+            if dedup is not None and not not_modified:
+                alias = await loop.run_in_executor(None, dedup.check, url, fetched['body'])
+            elif dedup is not None and prior is not None and prior.get('content_hash'):
+                # Still counts as seen, so later copies of it are caught
+                alias = dedup.check_digest(url, prior['content_hash'])
+            if alias is not None:
+                return alias
+            entry = fetched.get('cache_entry')
+            if prior is not None and (not_modified or digest == prior.get('content_hash')):
+                page = dict(prior)
+                page['change'] = 'unchanged'
+                page['scraped_at'] = datetime.utcnow().isoformat()
+            else:
+                extractor = getattr(extract, '__name__', None)
+                page = cache.cached_page(entry, extractor) if entry is not None else None
+                if page is not None:
+                    stats.cache.pages_reused += 1
+                    # Extracted by an earlier task, but revalidated just now
+                    page['scraped_at'] = datetime.utcnow().isoformat()
+                else:
+                    page = await loop.run_in_executor(None, extract, url, fetched['status_code'], fetched['body'])
+                    if cache is not None and extractor and 'error' not in page:
+                        await loop.run_in_executor(None, cache.put_page, url, extractor, page)
+                if previous is not None:
+                    page['change'] = 'added' if prior is None else 'changed'
+            page.pop('not_modified', None)
+            if not_modified or entry is not None:
+                page['not_modified'] = True
+            if digest is not None:
+                page['content_hash'] = digest
+            page.update(response_validators(fetched))
+        page.update(transfer_info(fetched))
+        return page
+    except Exception as e:
+        page = on_error(url, e)
+        if isinstance(e, aiohttp.ClientResponseError):
+            # e.g. a 404/410, which an incremental crawl reports as removed
+            page['status_code'] = e.status
+        return page
+
+
+async def crawl_site(url: str, depth: int, max_pages: int, extract: Extractor,
+                     on_error: Callable[[str, Exception], Dict[str, Any]],
+                     on_page: Optional[PageCallback] = None,
+                     concurrency: int = MAX_CONCURRENT_REQUESTS,
+                     dedup: Optional[DuplicateDetector] = None,
+                     cache: Optional[ResponseCache] = None,
+                     previous: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Breadth-first crawl starting at ``url``.
+
+    Each depth level is fetched concurrently (at most ``concurrency`` requests
+    in flight); results keep the order in which URLs were discovered, and
+    ``on_page`` receives every page with its position in that order. URLs are
+    deduplicated by their canonical form, and a page's ``canonical_url`` is
+    never fetched on its own.
+
+    Pages that ``dedup`` finds to be duplicates go to ``aliases`` instead of
+    the results (and ``on_page``), and their links are not followed. They
+    don't use up ``max_pages``, but at most ``max_pages`` of them are fetched.
+
+    With ``previous`` (see ``fetch_and_extract``) unchanged pages are reused
+    from an earlier crawl, links included, so the crawl walks the same pages
+    without downloading or parsing what has not changed.
+
+    ``exhaustive`` is False when ``depth``, ``max_pages`` or the fetch budget
+    left internal links uncrawled, i.e. when a page missing from the results
+    may still be on the site.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    stats = FetchStats()
+    loop = asyncio.get_running_loop()
+
+    async def crawl_one(position: int, page_url: str) -> Dict[str, Any]:
+        page = await fetch_and_extract(semaphore, stats, page_url, extract, on_error, dedup, cache, previous)
+        if on_page is not None and 'duplicate_of' not in page:
+            await loop.run_in_executor(None, on_page, position, page)
+        return page
+
+    frontier = Frontier(max_depth=depth - 1, key=dedup_key)
+    frontier.add(canonicalize(url), 0)
+    crawled_urls = set()
+    results: List[Dict[str, Any]] = []
+    aliases: List[Dict[str, Any]] = []
+    fetch_budget = 2 * max_pages
+    fetched = 0
+    depth_reached = 0
+    beyond_depth = False
+
+    while frontier and len(results) < max_pages and fetched < fetch_budget:
+        # Take as many URLs from the next level as the page budget allows
+        batch = frontier.pop_level(min(max_pages - len(results), fetch_budget - fetched))
+        level = batch[0][1]
+
+        for current_url, _ in batch:
+            print(f"Crawling: {current_url}")
+        # Positions follow discovery order, so duplicates leave gaps
+        pages = await asyncio.gather(*[
+            crawl_one(fetched + i, current_url)
+            for i, (current_url, _) in enumerate(batch)
+        ])
+        fetched += len(batch)
+        aliases.extend(page for page in pages if 'duplicate_of' in page)
+        pages = [page for page in pages if 'duplicate_of' not in page]
+        results.extend(pages)
+        crawled_urls.update(current_url for current_url, _ in batch)
+
+        # Collect internal links for next level
+        for content in pages:
+            if 'links' not in content or content.get('error'):
+                continue
+            if content.get('canonical_url'):
+                # The page already stands in for its rel=canonical target
+                frontier.mark_seen(content['canonical_url'])
+            internal = [link['url'] for link in content['links'] if link.get('internal')]
+            if level < depth - 1:
+                frontier.extend(internal, level + 1)
+            elif any(not frontier.seen(link_url) for link_url in internal):
+                beyond_depth = True
+
+        depth_reached = level + 1
+
+    return {
+        'crawled_urls': list(crawled_urls),
+        'pages': results,
+        'aliases': aliases,
+        'depth_reached': depth_reached,
+        'exhaustive': not frontier and not beyond_depth,
+        **stats.report()
+    }
+
+
+def crawl_site_sync(url: str, depth: int, max_pages: int, extract: Extractor,
+                    on_error: Callable[[str, Exception], Dict[str, Any]],
+                    on_page: Optional[PageCallback] = None,
+                    dedup: Optional[DuplicateDetector] = None,
+                    cache: Optional[ResponseCache] = None,
+                    previous: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Run ``crawl_site`` on the shared pool's event loop"""
+    return pool.run(crawl_site(url, depth, max_pages, extract, on_error, on_page,
+                               dedup=dedup, cache=cache, previous=previous))
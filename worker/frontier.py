@@ -0,0 +1,78 @@
+"""Crawl frontier shared by ``crawl_url`` and ``crawl_website_enhanced``.
+
+The frontier holds the URLs still to be crawled together with their depth.
+Every URL is remembered from the moment it is queued, so it is never queued
+twice and never re-queued once crawled, and every check is a set lookup
+rather than a scan of the queue. URLs come out first-in first-out, or in
+order of a ``priority(url, depth)`` key (lowest first, ties first-in
+first-out) when one is given. With a ``key`` (such as
+``canonical.dedup_key``), two URLs with the same key count as one.
+"""
+import heapq
+import itertools
+from collections import deque
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# priority(url, depth) -> sort key, lowest is crawled first
+Priority = Callable[[str, int], object]
+
+
+class Frontier:
+    """Queue of (url, depth) pairs with a seen-or-queued set"""
+
+    def __init__(self, max_depth: Optional[int] = None, priority: Optional[Priority] = None,
+                 key: Optional[Callable[[str], str]] = None):
+        self.max_depth = max_depth
+        self.priority = priority
+        self.key = key
+        self._seen = set()
+        self._queue = deque()
+        self._heap: List[tuple] = []
+        self._order = itertools.count()
+
+    def add(self, url: str, depth: int = 0) -> bool:
+        """Queue ``url`` unless it was seen before or lies beyond ``max_depth``"""
+        if self.seen(url) or (self.max_depth is not None and depth > self.max_depth):
+            return False
+        self.mark_seen(url)
+        if self.priority is None:
+            self._queue.append((url, depth))
+        else:
+            heapq.heappush(self._heap, (self.priority(url, depth), next(self._order), url, depth))
+        return True
+
+    def extend(self, urls: Iterable[str], depth: int) -> int:
+        """Queue several URLs at the same depth; returns how many were new"""
+        return sum(self.add(url, depth) for url in urls)
+
+    def pop(self) -> Tuple[str, int]:
+        if self.priority is None:
+            return self._queue.popleft()
+        _, _, url, depth = heapq.heappop(self._heap)
+        return url, depth
+
+    def peek_depth(self) -> int:
+        """Depth of the URL ``pop`` would return next"""
+        return self._queue[0][1] if self.priority is None else self._heap[0][3]
+
+    def pop_level(self, limit: int) -> List[Tuple[str, int]]:
+        """Pop up to ``limit`` URLs, stopping where the depth of the queue changes"""
+        batch = []
+        while self and len(batch) < limit:
+            if batch and self.peek_depth() != batch[0][1]:
+                break
+            batch.append(self.pop())
+        return batch
+
+    def seen(self, url: str) -> bool:
+        return (url if self.key is None else self.key(url)) in self._seen
+
+    def mark_seen(self, url: str):
+        """Never queue ``url`` (e.g. a page's rel=canonical target once the page is crawled)"""
+        self._seen.add(url if self.key is None else self.key(url))
+
+    def __len__(self) -> int:
+        return len(self._queue) if self.priority is None else len(self._heap)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
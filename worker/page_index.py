@@ -0,0 +1,114 @@
+"""One-pass element index for the enhanced crawler's analyzers.
+
+The analyzers used to call ``find_all``/``select``/``get_text`` on the whole
+soup over and over, walking the same tree a dozen times per page. A
+``PageIndex`` walks it once, keeps every tag in document order grouped by tag
+name together with the span of its subtree, and computes the page text once.
+The lookups below reproduce the BeautifulSoup calls they replace, including
+document order.
+"""
+from typing import Callable, Dict, List, Optional
+
+from bs4 import BeautifulSoup, Tag
+
+
+def attr_matches(tag: Tag, attr: str, value: str) -> bool:
+    """Same rule BeautifulSoup uses for ``attrs={attr: value}``"""
+    current = tag.get(attr)
+    if current is None:
+        return False
+    if isinstance(current, list):
+        return value in current or ' '.join(current) == value
+    return current == value
+
+
+class PageIndex:
+    def __init__(self, soup: BeautifulSoup):
+        self.soup = soup
+        self.elements: List[Tag] = []
+        self.by_tag: Dict[str, List[Tag]] = {}
+        # id(tag) -> (position, end): the tag's subtree is elements[position + 1:end]
+        self.spans: Dict[int, tuple] = {}
+        self._text: Optional[str] = None
+        self._walk()
+
+    def _walk(self):
+        stack = [(self.soup, iter(self.soup.contents), -1)]
+        while stack:
+            tag, children, position = stack[-1]
+            for child in children:
+                if isinstance(child, Tag):
+                    child_position = len(self.elements)
+                    self.elements.append(child)
+                    self.by_tag.setdefault(child.name, []).append(child)
+                    stack.append((child, iter(child.contents), child_position))
+                    break
+            else:
+                stack.pop()
+                if position >= 0:
+                    self.spans[id(tag)] = (position, len(self.elements))
+
+    @property
+    def text(self) -> str:
+        """``soup.get_text()``, computed on first use only"""
+        if self._text is None:
+            self._text = self.soup.get_text()
+        return self._text
+
+    def find_all(self, *names: str) -> List[Tag]:
+        if len(names) == 1:
+            return self.by_tag.get(names[0], [])
+        wanted = set(names)
+        return [element for element in self.elements if element.name in wanted]
+
+    def find(self, name: str) -> Optional[Tag]:
+        found = self.by_tag.get(name)
+        return found[0] if found else None
+
+    def find_with_attr(self, name: str, attr: str, value: str) -> List[Tag]:
+        return [tag for tag in self.find_all(name) if attr_matches(tag, attr, value)]
+
+    def first_with_attr(self, name: str, attr: str, value: str) -> Optional[Tag]:
+        for tag in self.find_all(name):
+            if attr_matches(tag, attr, value):
+                return tag
+        return None
+
+    def with_attr(self, name: str, attr: str) -> List[Tag]:
+        """Tags that have ``attr`` at all, like ``find_all(name, attr=True)``"""
+        return [tag for tag in self.find_all(name) if tag.get(attr) is not None]
+
+    def descendants(self, ancestor: Tag, *names: str) -> List[Tag]:
+        """``ancestor.find_all(names)`` without walking the subtree again"""
+        position, end = self.spans[id(ancestor)]
+        wanted = set(names)
+        return [element for element in self.elements[position + 1:end] if element.name in wanted]
+
+    def inside(self, name: str, predicate: Callable[[Tag], bool]) -> List[Tag]:
+        """``name`` tags nested in any tag matching ``predicate`` (a CSS ``X name`` selector)"""
+        ranges = [self.spans[id(element)] for element in self.elements if predicate(element)]
+        if not ranges:
+            return []
+        found = []
+        for tag in self.find_all(name):
+            position = self.spans[id(tag)][0]
+            if any(start < position < end for start, end in ranges):
+                found.append(tag)
+        return found
+
+
+def has_class(class_name: str) -> Callable[[Tag], bool]:
+    def predicate(tag: Tag) -> bool:
+        classes = tag.get('class') or []
+        if isinstance(classes, str):
+            classes = classes.split()
+        return class_name in classes
+    return predicate
+
+
+def has_tag_name(name: str) -> Callable[[Tag], bool]:
+    return lambda tag: tag.name == name
+
+
+def has_attr_value(attr: str, value: str) -> Callable[[Tag], bool]:
+    return lambda tag: tag.get(attr) == value
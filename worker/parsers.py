@@ -0,0 +1,54 @@
+"""HTML parser backend selection.
+
+All extraction code works on a BeautifulSoup tree, so the backend is the
+tree builder BeautifulSoup uses underneath. ``HTML_PARSER`` picks it per
+deployment: ``html.parser`` (default, pure Python, no extra dependency) or
+``lxml`` (C-based, about twice as fast). On well-formed pages both produce
+the same extracted fields, but they repair broken markup differently and
+the results are not normalized:
+
+- an unclosed ``<p>``: lxml closes it at the next ``<p>``, html.parser nests
+  the following paragraphs inside it, so their text is joined into one;
+- a ``<p>`` inside a ``<p>``: lxml closes the outer one where the inner one
+  starts (the text after the inner one is in no paragraph), html.parser
+  keeps the inner paragraph and that text in the outer;
+- an ``<a>`` inside an ``<a>``: likewise, lxml ends the outer link at the
+  inner one, html.parser nests them, so the outer link's text includes the
+  inner link's;
+- a ``<form>`` inside a ``<form>``: lxml ends the outer form at the inner
+  one, html.parser nests them, so the outer form also counts the inner's
+  inputs.
+
+``tests/test_parsers.py`` runs both backends over ``tests/parser_corpus``
+and pins these differences. html5lib is not offered because its text nodes
+include script bodies, which changes word counts. If the configured builder
+is not installed we fall back to ``html.parser`` rather than failing every
+page.
+"""
+import os
+from typing import Optional
+
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+
+PARSER_BACKENDS = ('lxml', 'html.parser')
+FALLBACK_PARSER = 'html.parser'
+
+
+def resolve_backend(name: Optional[str]) -> str:
+    """Return ``name`` if it is a known, installed backend, else the fallback"""
+    if name not in PARSER_BACKENDS:
+        print(f"Unknown HTML_PARSER {name!r}, using {FALLBACK_PARSER}")
+        return FALLBACK_PARSER
+    if builder_registry.lookup(name) is None:
+        print(f"HTML parser backend {name!r} is not installed, using {FALLBACK_PARSER}")
+        return FALLBACK_PARSER
+    return name
+
+
+HTML_PARSER = resolve_backend(os.getenv("HTML_PARSER", "html.parser"))
+
+
+def make_soup(body, backend: Optional[str] = None) -> BeautifulSoup:
+    """Parse a page body with the deployment's backend (or an explicit one)"""
+    return BeautifulSoup(body, resolve_backend(backend) if backend else HTML_PARSER)
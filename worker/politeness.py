@@ -0,0 +1,213 @@
+"""Per-host politeness scheduling for the crawl tasks.
+
+Every host gets a token bucket refilled at one token per ``CRAWL_DELAY``
+seconds (never faster than the host's robots.txt ``Crawl-delay``, and with no
+burst at all once a host asks for one). A 429/503 adds a growing penalty to that interval and ``Retry-After`` pauses the host
+outright; successful responses decay the penalty again. Requests to different
+hosts never wait on each other.
+
+The scheduler itself only does time bookkeeping under a lock, so one instance
+is shared by every task in the worker process, sync or async.
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+CRAWL_DELAY = float(os.getenv("CRAWL_DELAY", "1"))
+CRAWL_BURST = int(os.getenv("CRAWL_BURST", "3"))
+MAX_BACKOFF = float(os.getenv("CRAWL_MAX_BACKOFF", "60"))
+ROBOTS_TTL = 3600
+# Hosts idle for this long are dropped; they start over with a full bucket
+HOST_IDLE_TTL = 3600
+
+BACKOFF_STATUSES = (429, 503)
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def robots_url(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}/robots.txt"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either a number of seconds or an HTTP date"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class HostBudget:
+    """Token bucket and back-off state for one host"""
+
+    def __init__(self, delay: float, burst: int):
+        self.delay = delay
+        self.burst = burst
+        self.crawl_delay = 0.0
+        self.penalty = 0.0
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.robots_checked = 0.0
+        self.touched = self.updated
+
+    @property
+    def interval(self) -> float:
+        return max(self.delay, self.crawl_delay) + self.penalty
+
+    @property
+    def capacity(self) -> int:
+        # A robots.txt Crawl-delay is a minimum gap between requests, not an
+        # average rate, so it leaves no room for a burst
+        return 1 if self.crawl_delay > 0 else self.burst
+
+    def set_crawl_delay(self, crawl_delay: float):
+        self.crawl_delay = crawl_delay
+        self.tokens = min(self.tokens, float(self.capacity))
+
+    def idle(self, now: float) -> bool:
+        """True once forgetting this host changes nothing: bucket full, no block pending"""
+        quiet = now - self.touched
+        return quiet >= HOST_IDLE_TTL and quiet >= self.interval * self.capacity and now >= self.blocked_until
+
+    def reserve(self, now: float) -> float:
+        """Take one token and return how long the caller must wait for it"""
+        interval = self.interval
+        if interval <= 0:
+            return max(0.0, self.blocked_until - now)
+
+        elapsed = now - self.updated
+        self.tokens = min(float(self.capacity), self.tokens + elapsed / interval)
+        self.updated = now
+
+        # Tokens may go negative: that is the queue of callers already waiting
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) * interval
+        self.tokens -= 1
+        return max(wait, self.blocked_until - now)
+
+
+class WaitStats:
+    """Queue wait accounting for one crawl task"""
+
+    def __init__(self):
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.hosts: Dict[str, float] = {}
+        self.backoffs = 0
+
+    def record(self, host: str, wait: float):
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.hosts[host] = self.hosts.get(host, 0.0) + wait
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'total_wait_seconds': round(self.total_wait, 3),
+            'avg_wait_seconds': round(self.total_wait / self.requests, 3) if self.requests else 0,
+            'max_wait_seconds': round(self.max_wait, 3),
+            'backoffs': self.backoffs,
+            'wait_by_host': {host: round(wait, 3) for host, wait in self.hosts.items()}
+        }
+
+
+class PolitenessScheduler:
+    def __init__(self, delay: float = CRAWL_DELAY, burst: int = CRAWL_BURST, max_backoff: float = MAX_BACKOFF):
+        self.delay = delay
+        self.burst = max(1, burst)
+        self.max_backoff = max_backoff
+        self._hosts: Dict[str, HostBudget] = {}
+        self._lock = threading.Lock()
+        self._pruned = time.monotonic()
+
+    def _budget(self, host: str) -> HostBudget:
+        now = time.monotonic()
+        if now - self._pruned >= HOST_IDLE_TTL:
+            self._prune(now)
+        budget = self._hosts.get(host)
+        if budget is None:
+            budget = self._hosts[host] = HostBudget(self.delay, self.burst)
+        budget.touched = now
+        return budget
+
+    def _prune(self, now: float):
+        """Forget idle hosts so a long-lived worker doesn't keep every host it ever saw"""
+        for host in [host for host, budget in self._hosts.items() if budget.idle(now)]:
+            del self._hosts[host]
+        self._pruned = now
+
+    def reserve(self, url: str, stats: Optional[WaitStats] = None) -> float:
+        host = host_of(url)
+        with self._lock:
+            wait = self._budget(host).reserve(time.monotonic())
+        if stats is not None:
+            stats.record(host, wait)
+        return wait
+
+    async def acquire(self, url: str, stats: Optional[WaitStats] = None):
+        wait = self.reserve(url, stats)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def wait(self, url: str, stats: Optional[WaitStats] = None):
+        wait = self.reserve(url, stats)
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_response(self, url: str, status_code: int, retry_after: Optional[str] = None,
+                        stats: Optional[WaitStats] = None):
+        """Adapt the host's rate to the response it just gave us"""
+        with self._lock:
+            budget = self._budget(host_of(url))
+            if status_code in BACKOFF_STATUSES:
+                budget.penalty = min(max(budget.penalty * 2, 1.0), self.max_backoff)
+                delay = parse_retry_after(retry_after)
+                if delay is not None:
+                    budget.blocked_until = max(budget.blocked_until, time.monotonic() + min(delay, self.max_backoff))
+                if stats is not None:
+                    stats.backoffs += 1
+            elif budget.penalty:
+                budget.penalty = budget.penalty / 2 if budget.penalty > 0.1 else 0.0
+
+    def claim_robots(self, url: str) -> bool:
+        """True if the caller should (re)fetch robots.txt for this URL's host"""
+        now = time.monotonic()
+        with self._lock:
+            budget = self._budget(host_of(url))
+            if budget.robots_checked and now - budget.robots_checked < ROBOTS_TTL:
+                return False
+            budget.robots_checked = now
+            return True
+
+    def set_robots(self, url: str, robots_txt: Optional[str], user_agent: str = '*'):
+        """Apply the Crawl-delay from a host's robots.txt (None if unavailable)"""
+        crawl_delay = None
+        if robots_txt:
+            parser = RobotFileParser()
+            parser.parse(robots_txt.splitlines())
+            crawl_delay = parser.crawl_delay(user_agent)
+        with self._lock:
+            self._budget(host_of(url)).set_crawl_delay(float(crawl_delay or 0))
+
+
+# Shared by every task in this worker process
+scheduler = PolitenessScheduler()
@@ -0,0 +1,178 @@
+"""HTTP response cache shared by every crawl task, kept in Redis.
+
+Pages that came with an ``ETag`` or ``Last-Modified`` header are stored
+under their canonical URL: the (compressed) body, its validators and, once a
+crawl has extracted it, the extracted page per extractor. The next task that
+visits the URL sends ``If-None-Match``/``If-Modified-Since``; a 304 means the
+body is not downloaded again and, when the same extractor already ran on it,
+not parsed again either.
+
+Entries expire ``HTTP_CACHE_TTL`` seconds after their last use, bodies above
+``HTTP_CACHE_MAX_ENTRY_BYTES`` are never stored, and once all entries add up
+to more than ``HTTP_CACHE_MAX_BYTES`` the least recently used ones are
+evicted. Redis being unavailable only turns the cache off; the crawl goes on.
+"""
+import hashlib
+import json
+import os
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from canonical import canonicalize
+
+HTTP_CACHE_TTL = int(os.getenv("HTTP_CACHE_TTL", "86400"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+HTTP_CACHE_MAX_ENTRY_BYTES = int(os.getenv("HTTP_CACHE_MAX_ENTRY_BYTES", str(2 * 1024 * 1024)))
+
+KEY_PREFIX = "http_cache:"
+# entry key -> last use (sorted set), entry key -> stored bytes, total stored bytes
+LRU_KEY = "http_cache_lru"
+SIZES_KEY = "http_cache_sizes"
+BYTES_KEY = "http_cache_bytes"
+
+
+class CacheStats:
+    """Per-task cache counters; a hit is a 304 answered from the cache"""
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.stored = 0
+        self.pages_reused = 0
+        self.bytes_saved = 0
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'stored': self.stored,
+            'pages_reused': self.pages_reused,
+            'bytes_saved': self.bytes_saved,
+            'hit_rate': round(self.hits / self.lookups, 3) if self.lookups else 0
+        }
+
+
+def validators(headers) -> Dict[str, str]:
+    """The ETag/Last-Modified of a response, if it has them"""
+    found = {}
+    if headers.get('ETag'):
+        found['etag'] = headers['ETag']
+    if headers.get('Last-Modified'):
+        found['last_modified'] = headers['Last-Modified']
+    return found
+
+
+def conditional_headers(entry: Dict[str, Any]) -> Dict[str, str]:
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+class ResponseCache:
+    def __init__(self, client, ttl: int = HTTP_CACHE_TTL, max_bytes: int = HTTP_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = HTTP_CACHE_MAX_ENTRY_BYTES):
+        self.client = client
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def key(self, url: str) -> str:
+        return KEY_PREFIX + hashlib.sha1(canonicalize(url).encode()).hexdigest()
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Cached entry for ``url`` (body, validators, status, content type, pages), or None"""
+        if not self.enabled:
+            return None
+        try:
+            fields = self.client.hgetall(self.key(url))
+        except Exception as e:
+            print(f"HTTP cache unavailable: {e}")
+            return None
+        if not fields or b'body' not in fields:
+            return None
+        fields = {name.decode(): value for name, value in fields.items()}
+        return {
+            'body': zlib.decompress(fields['body']),
+            'status_code': int(fields.get('status_code', b'200')),
+            'content_type': fields.get('content_type', b'').decode(),
+            'etag': fields['etag'].decode() if 'etag' in fields else None,
+            'last_modified': fields['last_modified'].decode() if 'last_modified' in fields else None,
+            'pages': {name[len('page:'):]: value for name, value in fields.items() if name.startswith('page:')}
+        }
+
+    def cached_page(self, entry: Dict[str, Any], extractor: str) -> Optional[Dict[str, Any]]:
+        page = entry['pages'].get(extractor)
+        return json.loads(page) if page is not None else None
+
+    def put(self, url: str, fetched: Dict[str, Any]):
+        """Store a fetched 200 response, if it can be revalidated and isn't too big"""
+        found = validators(fetched['headers'])
+        if not self.enabled or not found or fetched['truncated'] or len(fetched['body']) > self.max_entry_bytes:
+            return False
+        body = zlib.compress(fetched['body'])
+        key = self.key(url)
+        try:
+            old_size = self.client.hget(SIZES_KEY, key)
+            pipe = self.client.pipeline()
+            pipe.delete(key)
+            pipe.hset(key, mapping={
+                'url': url,
+                'body': body,
+                'status_code': fetched['status_code'],
+                'content_type': fetched['content_type'],
+                'fetched_at': time.time(),
+                **found
+            })
+            pipe.expire(key, self.ttl)
+            pipe.zadd(LRU_KEY, {key: time.time()})
+            pipe.hset(SIZES_KEY, key, len(body))
+            pipe.incrby(BYTES_KEY, len(body) - int(old_size or 0))
+            pipe.execute()
+            self._evict()
+            return True
+        except Exception as e:
+            print(f"HTTP cache unavailable: {e}")
+            return False
+
+    def put_page(self, url: str, extractor: str, page: Dict[str, Any]):
+        """Keep what ``extractor`` made of the cached body, so a 304 needs no parsing"""
+        key = self.key(url)
+        try:
+            if self.client.exists(key):
+                self.client.hset(key, f"page:{extractor}", json.dumps(page, ensure_ascii=False))
+        except Exception as e:
+            print(f"HTTP cache unavailable: {e}")
+
+    def touch(self, url: str):
+        """Mark an entry as used, pushing back its expiry and eviction"""
+        key = self.key(url)
+        try:
+            pipe = self.client.pipeline()
+            pipe.expire(key, self.ttl)
+            pipe.zadd(LRU_KEY, {key: time.time()})
+            pipe.execute()
+        except Exception as e:
+            print(f"HTTP cache unavailable: {e}")
+
+    def _evict(self):
+        # Entries that expired on their own are still counted until they come up here
+        while int(self.client.get(BYTES_KEY) or 0) > self.max_bytes:
+            oldest = self.client.zpopmin(LRU_KEY)
+            if not oldest:
+                self.client.set(BYTES_KEY, 0)
+                return
+            key = oldest[0][0]
+            size = self.client.hget(SIZES_KEY, key)
+            pipe = self.client.pipeline()
+            pipe.delete(key)
+            pipe.hdel(SIZES_KEY, key)
+            pipe.decrby(BYTES_KEY, int(size or 0))
+            pipe.execute()
@@ -0,0 +1,444 @@
+"""Worker-side database access.
+
+Each worker process keeps one connection to the database named by
+``DATABASE_URL`` (the same setting the API uses), opened lazily after Celery
+forks. SQLite runs in WAL mode with a busy timeout so readers never block the
+writer and concurrent writers wait instead of failing with "database is
+locked". ``postgresql://`` URLs go through psycopg2.
+
+Status changes are batched: non-final statuses are coalesced per task and
+written together in one transaction every ``STATUS_FLUSH_INTERVAL`` seconds,
+while ``completed``/``failed`` are flushed immediately (together with anything
+pending) so a task's result is durable before the task returns. Each write
+also moves the task between the ``task_counters`` status counters and counts
+completions/failures in their hourly bucket (dropping buckets older than
+``ACTIVITY_RETENTION_HOURS``); finished tasks are added to the daily and
+per-domain dashboard rollups in the same transaction.
+
+Crawled pages are written one at a time into the ``pages`` table and its
+``page_headings``/``page_links`` children (schema owned by the API) instead
+of being packed into ``tasks.result``, and indexed for full-text search in
+``pages_fts`` when the database has it. Incremental re-crawls read an
+earlier task's pages back with ``load_task_pages``. A completed task's aggregates go to
+``task_summaries`` so listings can show them without reading any pages, and
+its content analytics to ``task_analytics``.
+
+Every write for a task first takes its ``tasks`` row (``Storage.lock_task``)
+and writes nothing if the task has been deleted meanwhile, so a crawl that is
+still running when its task is deleted leaves no orphan rows behind.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:////app/app.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+STATUS_FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", "0.5"))
+# Same setting as the API's: hourly counter buckets kept for /stats
+ACTIVITY_RETENTION_HOURS = int(os.getenv("ACTIVITY_RETENTION_HOURS", "24"))
+
+TERMINAL_STATUSES = ('completed', 'failed')
+ACTIVITY_EVENTS = ('created', 'completed', 'failed')
+
+# Same upsert the API uses for task_counters; both run it inside the
+# transaction that changes the task
+COUNTER_UPSERT = (
+    "INSERT INTO task_counters (name, value) VALUES (?, ?) "
+    "ON CONFLICT (name) DO UPDATE SET value = task_counters.value + excluded.value"
+)
+
+# Dashboard rollups (schema owned by the API): table -> (key column, counted columns)
+ROLLUPS = {
+    'daily_rollups': ('day', ('created', 'completed', 'failed', 'pages', 'content_size')),
+    'domain_rollups': ('domain', ('tasks', 'completed', 'pages', 'content_size')),
+}
+
+
+def rollup_upsert(table: str) -> str:
+    key, columns = ROLLUPS[table]
+    return (
+        f"INSERT INTO {table} ({key}, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+        f"ON CONFLICT ({key}) DO UPDATE SET " +
+        ', '.join(f"{column} = {table}.{column} + excluded.{column}" for column in columns)
+    )
+
+
+def sqlite_path(url: str) -> str:
+    """Database path for a SQLAlchemy-style sqlite URL (``sqlite:////abs``, ``sqlite:///rel``)"""
+    path = url.split(':///', 1)[1] if ':///' in url else ''
+    return path or ':memory:'
+
+
+class Storage:
+    def __init__(self, url: str = DATABASE_URL):
+        self.url = url
+        self.is_sqlite = url.startswith('sqlite')
+        self._lock = threading.RLock()
+        self._pid = None
+        self._conn = None
+        self._search_index = None
+
+    def _connect(self):
+        if self.is_sqlite:
+            import sqlite3
+            conn = sqlite3.connect(sqlite_path(self.url), timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            return conn
+        try:
+            import psycopg2
+        except ImportError:
+            raise RuntimeError("DATABASE_URL points at Postgres but psycopg2 is not installed")
+        return psycopg2.connect(self.url.replace('postgresql+psycopg2://', 'postgresql://', 1))
+
+    def _connection(self):
+        # Connections must not cross a fork, so reconnect in each new process
+        if self._conn is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._conn = self._connect()
+            self._search_index = None
+        return self._conn
+
+    def has_search_index(self, cursor) -> bool:
+        """Whether the API set up the pages_fts full-text table (SQLite with FTS5 only)"""
+        if self._search_index is None:
+            if self.is_sqlite:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'pages_fts'")
+                self._search_index = cursor.fetchone() is not None
+            else:
+                self._search_index = False
+        return self._search_index
+
+    def _sql(self, sql: str) -> str:
+        return sql if self.is_sqlite else sql.replace('?', '%s')
+
+    @contextmanager
+    def transaction(self):
+        """Cursor inside one transaction; commits on success, rolls back on error"""
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def lock_task(self, cursor, task_id: str, columns: str = 'id') -> Optional[Sequence[Any]]:
+        """The task's row, held against a concurrent delete until the transaction ends (None if gone)"""
+        if self.is_sqlite:
+            # sqlite3 only opens the transaction at the first write, which would
+            # let the API's delete commit between this read and our writes
+            if not cursor.connection.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(f"SELECT {columns} FROM tasks WHERE id = ?", (task_id,))
+        else:
+            cursor.execute(f"SELECT {columns} FROM tasks WHERE id = %s FOR SHARE", (task_id,))
+        return cursor.fetchone()
+
+    def execute(self, cursor, sql: str, params: Sequence[Any] = ()):
+        cursor.execute(self._sql(sql), tuple(params))
+
+    def executemany(self, cursor, sql: str, rows: Iterable[Sequence[Any]]):
+        cursor.executemany(self._sql(sql), [tuple(row) for row in rows])
+
+
+class StatusBatcher:
+    """Coalesces task status changes and writes them in batches"""
+
+    def __init__(self, storage: Storage, interval: float = STATUS_FLUSH_INTERVAL):
+        self.storage = storage
+        self.interval = interval
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Batches must reach the database in the order they were taken, or a
+        # stale "running" could land after "completed"
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        # Called with the ids of the tasks in each batch once it is committed
+        self.listeners: List[Callable[[List[str]], None]] = []
+
+    def _ensure_flusher(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="status-flusher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing task statuses: {e}")
+
+    def update(self, task_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        with self._lock:
+            self._ensure_flusher()
+            self._pending[task_id] = {
+                'status': status,
+                'result': result,
+                'error': error,
+                'at': datetime.utcnow().isoformat()
+            }
+        if status in TERMINAL_STATUSES:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                with self.storage.transaction() as cursor:
+                    for task_id, update in pending.items():
+                        self._write(cursor, task_id, update)
+            except Exception:
+                # Put the batch back unless newer updates arrived meanwhile
+                with self._lock:
+                    for task_id, update in pending.items():
+                        self._pending.setdefault(task_id, update)
+                raise
+            for listener in self.listeners:
+                try:
+                    listener(list(pending))
+                except Exception as e:
+                    print(f"Error in task status listener: {e}")
+
+    def _write(self, cursor, task_id: str, update: Dict[str, Any]):
+        status = update['status']
+        row = self.storage.lock_task(cursor, task_id, 'status, url')
+        if row is None:
+            # Deleted while the crawl was running
+            return
+        previous, url = row
+        if status == "completed":
+            self.storage.execute(cursor,
+                "UPDATE tasks SET status = ?, result = ?, completed_at = ? WHERE id = ?",
+                (status, update['result'], update['at'], task_id)
+            )
+        elif status == "failed":
+            self.storage.execute(cursor,
+                "UPDATE tasks SET status = ?, error = ?, completed_at = ? WHERE id = ?",
+                (status, update['error'], update['at'], task_id)
+            )
+        else:
+            self.storage.execute(cursor,
+                "UPDATE tasks SET status = ? WHERE id = ?",
+                (status, task_id)
+            )
+        if status != previous:
+            deltas = {f"status:{previous}": -1, f"status:{status}": 1}
+            if status in TERMINAL_STATUSES:
+                deltas[f"{status}:{update['at'][:13]}"] = 1
+                pages, content_size = self._roll_up(cursor, task_id, url, status, update['at'])
+                deltas['pages'] = pages
+                deltas['content_size'] = content_size
+                self._prune_activity(cursor)
+            for name, delta in deltas.items():
+                self.storage.execute(cursor, COUNTER_UPSERT, (name, delta))
+
+    def _prune_activity(self, cursor):
+        """Drop hourly counter buckets past ``ACTIVITY_RETENTION_HOURS``"""
+        cutoff = (datetime.utcnow() - timedelta(hours=ACTIVITY_RETENTION_HOURS)).isoformat()[:13]
+        for event in ACTIVITY_EVENTS:
+            self.storage.execute(cursor, "DELETE FROM task_counters WHERE name LIKE ? AND name < ?",
+                                 (f"{event}:%", f"{event}:{cutoff}"))
+
+    def _roll_up(self, cursor, task_id: str, url: str, status: str, at: str) -> Tuple[int, int]:
+        """Add a finished task to the daily and per-domain dashboard rollups; returns its (pages, content size)"""
+        pages = content_size = 0
+        if status == 'completed':
+            # The summary is saved before the task is marked completed
+            self.storage.execute(cursor,
+                "SELECT total_pages, total_content_size FROM task_summaries WHERE task_id = ?", (task_id,))
+            summary = cursor.fetchone()
+            if summary is not None:
+                pages, content_size = summary
+        completed = 1 if status == 'completed' else 0
+        self.storage.execute(cursor, rollup_upsert('daily_rollups'),
+                             (at[:10], 0, completed, 1 - completed, pages, content_size))
+        self.storage.execute(cursor, rollup_upsert('domain_rollups'),
+                             (urlparse(url).netloc, 0, completed, pages, content_size))
+        return pages, content_size
+
+
+# Page columns with a place of their own; everything else goes to pages.extra
+PAGE_COLUMNS = ('url', 'status_code', 'title', 'description', 'content_length', 'error', 'scraped_at')
+PAGE_CHILDREN = ('headings', 'links', 'paragraphs')
+
+
+def save_page(task_id: str, position: int, page: Dict[str, Any]) -> bool:
+    """Write one crawl_url page into the pages/page_headings/page_links tables
+
+    False, writing nothing, if the task has been deleted meanwhile.
+    """
+    extra = {k: v for k, v in page.items() if k not in PAGE_COLUMNS and k not in PAGE_CHILDREN}
+    headings = page.get('headings', [])
+    links = page.get('links', [])
+    with storage.transaction() as cursor:
+        if storage.lock_task(cursor, task_id) is None:
+            # Deleted while the crawl was running
+            return False
+        search_index = storage.has_search_index(cursor)
+        if search_index:
+            storage.execute(cursor,
+                "DELETE FROM pages_fts WHERE rowid IN (SELECT id FROM pages WHERE task_id = ? AND position = ?)",
+                (task_id, position)
+            )
+        # Overwrite rather than duplicate if a page is written twice
+        for table, column in (('pages', 'position'), ('page_headings', 'page_position'), ('page_links', 'page_position')):
+            storage.execute(cursor, f"DELETE FROM {table} WHERE task_id = ? AND {column} = ?", (task_id, position))
+        storage.execute(cursor,
+            "INSERT INTO pages (task_id, position, url, status_code, title, description, content_length, "
+            "error, scraped_at, paragraphs, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (task_id, position, page.get('url'), page.get('status_code'), page.get('title'),
+             page.get('description'), page.get('content_length'), page.get('error'), page.get('scraped_at'),
+             json.dumps(page['paragraphs'], ensure_ascii=False) if 'paragraphs' in page else None,
+             json.dumps(extra) if extra else None)
+        )
+        if search_index and not page.get('error'):
+            # Keyed on pages.id, an INTEGER PRIMARY KEY, so lastrowid is the new page's id.
+            # Same text the API's backfill indexes for older pages.
+            storage.execute(cursor,
+                "INSERT INTO pages_fts (rowid, title, content, links) VALUES (?, ?, ?, ?)",
+                (cursor.lastrowid, page.get('title'), '\n'.join(page.get('paragraphs', [])),
+                 '\n'.join(f"{l['url']} {l.get('text') or ''}" for l in links))
+            )
+        storage.executemany(cursor,
+            "INSERT INTO page_headings (task_id, page_position, position, level, text) VALUES (?, ?, ?, ?, ?)",
+            [(task_id, position, i, h.get('level'), h.get('text')) for i, h in enumerate(headings)]
+        )
+        storage.executemany(cursor,
+            "INSERT INTO page_links (task_id, page_position, position, url, text, internal) VALUES (?, ?, ?, ?, ?, ?)",
+            [(task_id, position, i, l['url'], l.get('text'), l.get('internal')) for i, l in enumerate(links)]
+        )
+    return True
+
+
+def load_task_pages(task_id: str) -> List[Dict[str, Any]]:
+    """A stored task's pages as crawl_url produced them (the inverse of ``save_page``)"""
+    with storage.transaction() as cursor:
+        storage.execute(cursor,
+            "SELECT position, url, status_code, title, description, content_length, error, scraped_at, "
+            "paragraphs, extra FROM pages WHERE task_id = ? ORDER BY position", (task_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            # Older tasks keep their pages inside the result blob
+            storage.execute(cursor, "SELECT result FROM tasks WHERE id = ?", (task_id,))
+            row = cursor.fetchone()
+            result = json.loads(row[0]) if row and row[0] else {}
+            return result.get('pages', []) if isinstance(result, dict) else []
+        storage.execute(cursor,
+            "SELECT page_position, level, text FROM page_headings WHERE task_id = ? "
+            "ORDER BY page_position, position", (task_id,))
+        headings: Dict[int, list] = {}
+        for position, level, text in cursor.fetchall():
+            headings.setdefault(position, []).append({'level': level, 'text': text})
+        storage.execute(cursor,
+            "SELECT page_position, url, text, internal FROM page_links WHERE task_id = ? "
+            "ORDER BY page_position, position", (task_id,))
+        links: Dict[int, list] = {}
+        for position, url, text, internal in cursor.fetchall():
+            links.setdefault(position, []).append({'url': url, 'text': text, 'internal': bool(internal)})
+
+    pages = []
+    for position, url, status_code, title, description, content_length, error, scraped_at, paragraphs, extra in rows:
+        page = {'url': url}
+        if error is not None:
+            page['error'] = error
+        else:
+            page.update({
+                'status_code': status_code,
+                'title': title,
+                'description': description,
+                'headings': headings.get(position, []),
+                'paragraphs': json.loads(paragraphs) if paragraphs else [],
+                'links': links.get(position, []),
+                'content_length': content_length,
+            })
+        page['scraped_at'] = scraped_at
+        if extra:
+            page.update(json.loads(extra))
+        pages.append(page)
+    return pages
+
+
+def load_task_aliases(task_id: str) -> List[Dict[str, Any]]:
+    """The pages a stored task kept only as duplicates of another page (from its result)"""
+    with storage.transaction() as cursor:
+        storage.execute(cursor, "SELECT result FROM tasks WHERE id = ?", (task_id,))
+        row = cursor.fetchone()
+    result = json.loads(row[0]) if row and row[0] else {}
+    return result.get('aliases', []) if isinstance(result, dict) else []
+
+
+def summarize_pages(pages: Iterable[Dict[str, Any]], depth_reached: Optional[int] = None) -> Dict[str, Any]:
+    """Aggregates shown in task listings, computed once when the crawl completes"""
+    summary = {
+        'total_pages': 0,
+        'error_pages': 0,
+        'total_links': 0,
+        'total_images': 0,
+        'total_content_size': 0,
+        'depth_reached': depth_reached
+    }
+    for page in pages:
+        summary['total_pages'] += 1
+        summary['error_pages'] += 1 if page.get('error') else 0
+        summary['total_links'] += len(page.get('links', []))
+        summary['total_images'] += len(page.get('images', []))
+        summary['total_content_size'] += page.get('content_length') or 0
+    return summary
+
+
+def save_task_summary(task_id: str, summary: Dict[str, Any]):
+    """Store a task's aggregates in task_summaries (schema owned by the API)"""
+    with storage.transaction() as cursor:
+        if storage.lock_task(cursor, task_id) is None:
+            return
+        storage.execute(cursor, "DELETE FROM task_summaries WHERE task_id = ?", (task_id,))
+        storage.execute(cursor,
+            "INSERT INTO task_summaries (task_id, total_pages, error_pages, total_links, total_images, "
+            "total_content_size, depth_reached) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, summary['total_pages'], summary['error_pages'], summary['total_links'],
+             summary['total_images'], summary['total_content_size'], summary['depth_reached'])
+        )
+
+
+def save_task_analytics(task_id: str, analytics: Dict[str, Any], keyword_sketch: Optional[Dict[str, Any]] = None):
+    """Store a task's content analytics and keyword sketch in task_analytics (schema owned by the API)"""
+    with storage.transaction() as cursor:
+        if storage.lock_task(cursor, task_id) is None:
+            return
+        storage.execute(cursor, "DELETE FROM task_analytics WHERE task_id = ?", (task_id,))
+        storage.execute(cursor,
+            "INSERT INTO task_analytics (task_id, analytics, keyword_sketch, computed_at) VALUES (?, ?, ?, ?)",
+            (task_id, json.dumps(analytics, ensure_ascii=False),
+             json.dumps(keyword_sketch, ensure_ascii=False) if keyword_sketch else None,
+             datetime.utcnow().isoformat())
+        )
+
+
+def _flush_at_exit():
+    try:
+        status_batcher.flush()
+    except Exception as e:
+        print(f"Error flushing task statuses at exit: {e}")
+
+
+# One connection and one status batch per worker process
+storage = Storage()
+status_batcher = StatusBatcher(storage)
+atexit.register(_flush_at_exit)
@@ -0,0 +1,140 @@
+import asyncio
+import gzip
+import os
+import threading
+
+import pytest
+
+# Settings read at import time by the worker modules
+os.environ.setdefault("CRAWL_DELAY", "0")
+os.environ.setdefault("CRAWL_MAX_RETRIES", "0")
+
+from aiohttp import web  # noqa: E402
+
+# /p1 is the root of a binary tree of pages: /p{n} links to /p{2n} and /p{2n+1}
+SITE_PAGES = 63
+PAGE_DELAY = 0.2
+# Long enough for dedup to compare its SimHash
+ARTICLE = ' '.join(f'Sentence {i} of the article that is served under several paths.' for i in range(20))
+# Served as /large, and gzip-encoded as /large.gz
+LARGE_PAGE = b'<html><body>' + b'<p>Padding for a very large page.</p>' * 30000
+
+
+class LocalSite:
+    """A small site served by aiohttp on a background thread, counting what it is asked for"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.base = None
+        self.reset()
+
+    def reset(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def page(self, request):
+        n = int(request.match_info['n'])
+        if not 1 <= n <= SITE_PAGES:
+            raise web.HTTPNotFound()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(PAGE_DELAY)
+        finally:
+            self.in_flight -= 1
+        links = ''.join(f'<a href="/p{child}">Page {child}</a>' for child in (2 * n, 2 * n + 1)
+                        if child <= SITE_PAGES)
+        return web.Response(content_type='text/html', text=(
+            f'<html><head><title>Page {n}</title></head><body>'
+            f'<h1>Page {n}</h1><p>This is page number {n} of the local test site.</p>'
+            f'{links}<a href="/broken">Broken link</a><a href="https://example.org/">Elsewhere</a>'
+            f'</body></html>'
+        ))
+
+    async def cached(self, request):
+        """A page with an ETag that answers 304 to a matching If-None-Match"""
+        etag = '"v1"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(content_type='text/html', headers={'ETag': etag}, text=(
+            '<html><head><title>Cached</title></head><body>'
+            '<p>This page can be revalidated with its ETag.</p></body></html>'
+        ))
+
+    async def articles(self, request):
+        links = ''.join(f'<a href="/article/{n}">Copy {n}</a>' for n in (1, 2, 3))
+        return web.Response(content_type='text/html', text=f'<html><body>{links}</body></html>')
+
+    async def article(self, request):
+        """The same article text under /article/1..3, each linking to its own /more/{n}"""
+        n = request.match_info['n']
+        body = f'<p>{ARTICLE}</p><a href="/more/{n}">More</a>'
+        if n == '3':
+            # Same text with different markup: a near duplicate, not an exact one
+            body = f'<div>{body}</div>'
+        return web.Response(content_type='text/html', text=f'<html><body>{body}</body></html>')
+
+    async def large(self, request):
+        if request.path.endswith('.gz'):
+            return web.Response(body=gzip.compress(LARGE_PAGE), content_type='text/html',
+                                headers={'Content-Encoding': 'gzip'})
+        return web.Response(body=LARGE_PAGE, content_type='text/html')
+
+    async def pdf(self, request):
+        return web.Response(body=b'%PDF-1.4\n' + b'\0' * 100000, content_type='application/pdf')
+
+    async def broken(self, request):
+        return web.Response(status=500, text='Internal Server Error')
+
+    async def image(self, request):
+        return web.Response(body=b'\x89PNG\r\n\x1a\n', content_type='image/png')
+
+    @web.middleware
+    async def record(self, request, handler):
+        self.requests.append(request.path)
+        return await handler(request)
+
+    def start(self):
+        app = web.Application(middlewares=[self.record])
+        app.router.add_get('/p{n:\\d+}', self.page)
+        app.router.add_get('/cached', self.cached)
+        app.router.add_get('/articles', self.articles)
+        app.router.add_get('/article/{n}', self.article)
+        app.router.add_get('/large', self.large)
+        app.router.add_get('/large.gz', self.large)
+        app.router.add_get('/report.pdf', self.pdf)
+        app.router.add_get('/broken', self.broken)
+        app.router.add_get('/image.png', self.image)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f'http://127.0.0.1:{port}'
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def url(self, path: str) -> str:
+        return self.base + path
+
+    def fetched(self, path: str) -> int:
+        return self.requests.count(path)
+
+
+@pytest.fixture(scope='session')
+def local_site():
+    site = LocalSite()
+    site.start()
+    yield site
+    site.stop()
+
+
+@pytest.fixture
+def site(local_site):
+    local_site.reset()
+    return local_site
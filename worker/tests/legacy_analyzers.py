@@ -0,0 +1,276 @@
+"""The enhanced crawler's analyzers as they were before ``PageIndex``.
+
+Each analyzer here walks the soup itself (``find_all``, ``select``,
+``get_text``), as ``EnhancedWebCrawler`` did before its analyzers were moved
+onto one shared ``PageIndex``. Kept as the reference the current analyzers
+are checked against (``test_page_index.py``) and benchmarked against
+(``benchmarks/page_index_bench.py``). Later behavior changes to the
+analyzers are applied here too (canonical URLs are canonicalized since
+rel=canonical handling was added).
+"""
+import json
+import re
+from typing import Any, Dict, List
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from canonical import canonicalize
+
+
+class LegacyAnalyzers:
+    def analyze_seo(self, soup: BeautifulSoup, url: str) -> Dict[str, Any]:
+        """Phân tích SEO của trang web"""
+        seo_analysis = {
+            "title_length": 0,
+            "meta_description": "",
+            "meta_description_length": 0,
+            "h1_count": 0,
+            "h2_count": 0,
+            "meta_keywords": "",
+            "og_tags": {},
+            "schema_markup": [],
+            "canonical_url": "",
+            "robots_meta": "",
+            "lang": "",
+            "charset": ""
+        }
+        
+        # Title analysis
+        title_tag = soup.find('title')
+        if title_tag:
+            seo_analysis["title_length"] = len(title_tag.get_text().strip())
+            
+        # Meta description
+        meta_desc = soup.find('meta', attrs={'name': 'description'})
+        if meta_desc:
+            desc = meta_desc.get('content', '')
+            seo_analysis["meta_description"] = desc
+            seo_analysis["meta_description_length"] = len(desc)
+            
+        # Heading counts
+        seo_analysis["h1_count"] = len(soup.find_all('h1'))
+        seo_analysis["h2_count"] = len(soup.find_all('h2'))
+        
+        # Meta keywords
+        meta_keywords = soup.find('meta', attrs={'name': 'keywords'})
+        if meta_keywords:
+            seo_analysis["meta_keywords"] = meta_keywords.get('content', '')
+            
+        # Open Graph tags
+        og_tags = soup.find_all('meta', attrs={'property': lambda x: x and x.startswith('og:')})
+        for tag in og_tags:
+            prop = tag.get('property', '')
+            content = tag.get('content', '')
+            seo_analysis["og_tags"][prop] = content
+            
+        # Schema markup
+        scripts = soup.find_all('script', attrs={'type': 'application/ld+json'})
+        for script in scripts:
+            try:
+                schema_data = json.loads(script.string)
+                seo_analysis["schema_markup"].append(schema_data)
+            except:
+                pass
+                
+        # Canonical URL
+        canonical = soup.find('link', attrs={'rel': 'canonical'})
+        if canonical and canonical.get('href'):
+            seo_analysis["canonical_url"] = canonicalize(canonical['href'], url)
+            
+        # Robots meta
+        robots = soup.find('meta', attrs={'name': 'robots'})
+        if robots:
+            seo_analysis["robots_meta"] = robots.get('content', '')
+            
+        # Language
+        html_tag = soup.find('html')
+        if html_tag:
+            seo_analysis["lang"] = html_tag.get('lang', '')
+            
+        return seo_analysis
+    
+    def detect_social_media(self, soup: BeautifulSoup) -> Dict[str, List[str]]:
+        """Phát hiện liên kết mạng xã hội"""
+        social_patterns = {
+            'facebook': [r'facebook\.com', r'fb\.com'],
+            'twitter': [r'twitter\.com', r'x\.com'],
+            'instagram': [r'instagram\.com'],
+            'linkedin': [r'linkedin\.com'],
+            'youtube': [r'youtube\.com', r'youtu\.be'],
+            'tiktok': [r'tiktok\.com'],
+            'telegram': [r'telegram\.org', r't\.me'],
+            'whatsapp': [r'whatsapp\.com', r'wa\.me'],
+            'zalo': [r'zalo\.me'],
+            'pinterest': [r'pinterest\.com']
+        }
+        
+        social_links = {platform: [] for platform in social_patterns.keys()}
+        
+        # Find all links
+        links = soup.find_all('a', href=True)
+        for link in links:
+            href = link.get('href', '').lower()
+            for platform, patterns in social_patterns.items():
+                for pattern in patterns:
+                    if re.search(pattern, href):
+                        social_links[platform].append(href)
+                        break
+                        
+        return {k: list(set(v)) for k, v in social_links.items() if v}
+    
+    def extract_contact_info(self, soup: BeautifulSoup) -> Dict[str, List[str]]:
+        """Trích xuất thông tin liên hệ"""
+        contact_info = {
+            'emails': [],
+            'phones': [],
+            'addresses': []
+        }
+        
+        text_content = soup.get_text()
+        
+        # Email pattern
+        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+        emails = re.findall(email_pattern, text_content)
+        contact_info['emails'] = list(set(emails))
+        
+        # Phone patterns (Vietnamese format)
+        phone_patterns = [
+            r'(\+84|0)[0-9]{9,10}',
+            r'\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b',
+            r'\b\d{4}[-.\s]?\d{3}[-.\s]?\d{3}\b'
+        ]
+        
+        phones = []
+        for pattern in phone_patterns:
+            phones.extend(re.findall(pattern, text_content))
+        contact_info['phones'] = list(set(phones))
+        
+        return contact_info
+    
+    def analyze_content_quality(self, soup: BeautifulSoup) -> Dict[str, Any]:
+        """Phân tích chất lượng nội dung"""
+        quality_metrics = {
+            'word_count': 0,
+            'paragraph_count': 0,
+            'image_count': 0,
+            'video_count': 0,
+            'link_count': 0,
+            'readability_score': 0,
+            'content_freshness': '',
+            'language_detected': 'unknown'
+        }
+        
+        # Text analysis
+        text_content = soup.get_text()
+        words = re.findall(r'\b\w+\b', text_content)
+        quality_metrics['word_count'] = len(words)
+        
+        # Structural elements
+        quality_metrics['paragraph_count'] = len(soup.find_all('p'))
+        quality_metrics['image_count'] = len(soup.find_all('img'))
+        quality_metrics['video_count'] = len(soup.find_all(['video', 'iframe']))
+        quality_metrics['link_count'] = len(soup.find_all('a', href=True))
+        
+        # Simple readability (average words per sentence)
+        sentences = re.split(r'[.!?]+', text_content)
+        if sentences and words:
+            quality_metrics['readability_score'] = len(words) / len([s for s in sentences if s.strip()])
+        
+        # Language detection (simple heuristic)
+        vietnamese_chars = len(re.findall(r'[àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ]', text_content.lower()))
+        if vietnamese_chars > 10:
+            quality_metrics['language_detected'] = 'vietnamese'
+        elif re.search(r'[a-zA-Z]', text_content):
+            quality_metrics['language_detected'] = 'english'
+            
+        return quality_metrics
+    
+    def extract_structured_data(self, soup: BeautifulSoup) -> Dict[str, Any]:
+        """Trích xuất dữ liệu có cấu trúc"""
+        structured_data = {
+            'breadcrumbs': [],
+            'navigation_menu': [],
+            'footer_links': [],
+            'forms': [],
+            'tables': []
+        }
+        
+        # Breadcrumbs
+        breadcrumb_selectors = [
+            '.breadcrumb a', '.breadcrumbs a', '[aria-label="breadcrumb"] a',
+            '.navigation-path a', '.nav-breadcrumb a'
+        ]
+        
+        for selector in breadcrumb_selectors:
+            breadcrumbs = soup.select(selector)
+            if breadcrumbs:
+                structured_data['breadcrumbs'] = [link.get_text().strip() for link in breadcrumbs]
+                break
+        
+        # Navigation menu
+        nav_selectors = ['nav a', '.navigation a', '.menu a', '.nav a']
+        for selector in nav_selectors:
+            nav_links = soup.select(selector)
+            if nav_links:
+                structured_data['navigation_menu'] = [
+                    {'text': link.get_text().strip(), 'href': link.get('href', '')} 
+                    for link in nav_links[:20]  # Limit to 20 items
+                ]
+                break
+        
+        # Footer links
+        footer = soup.find('footer')
+        if footer:
+            footer_links = footer.find_all('a', href=True)
+            structured_data['footer_links'] = [
+                {'text': link.get_text().strip(), 'href': link.get('href', '')} 
+                for link in footer_links[:15]
+            ]
+        
+        # Forms
+        forms = soup.find_all('form')
+        for form in forms:
+            form_data = {
+                'action': form.get('action', ''),
+                'method': form.get('method', 'get'),
+                'inputs': []
+            }
+            
+            inputs = form.find_all(['input', 'textarea', 'select'])
+            for inp in inputs:
+                input_data = {
+                    'type': inp.get('type', inp.name),
+                    'name': inp.get('name', ''),
+                    'placeholder': inp.get('placeholder', ''),
+                    'required': inp.has_attr('required')
+                }
+                form_data['inputs'].append(input_data)
+            
+            structured_data['forms'].append(form_data)
+        
+        # Tables
+        tables = soup.find_all('table')
+        for table in tables[:5]:  # Limit to 5 tables
+            table_data = {
+                'headers': [],
+                'rows': 0
+            }
+            
+            headers = table.find_all('th')
+            if headers:
+                table_data['headers'] = [th.get_text().strip() for th in headers]
+            
+            table_data['rows'] = len(table.find_all('tr'))
+            structured_data['tables'].append(table_data)
+        
+        return structured_data
+
+    def page_lists(self, soup: BeautifulSoup, url: str) -> Dict[str, List[str]]:
+        """The headings/paragraphs/links/images lists of ``crawl_page_enhanced``"""
+        return {
+            'headings': [h.get_text().strip() for h in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])],
+            'paragraphs': [p.get_text().strip() for p in soup.find_all('p') if p.get_text().strip()],
+            'links': [canonicalize(link.get('href', ''), url) for link in soup.find_all('a', href=True)],
+            'images': [urljoin(url, img.get('src', '')) for img in soup.find_all('img', src=True)]
+        }
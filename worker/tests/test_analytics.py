@@ -0,0 +1,58 @@
+"""The Space-Saving keyword sketch against exact counts of a skewed word stream."""
+import random
+from collections import Counter
+
+from analytics import ContentAnalytics, KeywordSketch
+
+
+def skewed_stream(length=20000, vocabulary=2000, seed=7):
+    """Zipf-like: word i turns up about 1/i as often as word 1"""
+    rng = random.Random(seed)
+    words = [f'w{i}' for i in range(1, vocabulary + 1)]
+    return rng.choices(words, weights=[1 / i for i in range(1, vocabulary + 1)], k=length)
+
+
+def test_counts_are_exact_until_the_sketch_fills():
+    sketch = KeywordSketch(capacity=10)
+    sketch.update({'a': 3, 'b': 1})
+    sketch.add('a')
+    assert sketch.items == {'a': [4, 0], 'b': [1, 0]}
+    assert sketch.min_count() == 0
+
+
+def test_a_full_sketch_evicts_its_smallest_entry():
+    sketch = KeywordSketch(capacity=3)
+    sketch.update({'a': 5, 'b': 2, 'c': 4})
+    sketch.add('d')
+    # d takes b's place and inherits b's count as its overcount
+    assert sketch.items == {'a': [5, 0], 'c': [4, 0], 'd': [3, 2]}
+    sketch.add('e', 2)
+    assert sketch.items == {'a': [5, 0], 'c': [4, 0], 'e': [5, 3]}
+    assert sketch.min_count() == 4
+
+
+def test_error_bounds_on_a_skewed_stream():
+    stream = skewed_stream()
+    exact = Counter(stream)
+    sketch = KeywordSketch(capacity=100)
+    for word in stream:
+        sketch.add(word)
+
+    assert len(sketch.items) == 100
+    for word, (count, error) in sketch.items.items():
+        assert count - error <= exact[word] <= count
+        assert error <= len(stream) / sketch.capacity
+    # Words that did not make it can't have been counted more than the smallest entry
+    floor = sketch.min_count()
+    assert all(exact[word] <= floor for word in exact if word not in sketch.items)
+    # Every word above N / capacity is kept, so the heaviest hitters come out on top in order
+    assert all(word in sketch.items for word, count in exact.items() if count > len(stream) / sketch.capacity)
+    assert [word for word, _ in sketch.top(5)] == [word for word, _ in exact.most_common(5)]
+
+
+def test_analytics_report_keywords_from_the_sketch():
+    analytics = ContentAnalytics()
+    analytics.add_page({'url': 'https://example.com/', 'title': 'Crawler crawler', 'paragraphs': ['The crawler runs']})
+    sketch = analytics.keyword_sketch()
+    assert sketch['items']['crawler'][0] == 3
+    assert 'the' not in sketch['items']
@@ -0,0 +1,87 @@
+"""One canonical spelling per URL, and the looser key used to tell URLs apart."""
+import pytest
+
+from canonical import canonicalize, dedup_key
+from worker import parse_content
+
+CANONICAL = [
+    # scheme and host case
+    ('HTTPS://Example.COM/Path', 'https://example.com/Path'),
+    ('http://EXAMPLE.com.', 'http://example.com/'),
+    # default ports go, others stay
+    ('https://example.com:443/a', 'https://example.com/a'),
+    ('http://example.com:80/a', 'http://example.com/a'),
+    ('https://example.com:80/a', 'https://example.com:80/a'),
+    ('http://example.com:8080/a', 'http://example.com:8080/a'),
+    # fragment
+    ('https://example.com/a#top', 'https://example.com/a'),
+    ('https://example.com/#', 'https://example.com/'),
+    # trailing slash is kept: /docs/ and /docs resolve relative links differently
+    ('https://example.com/docs/', 'https://example.com/docs/'),
+    ('https://example.com', 'https://example.com/'),
+    # dot segments and escapes
+    ('https://example.com/a/./b/../c', 'https://example.com/a/c'),
+    ('https://example.com/%7euser/%2f%3a', 'https://example.com/~user/%2F%3A'),
+    ('https://example.com/a b', 'https://example.com/a%20b'),
+    # sorted query, tracking parameters dropped
+    ('https://example.com/?b=2&a=1', 'https://example.com/?a=1&b=2'),
+    ('https://example.com/?utm_source=x&id=7&gclid=y&UTM_Medium=z', 'https://example.com/?id=7'),
+    ('https://example.com/?utm_source=x', 'https://example.com/'),
+    ('https://example.com/?a=1&&b', 'https://example.com/?a=1&b'),
+    # mangled URLs come back as they were, for the fetch to fail on
+    ('https://example.com:99999/a', 'https://example.com:99999/a'),
+    ('https://[::1/a', 'https://[::1/a'),
+    ('mailto:someone@example.com', 'mailto:someone@example.com'),
+]
+
+
+@pytest.mark.parametrize('url,expected', CANONICAL)
+def test_canonicalize(url, expected):
+    assert canonicalize(url) == expected
+    assert canonicalize(expected) == expected
+
+
+@pytest.mark.parametrize('url,base,expected', [
+    ('../b?utm_campaign=x#frag', 'https://Example.com/docs/a/', 'https://example.com/docs/b'),
+    ('/a', 'https://example.com:443/docs/', 'https://example.com/a'),
+    ('//other.example/x', 'https://example.com/', 'https://other.example/x'),
+])
+def test_canonicalize_resolves_against_base(url, base, expected):
+    assert canonicalize(url, base) == expected
+
+
+@pytest.mark.parametrize('a,b', [
+    ('https://example.com/docs/', 'https://example.com/docs'),
+    ('https://EXAMPLE.com:443/docs/#x', 'https://example.com/docs'),
+    ('https://example.com/?b=2&a=1&fbclid=z', 'https://example.com?a=1&b=2'),
+])
+def test_dedup_key_treats_spellings_alike(a, b):
+    assert dedup_key(a) == dedup_key(b)
+
+
+@pytest.mark.parametrize('a,b', [
+    ('http://example.com/a', 'https://example.com/a'),
+    ('https://example.com/a', 'https://example.com/A'),
+    ('https://example.com/?a=1', 'https://example.com/?a=2'),
+    ('https://example.com:8443/a', 'https://example.com/a'),
+])
+def test_dedup_key_keeps_different_urls_apart(a, b):
+    assert dedup_key(a) != dedup_key(b)
+
+
+def test_dedup_key_of_the_root_and_of_non_http_urls():
+    assert dedup_key('https://example.com') == 'https://example.com/'
+    assert dedup_key('mailto:someone@example.com') == 'mailto:someone@example.com'
+
+
+def test_rel_canonical_pointing_off_host_is_kept_in_canonical_form():
+    body = b'<html><head><link rel="canonical" href="HTTPS://Mirror.example:443/Page/?utm_source=x#a">' \
+           b'</head><body><p>Text</p></body></html>'
+    content = parse_content('https://example.com/page', 200, body)
+    assert content['canonical_url'] == 'https://mirror.example/Page/'
+
+
+def test_relative_rel_canonical_resolves_against_the_page():
+    body = b'<html><head><link rel="canonical" href="../other"></head><body></body></html>'
+    content = parse_content('https://example.com/a/page', 200, body)
+    assert content['canonical_url'] == 'https://example.com/other'
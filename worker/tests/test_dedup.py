@@ -0,0 +1,93 @@
+"""Exact and near-duplicate pages, from the SimHash up to the links a crawl follows."""
+import pytest
+
+import dedup
+from dedup import MIN_SHINGLES, DuplicateDetector, simhash, visible_words
+from fetch_engine import crawl_site
+from http_pool import pool
+from worker import extraction_error, parse_content
+
+from .conftest import ARTICLE
+
+ARTICLE_BODY = f'<html><body><p>{ARTICLE}</p></body></html>'.encode()
+
+
+def words(count, prefix='w'):
+    return [f'{prefix}{i}' for i in range(count)]
+
+
+def test_visible_words_skip_markup_scripts_and_comments():
+    body = b'<p>Hello <b>World</b></p><script>var x = 1;</script><!-- note --><style>p {}</style>'
+    assert visible_words(body) == ['hello', 'world']
+
+
+def test_pages_below_min_shingles_get_no_simhash():
+    # n words make n - 2 three-word shingles
+    assert simhash(words(MIN_SHINGLES + 1)) is None
+    assert simhash(words(MIN_SHINGLES + 2)) is not None
+
+
+def test_simhash_distance_tracks_how_much_text_differs():
+    text = visible_words(ARTICLE.encode())
+    edited = text[:]
+    edited[40] = 'changed'
+    unrelated = words(len(text), 'x')
+    distance = lambda a, b: bin(simhash(a) ^ simhash(b)).count('1')
+    assert distance(text, text) == 0
+    assert distance(text, edited) <= dedup.NEAR_DUPLICATE_DISTANCE
+    assert distance(text, unrelated) > 10
+
+
+def test_exact_duplicates():
+    detector = DuplicateDetector()
+    assert detector.check('https://example.com/a', ARTICLE_BODY) is None
+    assert detector.check('https://example.com/b', ARTICLE_BODY) == {
+        'url': 'https://example.com/b', 'duplicate_of': 'https://example.com/a', 'match': 'exact', 'distance': 0}
+    # Short pages are still caught when they are byte-for-byte the same
+    assert detector.check('https://example.com/c', b'<p>Hi</p>') is None
+    assert detector.check('https://example.com/d', b'<p>Hi</p>')['match'] == 'exact'
+    assert detector.report() == {'pages_checked': 4, 'exact_duplicates': 2, 'near_duplicates': 0,
+                                 'dedup_ratio': 0.5}
+
+
+@pytest.mark.parametrize('bits,duplicate', [
+    ((), True),
+    ((1, 17, 33), True),
+    ((1, 2, 3), True),
+    ((1, 17, 33, 49), False),
+    ((1, 2, 3, 4), False),
+])
+def test_near_duplicate_threshold(monkeypatch, bits, duplicate):
+    # Bodies name their fingerprint; 16-bit bands, so bits 1/17/33/49 each land in another one
+    monkeypatch.setattr(dedup, 'simhash', lambda words: int(words[0]))
+    detector = DuplicateDetector(max_distance=3)
+    original = 0x0123456789ABCDEF
+    changed = original
+    for bit in bits:
+        changed ^= 1 << bit
+    assert detector.check('https://example.com/a', f'{original} a'.encode()) is None
+    alias = detector.check('https://example.com/b', f'{changed} b'.encode())
+    if duplicate:
+        assert alias == {'url': 'https://example.com/b', 'duplicate_of': 'https://example.com/a',
+                         'match': 'near', 'distance': len(bits)}
+    else:
+        assert alias is None
+
+
+def test_short_pages_are_never_near_duplicates():
+    detector = DuplicateDetector()
+    assert detector.check('https://example.com/a', b'<p>Contact us today</p>') is None
+    assert detector.check('https://example.com/b', b'<div><p>Contact us today</p></div>') is None
+
+
+def test_duplicates_are_aliases_and_their_links_are_not_followed(site):
+    result = pool.run(crawl_site(site.url('/articles'), 3, 50, parse_content, extraction_error,
+                                 dedup=DuplicateDetector()))
+    aliases = {alias['url']: alias for alias in result['aliases']}
+    assert len(aliases) == 2
+    kept = [page['url'] for page in result['pages'] if '/article/' in page['url']]
+    assert len(kept) == 1
+    assert {alias['duplicate_of'] for alias in aliases.values()} == set(kept)
+    # Only the kept copy's /more link is fetched
+    n = kept[0].rsplit('/', 1)[1]
+    assert [path for path in site.requests if path.startswith('/more/')] == [f'/more/{n}']
@@ -0,0 +1,175 @@
+"""The fetch engine against a local site: limits, concurrency, errors and keep-alive."""
+import asyncio
+import gzip
+import time
+import zlib
+
+import pytest
+
+import fetch_engine
+from fetch_engine import (BoundedDecoder, FetchStats, MAX_CONCURRENT_REQUESTS, crawl_site, crawl_site_sync,
+                          fetch_and_extract, fetch_page)
+from http_pool import pool
+from worker import extraction_error, parse_content
+
+from .conftest import LARGE_PAGE, PAGE_DELAY
+
+
+def crawl(site, depth, max_pages, **kwargs):
+    return pool.run(crawl_site(site.url('/p1'), depth, max_pages, parse_content, extraction_error, **kwargs))
+
+
+def test_fetch_page(site):
+    fetched = pool.run(fetch_page(site.url('/p1'), FetchStats()))
+    assert fetched['status_code'] == 200
+    assert fetched['content_type'].startswith('text/html')
+    assert b'<h1>Page 1</h1>' in fetched['body']
+    assert not fetched['skipped'] and not fetched['truncated']
+
+
+def test_fetch_page_skips_non_html_without_reading_it(site):
+    fetched = pool.run(fetch_page(site.url('/image.png'), FetchStats()))
+    assert fetched['skipped']
+    assert fetched['body'] == b''
+
+
+def test_fetch_page_raises_for_error_status(site):
+    with pytest.raises(Exception, match='500'):
+        pool.run(fetch_page(site.url('/broken'), FetchStats()))
+
+
+def test_fetch_and_extract(site):
+    async def run():
+        return await fetch_and_extract(asyncio.Semaphore(1), FetchStats(), site.url('/p2'),
+                                       parse_content, extraction_error)
+
+    page = pool.run(run())
+    assert page['title'] == 'Page 2'
+    assert [link['url'] for link in page['links'] if link['internal']] == [
+        site.url('/p4'), site.url('/p5'), site.url('/broken')]
+    assert page['bytes_transferred'] > 0
+
+
+def test_fetch_and_extract_turns_errors_into_entries(site):
+    async def run(path):
+        return await fetch_and_extract(asyncio.Semaphore(1), FetchStats(), site.url(path),
+                                       parse_content, extraction_error)
+
+    assert '500' in pool.run(run('/broken'))['error']
+    assert 'non-HTML' in pool.run(run('/image.png'))['error']
+
+
+def test_crawl_respects_depth(site):
+    result = crawl(site, depth=2, max_pages=50)
+    # /p1, its two children and the broken link they share
+    assert sorted(result['crawled_urls']) == sorted(site.url(path) for path in ('/p1', '/p2', '/p3', '/broken'))
+    assert result['depth_reached'] == 2
+    assert site.fetched('/p4') == 0
+
+
+def test_crawl_respects_max_pages(site):
+    result = crawl(site, depth=10, max_pages=5)
+    assert len(result['pages']) == 5
+    assert len(site.requests) - site.fetched('/robots.txt') == 5
+
+
+def test_crawl_records_error_pages(site):
+    result = crawl(site, depth=2, max_pages=50)
+    errors = [page for page in result['pages'] if 'error' in page]
+    assert [page['url'] for page in errors] == [site.url('/broken')]
+    # The broken link is found on two pages but fetched once
+    assert site.fetched('/broken') == 1
+
+
+def test_crawl_fetches_each_level_concurrently(site):
+    started = time.monotonic()
+    result = crawl(site, depth=4, max_pages=15)
+    elapsed = time.monotonic() - started
+    assert len(result['pages']) == 15
+    # 14 tree pages in four levels; one at a time they would take 14 * PAGE_DELAY
+    assert elapsed < 8 * PAGE_DELAY
+    assert 1 < site.max_in_flight <= MAX_CONCURRENT_REQUESTS
+
+
+def test_crawl_concurrency_limit(site):
+    crawl(site, depth=3, max_pages=10, concurrency=1)
+    assert site.max_in_flight == 1
+
+
+def test_crawl_reuses_connections(site):
+    result = crawl(site, depth=4, max_pages=15, concurrency=2)
+    connections = result['connections']
+    assert connections['new_connections'] <= 2
+    assert connections['reused_connections'] >= 13
+
+
+def test_crawl_site_sync(site):
+    seen = []
+    result = crawl_site_sync(site.url('/p1'), 3, 10, parse_content, extraction_error,
+                             on_page=lambda position, page: seen.append((position, page['url'])))
+    assert len(result['pages']) == 8
+    assert sorted(seen) == sorted(enumerate(page['url'] for page in result['pages']))
+    assert result['pages'][0]['url'] == site.url('/p1')
+
+
+def test_error_entries_keep_the_http_status(site):
+    async def run():
+        return await fetch_and_extract(asyncio.Semaphore(1), FetchStats(), site.url('/p999'),
+                                       parse_content, extraction_error)
+
+    page = pool.run(run())
+    assert page['status_code'] == 404 and 'error' in page
+
+
+def test_crawl_reports_whether_it_was_exhaustive(site):
+    assert not crawl(site, depth=10, max_pages=5)['exhaustive']
+    assert not crawl(site, depth=2, max_pages=50)['exhaustive']
+    # /p32 is a leaf: it only links to /broken, which links nowhere
+    leaf = pool.run(crawl_site(site.url('/p32'), 5, 50, parse_content, extraction_error))
+    assert leaf['exhaustive'] and leaf['depth_reached'] == 2
+
+
+@pytest.mark.parametrize('encoding,compress', [
+    ('gzip', gzip.compress),
+    ('deflate', zlib.compress),
+    # Raw deflate, without the zlib header some servers leave out
+    ('deflate', lambda data: zlib.compress(data)[2:-4]),
+])
+def test_bounded_decoder_never_inflates_past_the_limit(encoding, compress):
+    decoder = BoundedDecoder(encoding)
+    body = b'a' * 1_000_000
+    assert decoder.decode(compress(body), 1000) == b'a' * 1000
+
+
+def test_bounded_decoder_rejects_unknown_encodings():
+    assert BoundedDecoder(None).decode(b'abc', 2) == b'ab'
+    with pytest.raises(ValueError, match='br'):
+        BoundedDecoder('br')
+
+
+@pytest.mark.parametrize('path', ['/large', '/large.gz'])
+def test_oversized_bodies_are_truncated(site, monkeypatch, path):
+    monkeypatch.setattr(fetch_engine, 'MAX_RESPONSE_BYTES', 100_000)
+    fetched = pool.run(fetch_page(site.url(path), FetchStats()))
+    assert fetched['truncated']
+    assert fetched['body'] == LARGE_PAGE[:100_000]
+    # Reading stops at the cap instead of draining the rest of the response
+    assert fetched['bytes_transferred'] < len(LARGE_PAGE) // 2
+
+
+def test_bodies_within_the_limit_are_read_whole(site):
+    fetched = pool.run(fetch_page(site.url('/large.gz'), FetchStats()))
+    assert not fetched['truncated']
+    assert fetched['body'] == LARGE_PAGE
+
+
+def test_pdf_responses_are_skipped_unread(site):
+    fetched = pool.run(fetch_page(site.url('/report.pdf'), FetchStats()))
+    assert fetched['skipped'] and fetched['content_type'] == 'application/pdf'
+    assert fetched['body'] == b'' and fetched['bytes_transferred'] == 0
+
+    async def run():
+        return await fetch_and_extract(asyncio.Semaphore(1), FetchStats(), site.url('/report.pdf'),
+                                       parse_content, extraction_error)
+
+    assert 'non-HTML content: application/pdf' in pool.run(run())['error']
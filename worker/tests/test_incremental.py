@@ -0,0 +1,118 @@
+"""What an incremental crawl reports as changed since the crawl it is compared with."""
+import asyncio
+
+from canonical import dedup_key
+from dedup import DuplicateDetector
+from fetch_engine import FetchStats, fetch_and_extract
+from http_pool import pool
+from worker import crawl_diff, extraction_error, parse_content
+
+BASE = 'https://example.com'
+
+
+def page(path, **fields):
+    return {'url': BASE + path, **fields}
+
+
+def crawl(pages, exhaustive=True, not_kept=()):
+    return {
+        'pages': pages,
+        'crawled_urls': [entry['url'] for entry in pages] + [BASE + path for path in not_kept],
+        'aliases': [{'url': BASE + path, 'duplicate_of': BASE + '/'} for path in not_kept],
+        'exhaustive': exhaustive
+    }
+
+
+PREVIOUS = [page('/'), page('/a'), page('/b'), page('/c'), page('/broken', error='HTTP 500')]
+
+
+def test_added_changed_and_unchanged():
+    diff = crawl_diff('t1', PREVIOUS, crawl([
+        page('/', change='unchanged'), page('/a', change='changed'), page('/new', change='added'),
+        page('/b', change='unchanged'), page('/c', change='unchanged')
+    ]))
+    assert diff['added'] == [BASE + '/new']
+    assert diff['changed'] == [BASE + '/a']
+    assert diff['unchanged'] == 3
+    assert diff['removed'] == diff['errored'] == diff['not_recrawled'] == []
+
+
+def test_pages_no_longer_reached_are_removed_by_an_exhaustive_crawl():
+    diff = crawl_diff('t1', PREVIOUS, crawl([page('/', change='unchanged'), page('/a', change='unchanged')]))
+    assert diff['removed'] == [BASE + '/b', BASE + '/c']
+    assert diff['not_recrawled'] == []
+
+
+def test_pages_beyond_the_limits_are_not_removed():
+    diff = crawl_diff('t1', PREVIOUS, crawl([page('/', change='unchanged'), page('/a', change='unchanged')],
+                                            exhaustive=False))
+    assert diff['removed'] == []
+    assert diff['not_recrawled'] == [BASE + '/b', BASE + '/c']
+
+
+def test_gone_pages_are_removed_and_other_failures_errored():
+    diff = crawl_diff('t1', PREVIOUS, crawl([
+        page('/', change='unchanged'), page('/a', error='404 Not Found', status_code=404),
+        page('/b', error='410 Gone', status_code=410), page('/c', error='timed out'),
+        page('/broken', error='HTTP 500', status_code=500), page('/other', error='404', status_code=404)
+    ]))
+    assert diff['removed'] == [BASE + '/a', BASE + '/b']
+    # /broken already failed last time and /other was never known
+    assert diff['errored'] == [BASE + '/c']
+
+
+def test_duplicates_are_not_removed():
+    diff = crawl_diff('t1', PREVIOUS, crawl([page('/', change='unchanged'), page('/a', change='unchanged')],
+                                            not_kept=('/b', '/c')))
+    assert diff['removed'] == []
+    assert diff['duplicates'] == [BASE + '/b', BASE + '/c']
+
+
+def test_pages_that_failed_last_time_are_recovered_not_added():
+    diff = crawl_diff('t1', PREVIOUS, crawl([
+        page('/', change='unchanged'), page('/a', change='unchanged'), page('/b', change='unchanged'),
+        page('/c', change='unchanged'), page('/broken', change='added'), page('/new', change='added')
+    ]))
+    assert diff['recovered'] == [BASE + '/broken']
+    assert diff['added'] == [BASE + '/new']
+
+
+def test_last_crawls_duplicates_are_known_urls():
+    previous_aliases = [{'url': BASE + '/copy', 'duplicate_of': BASE + '/'},
+                        {'url': BASE + '/print', 'duplicate_of': BASE + '/a'},
+                        {'url': BASE + '/old', 'duplicate_of': BASE + '/a'}]
+    pages = [page(path, change='unchanged') for path in ('/', '/a', '/b', '/c')] + [page('/print', change='added')]
+    diff = crawl_diff('t1', PREVIOUS, crawl(pages, not_kept=('/copy',)), previous_aliases)
+    # Still a duplicate, a page of its own now, and no longer reached
+    assert diff['duplicates'] == [BASE + '/copy']
+    assert diff['added'] == [BASE + '/print']
+    assert diff['removed'] == [BASE + '/old']
+    diff = crawl_diff('t1', PREVIOUS, crawl(pages, exhaustive=False, not_kept=('/copy',)), previous_aliases)
+    assert diff['not_recrawled'] == [BASE + '/old']
+
+
+def test_reused_pages_get_a_fresh_scraped_at(site):
+    async def fetch(previous=None):
+        return await fetch_and_extract(asyncio.Semaphore(1), FetchStats(), site.url('/p2'),
+                                       parse_content, extraction_error, previous=previous)
+
+    first = pool.run(fetch())
+    first['scraped_at'] = '2000-01-01T00:00:00'
+    again = pool.run(fetch({dedup_key(first['url']): first}))
+    assert again['change'] == 'unchanged'
+    assert again['scraped_at'] > first['scraped_at']
+
+
+def test_not_modified_pages_still_catch_later_duplicates(site):
+    async def fetch(url, dedup, previous=None):
+        return await fetch_and_extract(asyncio.Semaphore(1), FetchStats(), url, parse_content, extraction_error,
+                                       dedup=dedup, previous=previous)
+
+    first = pool.run(fetch(site.url('/cached'), DuplicateDetector()))
+    previous = {dedup_key(first['url']): first}
+    dedup = DuplicateDetector()
+    again = pool.run(fetch(site.url('/cached'), dedup, previous))
+    assert again['not_modified'] and again['change'] == 'unchanged'
+    # The same body under another URL, fetched in full, is a duplicate of the 304
+    copy = pool.run(fetch(site.url('/cached?copy'), dedup, previous))
+    assert copy['duplicate_of'] == site.url('/cached') and copy['match'] == 'exact'
@@ -0,0 +1,86 @@
+"""The ``PageIndex`` analyzers against the tree-walking ones they replaced."""
+from pathlib import Path
+
+import pytest
+
+from page_index import PageIndex, has_attr_value, has_class, has_tag_name
+from parsers import make_soup
+from worker import EnhancedWebCrawler
+
+from .legacy_analyzers import LegacyAnalyzers
+
+CORPUS = Path(__file__).parent / 'parser_corpus'
+URL = 'https://example.com/page'
+
+# Markup the analyzers treat specially: multi-valued rel/class, nested
+# breadcrumbs, tables and forms, several footers, links without href
+EDGE_CASES = """<html lang="vi"><head><title> Hello </title><meta name="description" content="d">
+<meta name="keywords" content="k"><meta property="og:title" content="T"><meta property="og:x">
+<meta property="twitter:y" content="z"><meta name="robots" content="index">
+<link rel="alternate canonical" href="/c"><link rel="canonical" href="/c2">
+<script type="application/ld+json">{"@type": "Org"}</script><script type="application/ld+json">bad</script></head>
+<body><nav class="x"><a href="/1">One</a><div><a href="/2">Two</a></div><a>nohref</a></nav>
+<div class="menu"><a href="/m">M</a></div>
+<ul class="breadcrumb foo"><li><a href="/">Home</a></li><li><div class="breadcrumb"><a href="/b">B</a></div></li></ul>
+<div aria-label="breadcrumb"><a href="z">Z</a></div>
+<h1>A</h1><h2>B</h2><h3>C</h3><h1>D</h1>
+<p>Email me at a.b@ex.com or call 0912345678. Đây là tiếng Việt ạ ả ã ấ ầ ẩ ẫ ậ ắ ằ ẳ.</p><p></p><p>  </p>
+<a href="https://facebook.com/x">fb</a><a href="https://youtu.be/y">yt</a><a href="">empty</a>
+<img src="/i.png"><img><iframe src="v"></iframe><video></video>
+<form action="/s" method="post"><input name="q" required><div><textarea name="t"></textarea>
+<select name="s"></select></div><input type="hidden" name="h"></form><form></form>
+<table><tr><th>H1</th><th>H2</th></tr><tr><td><table><tr><th>in</th></tr></table></td></tr></table><table></table>
+<footer><a href="/f1">F1</a><p><a href="/f2">F2</a></p><a>x</a></footer><footer><a href="/f3">F3</a></footer>
+</body></html>"""
+
+NAV_CLASSES = """<html><body><div class='nav-breadcrumb'><a href=1>1</a></div>
+<div class='navigation'><a href=2>2</a></div><div class='nav'><a href=3>3</a><nav><a href=4>4</a></nav></div>
+</body></html>"""
+
+PAGES = {path.stem: path.read_bytes() for path in sorted(CORPUS.glob('*.html'))}
+PAGES.update({'edge_cases': EDGE_CASES.encode(), 'nav_classes': NAV_CLASSES.encode(), 'empty': b''})
+
+
+def analyses(soup, crawler, index=None):
+    extra = () if index is None else (index,)
+    return {
+        'seo': crawler.analyze_seo(soup, URL, *extra),
+        'social': crawler.detect_social_media(soup, *extra),
+        'contact': crawler.extract_contact_info(soup, *extra),
+        'quality': crawler.analyze_content_quality(soup, *extra),
+        'structured': crawler.extract_structured_data(soup, *extra),
+    }
+
+
+def unordered(analysis):
+    # The social and contact lists come out of a set, in no particular order
+    for section in ('social', 'contact'):
+        analysis[section] = {key: sorted(values) for key, values in analysis[section].items()}
+    return analysis
+
+
+@pytest.mark.parametrize('backend', ['html.parser', 'lxml'])
+@pytest.mark.parametrize('name', sorted(PAGES))
+def test_analyzers_match_the_legacy_ones(name, backend):
+    legacy = analyses(make_soup(PAGES[name], backend), LegacyAnalyzers())
+    soup = make_soup(PAGES[name], backend)
+    assert unordered(analyses(soup, EnhancedWebCrawler(), PageIndex(soup))) == unordered(legacy)
+
+
+@pytest.mark.parametrize('name', sorted(PAGES))
+def test_lookups_match_beautifulsoup(name):
+    soup = make_soup(PAGES[name])
+    index = PageIndex(soup)
+    assert index.elements == soup.find_all(True)
+    assert index.text == soup.get_text()
+    assert index.find_all('h1', 'h2', 'h3') == soup.find_all(['h1', 'h2', 'h3'])
+    assert index.find('title') == soup.find('title')
+    assert index.first_with_attr('meta', 'name', 'description') == soup.find('meta', attrs={'name': 'description'})
+    assert index.find_with_attr('link', 'rel', 'canonical') == soup.find_all('link', attrs={'rel': 'canonical'})
+    assert index.with_attr('a', 'href') == soup.find_all('a', href=True)
+    for form in soup.find_all('form'):
+        assert index.descendants(form, 'input', 'textarea', 'select') == form.find_all(['input', 'textarea', 'select'])
+    for selector, predicate in (('nav a', has_tag_name('nav')), ('.breadcrumb a', has_class('breadcrumb')),
+                                ('[aria-label="breadcrumb"] a', has_attr_value('aria-label', 'breadcrumb'))):
+        assert index.inside('a', predicate) == soup.select(selector)
+
@@ -0,0 +1,95 @@
+"""Both HTML parser backends over the same corpus of pages.
+
+Well-formed pages must extract to the same fields. The malformed pages are
+the differences documented in ``parsers.py``; they are expected to differ,
+and the tests fail if one of them stops differing (so the docs get updated).
+"""
+from pathlib import Path
+
+import pytest
+
+import parsers
+from page_index import PageIndex
+from worker import EnhancedWebCrawler, parse_content
+
+CORPUS = Path(__file__).parent / 'parser_corpus'
+URL = 'https://example.com/page'
+
+# page -> how lxml and html.parser repair it differently
+KNOWN_DIFFERENCES = {
+    'unclosed_p': 'html.parser nests an unclosed <p> in the one before it',
+    'nested_p': 'lxml closes the outer <p> where the inner one starts',
+    'nested_a': 'lxml closes the outer <a> where the inner one starts',
+    'nested_form': 'lxml closes the outer <form> where the inner one starts',
+}
+
+
+def corpus_pages():
+    return sorted(path.stem for path in CORPUS.glob('*.html'))
+
+
+def extract(name, backend, monkeypatch):
+    """Every extracted field of a corpus page, parsed with ``backend``"""
+    monkeypatch.setattr(parsers, 'HTML_PARSER', backend)
+    body = (CORPUS / f'{name}.html').read_bytes()
+    content = parse_content(URL, 200, body)
+    content.pop('scraped_at')
+    soup = parsers.make_soup(body)
+    index = PageIndex(soup)
+    crawler = EnhancedWebCrawler()
+    return {
+        'content': content,
+        'seo': crawler.analyze_seo(soup, URL, index),
+        'social': crawler.detect_social_media(soup, index),
+        'contact': crawler.extract_contact_info(soup, index),
+        'quality': crawler.analyze_content_quality(soup, index),
+        'structured': crawler.extract_structured_data(soup, index),
+    }
+
+
+@pytest.mark.parametrize('name', [
+    pytest.param(name, marks=pytest.mark.xfail(reason=KNOWN_DIFFERENCES[name], strict=True))
+    if name in KNOWN_DIFFERENCES else name
+    for name in corpus_pages()
+])
+def test_backends_extract_the_same_fields(name, monkeypatch):
+    assert extract(name, 'lxml', monkeypatch) == extract(name, 'html.parser', monkeypatch)
+
+
+def test_corpus_covers_every_known_difference():
+    assert set(KNOWN_DIFFERENCES) <= set(corpus_pages())
+
+
+def test_unclosed_paragraphs(monkeypatch):
+    lxml = extract('unclosed_p', 'lxml', monkeypatch)['content']['paragraphs']
+    builtin = extract('unclosed_p', 'html.parser', monkeypatch)['content']['paragraphs']
+    assert len(lxml) == 2
+    assert builtin[0].startswith(lxml[0]) and lxml[1] in builtin[0]
+
+
+def test_nested_paragraphs(monkeypatch):
+    lxml = extract('nested_p', 'lxml', monkeypatch)['content']['paragraphs']
+    builtin = extract('nested_p', 'html.parser', monkeypatch)['content']['paragraphs']
+    assert not any('tail of the outer' in text for text in lxml)
+    assert 'inner paragraph' in builtin[0] and 'tail of the outer' in builtin[0]
+
+
+def test_nested_links(monkeypatch):
+    def link_texts(backend):
+        links = extract('nested_a', backend, monkeypatch)['content']['links']
+        return {link['url']: link['text'] for link in links}
+
+    assert link_texts('lxml')['https://example.com/outer'] == 'outer link'
+    assert 'inner link' in link_texts('html.parser')['https://example.com/outer']
+
+
+def test_nested_forms(monkeypatch):
+    def input_counts(backend):
+        return [len(form['inputs']) for form in extract('nested_form', backend, monkeypatch)['structured']['forms']]
+
+    assert input_counts('lxml') == [1, 1]
+    assert input_counts('html.parser') == [2, 1]
+
+
+def test_unknown_backend_falls_back():
+    assert parsers.resolve_backend('html5lib') == parsers.FALLBACK_PARSER
@@ -0,0 +1,84 @@
+"""How long the politeness scheduler makes each request to a host wait."""
+from types import SimpleNamespace
+
+import pytest
+
+import politeness
+from politeness import HostBudget, PolitenessScheduler
+
+URL = 'https://example.com/page'
+
+
+def waits(budget, times):
+    return [round(budget.reserve(budget.updated + at), 3) for at in times]
+
+
+def test_burst_then_one_token_per_interval():
+    budget = HostBudget(delay=1, burst=3)
+    assert waits(budget, [0, 0, 0, 0, 0]) == [0, 0, 0, 1, 2]
+
+
+def test_tokens_refill_up_to_the_burst():
+    budget = HostBudget(delay=1, burst=3)
+    start = budget.updated
+    assert [budget.reserve(start) for _ in range(3)] == [0, 0, 0]
+    assert budget.reserve(start + 2) == 0
+    assert budget.reserve(start + 2) == 0
+    assert budget.reserve(start + 2) == pytest.approx(1)
+    # A long idle spell only ever buys back the burst, not a backlog of tokens
+    later = start + 600
+    assert [round(budget.reserve(later), 3) for _ in range(4)] == [0, 0, 0, 1]
+
+
+def test_crawl_delay_leaves_no_burst():
+    budget = HostBudget(delay=1, burst=3)
+    budget.set_crawl_delay(5)
+    assert waits(budget, [0, 0, 0, 0]) == [0, 5, 10, 15]
+    # Nor does it build one back up while idle
+    assert waits(budget, [600, 0]) == [0, 5]
+
+
+def test_set_robots_applies_crawl_delay_to_the_host():
+    scheduler = PolitenessScheduler(delay=1, burst=3)
+    scheduler.set_robots(URL, 'User-agent: *\nCrawl-delay: 5\n')
+    assert [scheduler.reserve(URL) for _ in range(4)] == pytest.approx([0, 5, 10, 15], abs=0.1)
+    assert scheduler.reserve('https://other.example/') == 0
+
+
+def test_backoff_status_grows_the_interval_and_success_decays_it():
+    scheduler = PolitenessScheduler(delay=1, burst=1, max_backoff=60)
+    budget = scheduler._budget('example.com')
+    scheduler.record_response(URL, 503)
+    assert budget.interval == 2
+    scheduler.record_response(URL, 429)
+    assert budget.interval == 3
+    scheduler.record_response(URL, 200)
+    assert budget.interval == 2
+
+
+def test_retry_after_blocks_the_host():
+    scheduler = PolitenessScheduler(delay=0, burst=3, max_backoff=60)
+    stats = politeness.WaitStats()
+    scheduler.record_response(URL, 429, '10', stats)
+    assert scheduler.reserve(URL) == pytest.approx(10, abs=0.1)
+    assert scheduler.reserve('https://other.example/') == 0
+    assert stats.backoffs == 1
+
+
+def test_retry_after_is_capped_by_max_backoff():
+    scheduler = PolitenessScheduler(delay=0, burst=3, max_backoff=30)
+    scheduler.record_response(URL, 503, '3600')
+    assert scheduler.reserve(URL) == pytest.approx(30, abs=0.1)
+
+
+def test_idle_hosts_are_pruned(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(politeness, 'time', SimpleNamespace(monotonic=lambda: clock[0]))
+    scheduler = PolitenessScheduler(delay=1, burst=3)
+    scheduler.reserve('https://idle.example/')
+    scheduler.reserve('https://busy.example/')
+    clock[0] += politeness.HOST_IDLE_TTL - 30
+    scheduler.record_response('https://busy.example/', 200)
+    clock[0] += 40
+    scheduler.reserve('https://new.example/')
+    assert set(scheduler._hosts) == {'busy.example', 'new.example'}
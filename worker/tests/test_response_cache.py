@@ -0,0 +1,25 @@
+"""Pages revalidated through the shared response cache."""
+import pytest
+
+import worker
+from response_cache import ResponseCache
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache(fakeredis.FakeRedis())
+    monkeypatch.setattr(worker, 'response_cache', cache)
+    return cache
+
+
+def test_enhanced_crawl_reuses_the_analysis_on_a_304(site, cache):
+    crawler = worker.EnhancedWebCrawler()
+    first = crawler.crawl_page_enhanced(site.url('/cached'))
+    again = crawler.crawl_page_enhanced(site.url('/cached'))
+    assert crawler.stats.cache.hits == 1 and crawler.stats.cache.pages_reused == 1
+    assert again['seo_analysis'] == first['seo_analysis']
+    # The transfer and crawl time are this request's, not the cached one's
+    assert first['bytes_transferred'] > 0 and again['bytes_transferred'] == 0
+    assert again['crawled_at'] > first['crawled_at']
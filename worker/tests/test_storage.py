@@ -0,0 +1,165 @@
+"""Worker-side writes against a throwaway SQLite database with the API's tables."""
+import pytest
+
+import storage
+from storage import Storage
+
+# The subset of the API's schema the worker writes to
+SCHEMA = """
+CREATE TABLE tasks (id TEXT PRIMARY KEY, url TEXT NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT,
+                    created_at TEXT, completed_at TEXT);
+CREATE TABLE pages (id INTEGER PRIMARY KEY, task_id TEXT NOT NULL, position INTEGER NOT NULL, url TEXT NOT NULL,
+                    status_code INTEGER, title TEXT, description TEXT, content_length INTEGER, error TEXT,
+                    scraped_at TEXT, paragraphs TEXT, extra TEXT);
+CREATE UNIQUE INDEX ux_pages_task_id_position ON pages (task_id, position);
+CREATE TABLE page_links (task_id TEXT, page_position INTEGER, position INTEGER, url TEXT NOT NULL, text TEXT,
+                         internal BOOLEAN, PRIMARY KEY (task_id, page_position, position));
+CREATE TABLE page_headings (task_id TEXT, page_position INTEGER, position INTEGER, level INTEGER, text TEXT,
+                            PRIMARY KEY (task_id, page_position, position));
+CREATE TABLE task_summaries (task_id TEXT PRIMARY KEY, total_pages INTEGER, error_pages INTEGER,
+                             total_links INTEGER, total_images INTEGER, total_content_size INTEGER,
+                             depth_reached INTEGER);
+CREATE TABLE task_analytics (task_id TEXT PRIMARY KEY, analytics TEXT NOT NULL, keyword_sketch TEXT,
+                             computed_at TEXT);
+CREATE TABLE task_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE daily_rollups (day TEXT PRIMARY KEY, created INTEGER NOT NULL DEFAULT 0,
+                            completed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,
+                            pages INTEGER NOT NULL DEFAULT 0, content_size INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE domain_rollups (domain TEXT PRIMARY KEY, tasks INTEGER NOT NULL DEFAULT 0,
+                             completed INTEGER NOT NULL DEFAULT 0, pages INTEGER NOT NULL DEFAULT 0,
+                             content_size INTEGER NOT NULL DEFAULT 0);
+"""
+
+PAGE = {
+    'url': 'https://example.com/', 'status_code': 200, 'title': 'Home', 'description': None,
+    'paragraphs': ['Hello'], 'headings': [{'level': 1, 'text': 'Home'}],
+    'links': [{'url': 'https://example.com/a', 'text': None, 'internal': True}],
+    'content_length': 5, 'scraped_at': '2026-01-01T00:00:00'
+}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = Storage(f"sqlite:///{tmp_path / 'app.db'}")
+    with db.transaction() as cursor:
+        cursor.executescript(SCHEMA)
+        cursor.execute("INSERT INTO tasks (id, url, status) VALUES ('t1', 'https://example.com/', 'running')")
+    monkeypatch.setattr(storage, 'storage', db)
+    return db
+
+
+def count(db, table):
+    with db.transaction() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def test_pages_round_trip(db):
+    assert storage.save_page('t1', 0, PAGE)
+    assert storage.load_task_pages('t1') == [PAGE]
+
+
+def test_nothing_is_written_for_a_deleted_task(db):
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM tasks WHERE id = 't1'")
+    assert not storage.save_page('t1', 0, PAGE)
+    storage.save_task_summary('t1', storage.summarize_pages([PAGE], 1))
+    storage.save_task_analytics('t1', {'pages': 1})
+    for table in ('pages', 'page_links', 'page_headings', 'task_summaries', 'task_analytics'):
+        assert count(db, table) == 0, table
+
+
+def task(db, task_id='t1'):
+    with db.transaction() as cursor:
+        cursor.execute("SELECT status, result, error, completed_at FROM tasks WHERE id = ?", (task_id,))
+        return cursor.fetchone()
+
+
+def counters(db):
+    with db.transaction() as cursor:
+        cursor.execute("SELECT name, value FROM task_counters WHERE name NOT LIKE '%:20%'")
+        return dict(cursor.fetchall())
+
+
+@pytest.fixture
+def batcher(db):
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE tasks SET status = 'pending'")
+        cursor.execute("INSERT INTO tasks (id, url, status) VALUES ('t2', 'https://example.org/', 'pending')")
+    # Flushed by the tests, not the background thread
+    return storage.StatusBatcher(db, interval=3600)
+
+
+def test_non_final_statuses_wait_for_the_flush_and_are_coalesced(db, batcher):
+    batcher.update('t1', 'running')
+    batcher.update('t2', 'running')
+    batcher.update('t1', 'retrying')
+    assert task(db)[0] == 'pending'
+    batcher.flush()
+    assert task(db, 't1')[0] == 'retrying' and task(db, 't2')[0] == 'running'
+    assert counters(db) == {'status:pending': -2, 'status:running': 1, 'status:retrying': 1}
+    batcher.flush()
+    assert counters(db) == {'status:pending': -2, 'status:running': 1, 'status:retrying': 1}
+
+
+def test_final_statuses_are_written_at_once_with_anything_pending(db, batcher):
+    storage.save_task_summary('t1', {'total_pages': 3, 'error_pages': 0, 'total_links': 0, 'total_images': 0,
+                                     'total_content_size': 120, 'depth_reached': 1})
+    batcher.update('t2', 'running')
+    batcher.update('t1', 'completed', result='{}')
+    status, result, _, completed_at = task(db, 't1')
+    assert (status, result) == ('completed', '{}') and completed_at
+    assert task(db, 't2')[0] == 'running'
+    assert counters(db) == {'status:pending': -2, 'status:running': 1, 'status:completed': 1,
+                            'pages': 3, 'content_size': 120}
+    with db.transaction() as cursor:
+        cursor.execute("SELECT tasks, completed, pages, content_size FROM domain_rollups WHERE domain = 'example.com'")
+        assert cursor.fetchone() == (0, 1, 3, 120)
+        cursor.execute("SELECT completed, failed, pages FROM daily_rollups")
+        assert cursor.fetchall() == [(1, 0, 3)]
+
+    batcher.update('t2', 'failed', error='boom')
+    assert task(db, 't2')[:3] == ('failed', None, 'boom')
+
+
+def test_a_failed_flush_is_retried_without_losing_newer_updates(db, batcher, monkeypatch):
+    batcher.update('t1', 'running')
+    batcher.update('t2', 'running')
+    write = batcher._write
+
+    def fail(cursor, task_id, update):
+        if task_id == 't2':
+            raise RuntimeError('database is locked')
+        write(cursor, task_id, update)
+
+    monkeypatch.setattr(batcher, '_write', fail)
+    with pytest.raises(RuntimeError):
+        batcher.flush()
+    # Rolled back as a whole: t1's write is gone too
+    assert task(db, 't1')[0] == 'pending'
+    monkeypatch.setattr(batcher, '_write', write)
+    batcher.update('t2', 'retrying')
+    batcher.flush()
+    assert task(db, 't1')[0] == 'running' and task(db, 't2')[0] == 'retrying'
+
+
+def test_listeners_hear_about_committed_batches(db, batcher):
+    heard = []
+
+    def broken_listener(task_ids):
+        raise RuntimeError('listener failed')
+
+    batcher.listeners.extend([broken_listener, lambda task_ids: heard.append((sorted(task_ids), task(db, 't1')[0]))])
+    batcher.update('t1', 'running')
+    batcher.update('t2', 'running')
+    assert heard == []
+    batcher.flush()
+    batcher.flush()
+    assert heard == [(['t1', 't2'], 'running')]
+
+
+def test_updates_for_a_deleted_task_are_dropped(db, batcher):
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM tasks WHERE id = 't2'")
+    batcher.update('t2', 'completed', result='{}')
+    assert counters(db) == {}
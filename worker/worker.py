@@ -1,17 +1,24 @@
 from celery import Celery
 import os
 import json
-import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-import time
 from datetime import datetime
-import sqlite3
 import redis
 import re
 from typing import Dict, List, Any, Optional
-import hashlib
-from collections import Counter
+import itertools
+
+from analytics import ContentAnalytics
+from canonical import canonicalize, dedup_key
+from dedup import DuplicateDetector
+from fetch_engine import FetchStats, NonHtmlContent, crawl_site_sync, fetch_url_sync, transfer_info
+from frontier import Frontier
+from page_index import PageIndex, has_attr_value, has_class, has_tag_name
+from parsers import make_soup
+from response_cache import ResponseCache
+from storage import (load_task_aliases, load_task_pages, save_page, save_task_analytics, save_task_summary,
+                     status_batcher, summarize_pages)
 
 # Celery app configuration
 app = Celery(
@@ -22,166 +29,180 @@ app = Celery(
 
 # Redis connection
 redis_client = redis.from_url(os.environ.get('REDIS_URL', 'redis://redis:6379/0'))
+# Fetched pages shared across tasks, revalidated with conditional GETs
+response_cache = ResponseCache(redis_client)
+# Statuses that take a page out of an incremental crawl's diff as removed
+GONE_STATUSES = (404, 410)
 
-def get_db_connection():
-    """Get database connection"""
-    # Share database file with API via volume
-    db_path = "/app/app.db"
-    return sqlite3.connect(db_path)
+def forget_cached_responses(task_ids):
+    """Drop the API's cached responses for tasks whose status just changed"""
+    try:
+        redis_client.delete(*[f"response_cache:{task_id}" for task_id in task_ids])
+    except Exception as e:
+        print(f"Error invalidating cached responses: {e}")
+
+status_batcher.listeners.append(forget_cached_responses)
+
+def publish_task_event(task_id, event, **data):
+    """Push a progress event to the API's /tasks/{id}/events subscribers"""
+    try:
+        redis_client.publish(f"task_events:{task_id}", json.dumps({"type": event, "task_id": task_id, **data}))
+    except Exception as e:
+        print(f"Error publishing task event: {e}")
 
 def update_task_status(task_id, status, result=None, error=None):
     """Update task status in database"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if status == "completed":
-            cursor.execute(
-                "UPDATE tasks SET status = ?, result = ?, completed_at = ? WHERE id = ?",
-                (status, result, datetime.utcnow().isoformat(), task_id)
-            )
-        elif status == "failed":
-            cursor.execute(
-                "UPDATE tasks SET status = ?, error = ?, completed_at = ? WHERE id = ?",
-                (status, error, datetime.utcnow().isoformat(), task_id)
-            )
-        else:
-            cursor.execute(
-                "UPDATE tasks SET status = ? WHERE id = ?",
-                (status, task_id)
-            )
-        
-        conn.commit()
-        conn.close()
+        status_batcher.update(task_id, status, result, error)
         print(f"Updated task {task_id} status to {status}")
     except Exception as e:
         print(f"Error updating task status: {e}")
+    # Finished statuses are already committed here, so subscribers can fetch the result
+    publish_task_event(task_id, "status", status=status, error=error)
 
 def extract_content(url):
     """Extract content from a single URL"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        print(f"Fetching URL: {url}")
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
+        fetched = fetch_url_sync(url, FetchStats())
+        if fetched['skipped']:
+            raise NonHtmlContent(f"Skipped non-HTML content: {fetched['content_type']}")
+        content = parse_content(url, fetched['status_code'], fetched['body'])
+        content.update(transfer_info(fetched))
+        return content
         
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract basic info
-        title = soup.find('title')
-        title_text = title.get_text().strip() if title else "No title"
-        
-        # Extract meta description
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        description = meta_desc.get('content', '') if meta_desc else ''
-        
-        # Extract headings
-        headings = []
-        for i in range(1, 4):  # h1 to h3 only
-            for heading in soup.find_all(f'h{i}'):
-                headings.append({
-                    'level': i,
-                    'text': heading.get_text().strip()
+    except Exception as e:
+        return extraction_error(url, e)
+
+def parse_content(url, status_code, body):
+    """Extract title, headings, paragraphs and links from a fetched page body"""
+    soup = make_soup(body)
+    
+    # Extract basic info
+    title = soup.find('title')
+    title_text = title.get_text().strip() if title else "No title"
+    
+    # Extract meta description
+    meta_desc = soup.find('meta', attrs={'name': 'description'})
+    description = meta_desc.get('content', '') if meta_desc else ''
+    
+    # Extract headings
+    headings = []
+    for i in range(1, 4):  # h1 to h3 only
+        for heading in soup.find_all(f'h{i}'):
+            headings.append({
+                'level': i,
+                'text': heading.get_text().strip()
+            })
+            if len(headings) >= 10:  # Limit headings
+                break
+    
+    # Extract some paragraphs
+    paragraphs = []
+    for p in soup.find_all('p'):
+        text = p.get_text().strip()
+        if text and len(text) > 20:  # Only meaningful paragraphs
+            paragraphs.append(text)
+            if len(paragraphs) >= 5:  # Limit paragraphs
+                break
+    
+    # Extract links, in canonical form so the crawl doesn't fetch the same page twice
+    links = []
+    page_host = urlparse(canonicalize(url)).netloc
+    for link in soup.find_all('a', href=True):
+        href = link.get('href', '')
+        text = link.get_text().strip()
+        if href and text:
+            full_url = canonicalize(href, url)
+            parsed = urlparse(full_url)
+            if parsed.scheme in ['http', 'https']:
+                links.append({
+                    'url': full_url,
+                    'text': text[:100],  # Limit text length
+                    'internal': parsed.netloc == page_host
                 })
-                if len(headings) >= 10:  # Limit headings
+                if len(links) >= 20:  # Limit links
                     break
-        
-        # Extract some paragraphs
-        paragraphs = []
-        for p in soup.find_all('p'):
-            text = p.get_text().strip()
-            if text and len(text) > 20:  # Only meaningful paragraphs
-                paragraphs.append(text)
-                if len(paragraphs) >= 5:  # Limit paragraphs
-                    break
-        
-        # Extract links
-        links = []
-        for link in soup.find_all('a', href=True):
-            href = link.get('href', '')
-            text = link.get_text().strip()
-            if href and text:
-                full_url = urljoin(url, href)
-                parsed = urlparse(full_url)
-                if parsed.scheme in ['http', 'https']:
-                    links.append({
-                        'url': full_url,
-                        'text': text[:100],  # Limit text length
-                        'internal': parsed.netloc == urlparse(url).netloc
-                    })
-                    if len(links) >= 20:  # Limit links
-                        break
-        
-        return {
-            'url': url,
-            'status_code': response.status_code,
-            'title': title_text,
-            'description': description,
-            'headings': headings,
-            'paragraphs': paragraphs,
-            'links': links,
-            'content_length': len(response.content),
-            'scraped_at': datetime.utcnow().isoformat()
-        }
-        
-    except Exception as e:
-        print(f"Error extracting content from {url}: {e}")
-        return {
-            'url': url,
-            'error': str(e),
-            'scraped_at': datetime.utcnow().isoformat()
-        }
+    
+    content = {
+        'url': url,
+        'status_code': status_code,
+        'title': title_text,
+        'description': description,
+        'headings': headings,
+        'paragraphs': paragraphs,
+        'links': links,
+        'content_length': len(body),
+        'scraped_at': datetime.utcnow().isoformat()
+    }
+    
+    canonical = soup.find('link', rel='canonical', href=True)
+    if canonical:
+        content['canonical_url'] = canonicalize(canonical['href'], url)
+    return content
+
+def extraction_error(url, error):
+    """Result entry for a page that could not be fetched or parsed"""
+    print(f"Error extracting content from {url}: {error}")
+    return {
+        'url': url,
+        'error': str(error),
+        'scraped_at': datetime.utcnow().isoformat()
+    }
 
 @app.task(bind=True)
-def crawl_url(self, task_id, url, depth=1, max_pages=10):
-    """Main crawling task"""
+def crawl_url(self, task_id, url, depth=1, max_pages=10, previous_task_id=None):
+    """Main crawling task; with previous_task_id, only pages changed since that task are processed"""
     try:
         print(f"Starting crawl task {task_id} for URL: {url}")
         update_task_status(task_id, "running")
         
-        crawled_urls = set()
-        to_crawl = [url]
-        results = []
-        current_depth = 0
-        
-        while to_crawl and len(results) < max_pages and current_depth < depth:
-            current_batch = to_crawl.copy()
-            to_crawl = []
-            
-            for current_url in current_batch:
-                if current_url in crawled_urls or len(results) >= max_pages:
-                    continue
-                
-                print(f"Crawling: {current_url}")
-                content = extract_content(current_url)
-                results.append(content)
-                crawled_urls.add(current_url)
-                
-                # Collect internal links for next level
-                if current_depth < depth - 1 and 'links' in content and not content.get('error'):
-                    for link in content['links']:
-                        if (link.get('internal') and 
-                            link['url'] not in crawled_urls and 
-                            link['url'] not in to_crawl):
-                            to_crawl.append(link['url'])
-                
-                # Be respectful - small delay
-                time.sleep(1)
-            
-            current_depth += 1
-        
-        # Prepare final result
+        # Incremental re-crawl: the earlier task's pages (and their validators) by URL
+        previous = None
+        if previous_task_id:
+            previous_pages = load_task_pages(previous_task_id)
+            previous = {dedup_key(page['url']): page for page in previous_pages if not page.get('error')}
+            print(f"Incremental crawl against task {previous_task_id}: {len(previous)} known pages")
+        
+        # Pages go to the pages table as soon as each one is crawled, and into
+        # the task's analytics at the same time
+        analytics = ContentAnalytics()
+        pages_done = itertools.count(1)
+        
+        def store_page(position, page):
+            if not save_page(task_id, position, page):
+                return
+            analytics.add_page(page)
+            publish_task_event(task_id, "page", position=position, url=page.get('url'),
+                               status_code=page.get('status_code'), error=page.get('error'),
+                               pages_done=next(pages_done), max_pages=max_pages)
+        
+        # Pages serving the same (or nearly the same) body are kept as aliases only
+        dedup = DuplicateDetector()
+        crawl = crawl_site_sync(url, depth, max_pages, parse_content, extraction_error, store_page, dedup,
+                                response_cache, previous)
+        results = crawl['pages']
+        
+        # Prepare final result; the pages themselves are already stored
         final_result = {
             'task_id': task_id,
             'total_pages': len(results),
-            'crawled_urls': list(crawled_urls),
-            'pages': results,
-            'depth_reached': current_depth,
+            'crawled_urls': crawl['crawled_urls'],
+            'pages_stored': True,
+            'depth_reached': crawl['depth_reached'],
+            'aliases': crawl['aliases'],
+            'dedup': dedup.report(),
+            'politeness': crawl['politeness'],
+            'connections': crawl['connections'],
+            'cache': crawl['cache'],
             'completed_at': datetime.utcnow().isoformat()
         }
+        if previous is not None:
+            final_result['diff'] = crawl_diff(previous_task_id, previous_pages, crawl,
+                                              load_task_aliases(previous_task_id))
+        
+        # Aggregates for task listings, stored before the task shows as completed
+        save_task_summary(task_id, summarize_pages(results, crawl['depth_reached']))
+        save_task_analytics(task_id, analytics.report(), analytics.keyword_sketch())
         
         # Update task as completed
         result_json = json.dumps(final_result)
@@ -196,6 +217,48 @@ def crawl_url(self, task_id, url, depth=1, max_pages=10):
         update_task_status(task_id, "failed", error=error_msg)
         raise
 
+def crawl_diff(previous_task_id, previous_pages, crawl, previous_aliases=()):
+    """Pages added, changed and removed since the previous crawl of the site.
+
+    A known page is removed when it now answers 404/410, or when this crawl
+    covered the whole site (``exhaustive``) without reaching it. Known pages
+    that failed otherwise are ``errored``; those the crawl's limits kept it
+    from reaching are ``not_recrawled`` rather than removed. A page that
+    failed last time and works now is ``recovered``, not added.
+
+    URLs kept only as duplicates (aliases) have no page of their own:
+    ``duplicates`` lists this crawl's, and last crawl's aliases count as
+    known URLs for ``removed``/``not_recrawled``. One that has a page of its
+    own now is ``added``, there being no earlier page to compare it with.
+    """
+    known = {dedup_key(page['url']): page['url'] for page in previous_pages if not page.get('error')}
+    failed = {dedup_key(page['url']) for page in previous_pages if page.get('error')}
+    changes = {'added': [], 'changed': [], 'unchanged': [], 'recovered': []}
+    removed, errored = [], []
+    for page in crawl['pages']:
+        change = page.get('change')
+        if change == 'added' and dedup_key(page['url']) in failed:
+            change = 'recovered'
+        if change in changes:
+            changes[change].append(page['url'])
+        elif page.get('error') and dedup_key(page['url']) in known:
+            (removed if page.get('status_code') in GONE_STATUSES else errored).append(page['url'])
+    for alias in previous_aliases:
+        known.setdefault(dedup_key(alias['url']), alias['url'])
+    crawled = {dedup_key(crawled_url) for crawled_url in crawl['crawled_urls']}
+    missing = [known_url for key, known_url in known.items() if key not in crawled]
+    return {
+        'previous_task_id': previous_task_id,
+        'added': changes['added'],
+        'changed': changes['changed'],
+        'recovered': changes['recovered'],
+        'removed': removed + missing if crawl['exhaustive'] else removed,
+        'errored': errored,
+        'not_recrawled': [] if crawl['exhaustive'] else missing,
+        'duplicates': [alias['url'] for alias in crawl.get('aliases', [])],
+        'unchanged': len(changes['unchanged'])
+    }
+
 @app.task
 def health_check():
     """Simple health check task"""
@@ -216,13 +279,15 @@ app.conf.update(
 
 class EnhancedWebCrawler:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
+        # Requests go through the worker's shared connection pool
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        }
+        self.stats = FetchStats()
         
-    def analyze_seo(self, soup: BeautifulSoup, url: str) -> Dict[str, Any]:
+    def analyze_seo(self, soup: BeautifulSoup, url: str, index: Optional[PageIndex] = None) -> Dict[str, Any]:
         """Phân tích SEO của trang web"""
+        index = index or PageIndex(soup)
         seo_analysis = {
             "title_length": 0,
             "meta_description": "",
@@ -239,35 +304,35 @@ class EnhancedWebCrawler:
         }
         
         # Title analysis
-        title_tag = soup.find('title')
+        title_tag = index.find('title')
         if title_tag:
             seo_analysis["title_length"] = len(title_tag.get_text().strip())
             
         # Meta description
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
+        meta_desc = index.first_with_attr('meta', 'name', 'description')
         if meta_desc:
             desc = meta_desc.get('content', '')
             seo_analysis["meta_description"] = desc
             seo_analysis["meta_description_length"] = len(desc)
             
         # Heading counts
-        seo_analysis["h1_count"] = len(soup.find_all('h1'))
-        seo_analysis["h2_count"] = len(soup.find_all('h2'))
+        seo_analysis["h1_count"] = len(index.find_all('h1'))
+        seo_analysis["h2_count"] = len(index.find_all('h2'))
         
         # Meta keywords
-        meta_keywords = soup.find('meta', attrs={'name': 'keywords'})
+        meta_keywords = index.first_with_attr('meta', 'name', 'keywords')
         if meta_keywords:
             seo_analysis["meta_keywords"] = meta_keywords.get('content', '')
             
         # Open Graph tags
-        og_tags = soup.find_all('meta', attrs={'property': lambda x: x and x.startswith('og:')})
+        og_tags = [tag for tag in index.with_attr('meta', 'property') if tag['property'].startswith('og:')]
         for tag in og_tags:
             prop = tag.get('property', '')
             content = tag.get('content', '')
             seo_analysis["og_tags"][prop] = content
             
         # Schema markup
-        scripts = soup.find_all('script', attrs={'type': 'application/ld+json'})
+        scripts = index.find_with_attr('script', 'type', 'application/ld+json')
         for script in scripts:
             try:
                 schema_data = json.loads(script.string)
@@ -276,24 +341,25 @@ class EnhancedWebCrawler:
                 pass
                 
         # Canonical URL
-        canonical = soup.find('link', attrs={'rel': 'canonical'})
-        if canonical:
-            seo_analysis["canonical_url"] = canonical.get('href', '')
+        canonical = index.first_with_attr('link', 'rel', 'canonical')
+        if canonical and canonical.get('href'):
+            seo_analysis["canonical_url"] = canonicalize(canonical['href'], url)
             
         # Robots meta
-        robots = soup.find('meta', attrs={'name': 'robots'})
+        robots = index.first_with_attr('meta', 'name', 'robots')
         if robots:
             seo_analysis["robots_meta"] = robots.get('content', '')
             
         # Language
-        html_tag = soup.find('html')
+        html_tag = index.find('html')
         if html_tag:
             seo_analysis["lang"] = html_tag.get('lang', '')
             
         return seo_analysis
     
-    def detect_social_media(self, soup: BeautifulSoup) -> Dict[str, List[str]]:
+    def detect_social_media(self, soup: BeautifulSoup, index: Optional[PageIndex] = None) -> Dict[str, List[str]]:
         """Phát hiện liên kết mạng xã hội"""
+        index = index or PageIndex(soup)
         social_patterns = {
             'facebook': [r'facebook\.com', r'fb\.com'],
             'twitter': [r'twitter\.com', r'x\.com'],
@@ -310,7 +376,7 @@ class EnhancedWebCrawler:
         social_links = {platform: [] for platform in social_patterns.keys()}
         
         # Find all links
-        links = soup.find_all('a', href=True)
+        links = index.with_attr('a', 'href')
         for link in links:
             href = link.get('href', '').lower()
             for platform, patterns in social_patterns.items():
@@ -321,15 +387,16 @@ class EnhancedWebCrawler:
                         
         return {k: list(set(v)) for k, v in social_links.items() if v}
     
-    def extract_contact_info(self, soup: BeautifulSoup) -> Dict[str, List[str]]:
+    def extract_contact_info(self, soup: BeautifulSoup, index: Optional[PageIndex] = None) -> Dict[str, List[str]]:
         """Trích xuất thông tin liên hệ"""
+        index = index or PageIndex(soup)
         contact_info = {
             'emails': [],
             'phones': [],
             'addresses': []
         }
         
-        text_content = soup.get_text()
+        text_content = index.text
         
         # Email pattern
         email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
@@ -353,8 +420,9 @@ class EnhancedWebCrawler:
         
         return contact_info
     
-    def analyze_content_quality(self, soup: BeautifulSoup) -> Dict[str, Any]:
+    def analyze_content_quality(self, soup: BeautifulSoup, index: Optional[PageIndex] = None) -> Dict[str, Any]:
         """Phân tích chất lượng nội dung"""
+        index = index or PageIndex(soup)
         quality_metrics = {
             'word_count': 0,
             'paragraph_count': 0,
@@ -367,15 +435,15 @@ class EnhancedWebCrawler:
         }
         
         # Text analysis
-        text_content = soup.get_text()
+        text_content = index.text
         words = re.findall(r'\b\w+\b', text_content)
         quality_metrics['word_count'] = len(words)
         
         # Structural elements
-        quality_metrics['paragraph_count'] = len(soup.find_all('p'))
-        quality_metrics['image_count'] = len(soup.find_all('img'))
-        quality_metrics['video_count'] = len(soup.find_all(['video', 'iframe']))
-        quality_metrics['link_count'] = len(soup.find_all('a', href=True))
+        quality_metrics['paragraph_count'] = len(index.find_all('p'))
+        quality_metrics['image_count'] = len(index.find_all('img'))
+        quality_metrics['video_count'] = len(index.find_all('video', 'iframe'))
+        quality_metrics['link_count'] = len(index.with_attr('a', 'href'))
         
         # Simple readability (average words per sentence)
         sentences = re.split(r'[.!?]+', text_content)
@@ -391,8 +459,9 @@ class EnhancedWebCrawler:
             
         return quality_metrics
     
-    def extract_structured_data(self, soup: BeautifulSoup) -> Dict[str, Any]:
+    def extract_structured_data(self, soup: BeautifulSoup, index: Optional[PageIndex] = None) -> Dict[str, Any]:
         """Trích xuất dữ liệu có cấu trúc"""
+        index = index or PageIndex(soup)
         structured_data = {
             'breadcrumbs': [],
             'navigation_menu': [],
@@ -402,21 +471,23 @@ class EnhancedWebCrawler:
         }
         
         # Breadcrumbs
+        # '.breadcrumb a', '.breadcrumbs a', '[aria-label="breadcrumb"] a', ...
         breadcrumb_selectors = [
-            '.breadcrumb a', '.breadcrumbs a', '[aria-label="breadcrumb"] a',
-            '.navigation-path a', '.nav-breadcrumb a'
+            has_class('breadcrumb'), has_class('breadcrumbs'), has_attr_value('aria-label', 'breadcrumb'),
+            has_class('navigation-path'), has_class('nav-breadcrumb')
         ]
         
         for selector in breadcrumb_selectors:
-            breadcrumbs = soup.select(selector)
+            breadcrumbs = index.inside('a', selector)
             if breadcrumbs:
                 structured_data['breadcrumbs'] = [link.get_text().strip() for link in breadcrumbs]
                 break
         
         # Navigation menu
-        nav_selectors = ['nav a', '.navigation a', '.menu a', '.nav a']
+        # 'nav a', '.navigation a', '.menu a', '.nav a'
+        nav_selectors = [has_tag_name('nav'), has_class('navigation'), has_class('menu'), has_class('nav')]
         for selector in nav_selectors:
-            nav_links = soup.select(selector)
+            nav_links = index.inside('a', selector)
             if nav_links:
                 structured_data['navigation_menu'] = [
                     {'text': link.get_text().strip(), 'href': link.get('href', '')} 
@@ -425,16 +496,16 @@ class EnhancedWebCrawler:
                 break
         
         # Footer links
-        footer = soup.find('footer')
+        footer = index.find('footer')
         if footer:
-            footer_links = footer.find_all('a', href=True)
+            footer_links = [link for link in index.descendants(footer, 'a') if link.get('href') is not None]
             structured_data['footer_links'] = [
                 {'text': link.get_text().strip(), 'href': link.get('href', '')} 
                 for link in footer_links[:15]
             ]
         
         # Forms
-        forms = soup.find_all('form')
+        forms = index.find_all('form')
         for form in forms:
             form_data = {
                 'action': form.get('action', ''),
@@ -442,7 +513,7 @@ class EnhancedWebCrawler:
                 'inputs': []
             }
             
-            inputs = form.find_all(['input', 'textarea', 'select'])
+            inputs = index.descendants(form, 'input', 'textarea', 'select')
             for inp in inputs:
                 input_data = {
                     'type': inp.get('type', inp.name),
@@ -455,37 +526,54 @@ class EnhancedWebCrawler:
             structured_data['forms'].append(form_data)
         
         # Tables
-        tables = soup.find_all('table')
+        tables = index.find_all('table')
         for table in tables[:5]:  # Limit to 5 tables
             table_data = {
                 'headers': [],
                 'rows': 0
             }
             
-            headers = table.find_all('th')
+            headers = index.descendants(table, 'th')
             if headers:
                 table_data['headers'] = [th.get_text().strip() for th in headers]
             
-            table_data['rows'] = len(table.find_all('tr'))
+            table_data['rows'] = len(index.descendants(table, 'tr'))
             structured_data['tables'].append(table_data)
         
         return structured_data
     
-    def crawl_page_enhanced(self, url: str) -> Dict[str, Any]:
+    def crawl_page_enhanced(self, url: str, dedup: Optional[DuplicateDetector] = None) -> Dict[str, Any]:
         """Crawl trang với tính năng nâng cao"""
         try:
             print(f"🚀 Enhanced crawling: {url}")
             
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
+            response = fetch_url_sync(url, self.stats, self.headers, response_cache)
+            if response['skipped']:
+                raise NonHtmlContent(f"Skipped non-HTML content: {response['content_type']}")
+            
+            # Trang trùng nội dung: chỉ ghi alias, không phân tích lại
+            alias = dedup.check(url, response['body']) if dedup is not None else None
+            if alias is not None:
+                return alias
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            # 304: dùng lại kết quả phân tích đã lưu trong cache
+            entry = response.get('cache_entry')
+            cached = response_cache.cached_page(entry, 'crawl_page_enhanced') if entry is not None else None
+            if cached is not None:
+                self.stats.cache.pages_reused += 1
+                # Phân tích cũ, nhưng lần tải (304) và thời điểm crawl là của lần này
+                cached.update({'url': url, 'crawled_at': datetime.now().isoformat(), **transfer_info(response)})
+                return cached
+            
+            soup = make_soup(response['body'])
+            # Walk the tree once; every analyzer below reads from this index
+            index = PageIndex(soup)
             
             # Basic extraction
-            title = soup.find('title')
+            title = index.find('title')
             title_text = title.get_text().strip() if title else ""
             
-            meta_desc = soup.find('meta', attrs={'name': 'description'})
+            meta_desc = index.first_with_attr('meta', 'name', 'description')
             description = meta_desc.get('content', '') if meta_desc else ""
             
             # Enhanced extractions
@@ -493,24 +581,26 @@ class EnhancedWebCrawler:
                 'url': url,
                 'title': title_text,
                 'description': description,
-                'content_size': len(response.content),
-                'status_code': response.status_code,
+                'content_size': len(response['body']),
+                'status_code': response['status_code'],
                 'crawled_at': datetime.now().isoformat(),
+                **transfer_info(response),
                 
                 # Enhanced features
-                'seo_analysis': self.analyze_seo(soup, url),
-                'social_media': self.detect_social_media(soup),
-                'contact_info': self.extract_contact_info(soup),
-                'content_quality': self.analyze_content_quality(soup),
-                'structured_data': self.extract_structured_data(soup),
+                'seo_analysis': self.analyze_seo(soup, url, index),
+                'social_media': self.detect_social_media(soup, index),
+                'contact_info': self.extract_contact_info(soup, index),
+                'content_quality': self.analyze_content_quality(soup, index),
+                'structured_data': self.extract_structured_data(soup, index),
                 
                 # Original features
-                'headings': [h.get_text().strip() for h in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])],
-                'paragraphs': [p.get_text().strip() for p in soup.find_all('p') if p.get_text().strip()],
-                'links': [urljoin(url, link.get('href', '')) for link in soup.find_all('a', href=True)],
-                'images': [urljoin(url, img.get('src', '')) for img in soup.find_all('img', src=True)]
+                'headings': [h.get_text().strip() for h in index.find_all('h1', 'h2', 'h3', 'h4', 'h5', 'h6')],
+                'paragraphs': [text for text in (p.get_text().strip() for p in index.find_all('p')) if text],
+                'links': [canonicalize(link.get('href', ''), url) for link in index.with_attr('a', 'href')],
+                'images': [urljoin(url, img.get('src', '')) for img in index.with_attr('img', 'src')]
             }
             
+            response_cache.put_page(url, 'crawl_page_enhanced', page_data)
             return page_data
             
         except Exception as e:
@@ -521,10 +611,6 @@ class EnhancedWebCrawler:
                 'crawled_at': datetime.now().isoformat()
             }
 
-if __name__ == '__main__':
-    print("🔥 Enhanced Crawler Worker starting...")
-    app.start()
-
 @app.task(bind=True)
 def crawl_website_enhanced(self, task_id: str, url: str, max_depth: int = 2, max_pages: int = 10):
     """Enhanced crawling task với AI-powered features"""
@@ -537,43 +623,48 @@ def crawl_website_enhanced(self, task_id: str, url: str, max_depth: int = 2, max
             "progress": "0",
             "message": f"Starting enhanced crawl of {url}"
         })
+        publish_task_event(task_id, "status", status="running")
         
         crawler = EnhancedWebCrawler()
-        visited_urls = set()
         crawled_data = []
-        urls_to_visit = [(url, 0)]  # (url, depth)
-        
-        while urls_to_visit and len(crawled_data) < max_pages:
-            current_url, depth = urls_to_visit.pop(0)
-            
-            if current_url in visited_urls or depth > max_depth:
-                continue
-                
-            visited_urls.add(current_url)
+        aliases = []
+        dedup = DuplicateDetector()
+        frontier = Frontier(max_depth=max_depth, key=dedup_key)
+        frontier.add(canonicalize(url), 0)
+        domain = urlparse(canonicalize(url)).netloc
+        
+        # Duplicates don't count towards max_pages, but at most max_pages of them are fetched
+        while frontier and len(crawled_data) < max_pages and len(aliases) < max_pages:
+            current_url, depth = frontier.pop()
             
             # Update progress
             progress = int((len(crawled_data) / max_pages) * 100)
+            message = f"Crawling page {len(crawled_data) + 1}/{max_pages}: {current_url}"
             redis_client.hset(f"task:{task_id}", mapping={
                 "progress": str(progress),
-                "message": f"Crawling page {len(crawled_data) + 1}/{max_pages}: {current_url}"
+                "message": message
             })
+            publish_task_event(task_id, "progress", progress=progress, message=message, url=current_url)
             
             # Crawl page with enhanced features
-            page_data = crawler.crawl_page_enhanced(current_url)
+            page_data = crawler.crawl_page_enhanced(current_url, dedup)
+            if 'duplicate_of' in page_data:
+                aliases.append(page_data)
+                continue
             
+            publish_task_event(task_id, "page", url=current_url, error=page_data.get('error'),
+                               pages_done=len(crawled_data) + ('error' not in page_data), max_pages=max_pages)
             if 'error' not in page_data:
                 crawled_data.append(page_data)
                 
+                canonical_url = page_data['seo_analysis']['canonical_url']
+                if canonical_url:
+                    frontier.mark_seen(canonical_url)
+                
                 # Add new URLs to visit (only from same domain)
                 if depth < max_depth:
-                    domain = urlparse(url).netloc
-                    for link in page_data.get('links', []):
-                        link_domain = urlparse(link).netloc
-                        if link_domain == domain and link not in visited_urls:
-                            urls_to_visit.append((link, depth + 1))
-            
-            # Respectful crawling delay
-            time.sleep(1)
+                    frontier.extend((link for link in page_data.get('links', [])
+                                     if urlparse(link).netloc == domain), depth + 1)
         
         # Calculate summary statistics
         total_words = sum(page.get('content_quality', {}).get('word_count', 0) for page in crawled_data)
@@ -591,103 +682,21 @@ def crawl_website_enhanced(self, task_id: str, url: str, max_depth: int = 2, max
                 "total_images": total_images,
                 "total_links": total_links,
                 "domains_found": len(set(urlparse(page['url']).netloc for page in crawled_data)),
-                "avg_content_size": sum(page.get('content_size', 0) for page in crawled_data) // len(crawled_data) if crawled_data else 0
+                "avg_content_size": sum(page.get('content_size', 0) for page in crawled_data) // len(crawled_data) if crawled_data else 0,
+                "dedup": dedup.report(),
+                **crawler.stats.report()
             },
             "data": crawled_data,
+            "aliases": aliases,
             "completed_at": datetime.now().isoformat()
         }
         
-        # Store final results
-        redis_client.hset(f"task:{task_id}", mapping=completion_data)
-        
-        print(f"✅ Enhanced crawl task {task_id} completed successfully")
-        return {"task_id": task_id, "status": "completed", "pages_crawled": len(crawled_data)}
-        
-    except Exception as e:
-        error_msg = f"Enhanced crawl task failed: {str(e)}"
-        print(f"❌ {error_msg}")
-        
+        # Store final results; hash fields can't hold dicts or lists, so those go in as JSON
         redis_client.hset(f"task:{task_id}", mapping={
-            "status": "failed",
-            "progress": "0",
-            "message": error_msg,
-            "error": str(e),
-            "failed_at": datetime.now().isoformat()
+            key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+            for key, value in completion_data.items()
         })
-        
-        raise self.retry(exc=e, countdown=60, max_retries=3)
-    """Enhanced crawling task với AI-powered features"""
-    try:
-        print(f"🔥 Starting enhanced crawl task {task_id} for {url}")
-        
-        # Update task status
-        redis_client.hset(f"task:{task_id}", mapping={
-            "status": "running",
-            "progress": "0",
-            "message": f"Starting enhanced crawl of {url}"
-        })
-        
-        crawler = EnhancedWebCrawler()
-        visited_urls = set()
-        crawled_data = []
-        urls_to_visit = [(url, 0)]  # (url, depth)
-        
-        while urls_to_visit and len(crawled_data) < max_pages:
-            current_url, depth = urls_to_visit.pop(0)
-            
-            if current_url in visited_urls or depth > max_depth:
-                continue
-                
-            visited_urls.add(current_url)
-            
-            # Update progress
-            progress = int((len(crawled_data) / max_pages) * 100)
-            redis_client.hset(f"task:{task_id}", mapping={
-                "progress": str(progress),
-                "message": f"Crawling page {len(crawled_data) + 1}/{max_pages}: {current_url}"
-            })
-            
-            # Crawl page with enhanced features
-            page_data = crawler.crawl_page_enhanced(current_url)
-            
-            if 'error' not in page_data:
-                crawled_data.append(page_data)
-                
-                # Add new URLs to visit (only from same domain)
-                if depth < max_depth:
-                    domain = urlparse(url).netloc
-                    for link in page_data.get('links', []):
-                        link_domain = urlparse(link).netloc
-                        if link_domain == domain and link not in visited_urls:
-                            urls_to_visit.append((link, depth + 1))
-            
-            # Respectful crawling delay
-            time.sleep(1)
-        
-        # Calculate summary statistics
-        total_words = sum(page.get('content_quality', {}).get('word_count', 0) for page in crawled_data)
-        total_images = sum(page.get('content_quality', {}).get('image_count', 0) for page in crawled_data)
-        total_links = sum(page.get('content_quality', {}).get('link_count', 0) for page in crawled_data)
-        
-        # Enhanced completion data
-        completion_data = {
-            "status": "completed",
-            "progress": "100",
-            "message": f"Enhanced crawl completed! {len(crawled_data)} pages processed",
-            "summary": {
-                "pages_crawled": len(crawled_data),
-                "total_words": total_words,
-                "total_images": total_images,
-                "total_links": total_links,
-                "domains_found": len(set(urlparse(page['url']).netloc for page in crawled_data)),
-                "avg_content_size": sum(page.get('content_size', 0) for page in crawled_data) // len(crawled_data) if crawled_data else 0
-            },
-            "data": crawled_data,
-            "completed_at": datetime.now().isoformat()
-        }
-        
-        # Store final results
-        redis_client.hset(f"task:{task_id}", mapping=completion_data)
+        publish_task_event(task_id, "status", status="completed")
         
         print(f"✅ Enhanced crawl task {task_id} completed successfully")
         return {"task_id": task_id, "status": "completed", "pages_crawled": len(crawled_data)}
@@ -703,6 +712,7 @@ def crawl_website_enhanced(self, task_id: str, url: str, max_depth: int = 2, max
             "error": str(e),
             "failed_at": datetime.now().isoformat()
         })
+        publish_task_event(task_id, "status", status="failed", error=str(e))
         
         raise self.retry(exc=e, countdown=60, max_retries=3)
 